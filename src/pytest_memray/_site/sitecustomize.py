@@ -0,0 +1,28 @@
+"""Track the Python processes started by a test that pytest-memray tracks.
+
+This directory is only put on the PYTHONPATH of those processes, while the
+test runs with --memray-follow-children.
+"""
+
+import importlib
+import os
+import sys
+
+if os.environ.get("PYTEST_MEMRAY_CHILD_CAPTURE"):  # pragma: no cover
+    try:
+        from pytest_memray.children import track_this_process
+    except ImportError:
+        # A different interpreter, which pytest-memray isn't installed for.
+        pass
+    else:
+        track_this_process()
+
+# Let the sitecustomize module that this one shadows run too, if there is one.
+_here = os.path.dirname(os.path.abspath(__file__))
+sys.path[:] = [path for path in sys.path if os.path.abspath(path or ".") != _here]
+_this = sys.modules.pop(__name__)
+try:  # pragma: no cover
+    importlib.import_module(__name__)
+except ImportError:  # pragma: no cover
+    # The import of this module still expects to find it there.
+    sys.modules[__name__] = _this
@@ -0,0 +1,83 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Iterable
+from typing import Optional
+from typing import Tuple
+
+from pytest import Config
+from pytest import StashKey
+
+Frame = Tuple[str, str, int]
+
+# Directories that hold installed packages. Files inside them are never
+# first-party, even if a project root contains them (e.g. a local virtualenv).
+_THIRD_PARTY_DIRS = frozenset({"site-packages", "dist-packages"})
+
+
+class ProjectRoots:
+    """Tell the source files of the project apart from everything else.
+
+    The roots are compiled into a tuple of path prefixes, and the answer for
+    each file name is cached, since the same frames show up in the stacks of
+    most allocations. Both are compared with their symlinks resolved, as
+    either can be reached through one (e.g. /var and /private/var on macOS).
+    """
+
+    def __init__(self, roots: Iterable[Path]) -> None:
+        self.roots = tuple(sorted({os.path.realpath(root) for root in roots}))
+        self._prefixes = tuple(os.path.join(root, "") for root in self.roots)
+        self._owned: dict[str, bool] = {}
+
+    def owns(self, filename: str) -> bool:
+        """Return whether the given source file belongs to the project."""
+        owned = self._owned.get(filename)
+        if owned is None:
+            path = os.path.realpath(filename)
+            owned = False
+            for prefix in self._prefixes:
+                if path.startswith(prefix):
+                    relative_parts = path[len(prefix) :].split(os.sep)
+                    owned = _THIRD_PARTY_DIRS.isdisjoint(relative_parts)
+                    break
+            self._owned[filename] = owned
+        return owned
+
+    def first_party_frame(self, stack_trace: Iterable[Frame]) -> Optional[Frame]:
+        """Return the innermost frame of the stack that runs project code."""
+        for frame in stack_trace:
+            if self.owns(frame[1]):
+                return frame
+        return None
+
+
+_CONFIGURED_ROOTS = StashKey[Optional[ProjectRoots]]()
+_DEFAULT_ROOTS = StashKey[ProjectRoots]()
+
+
+def project_roots(config: Config) -> Optional[ProjectRoots]:
+    """Return the project roots given in the options, if any."""
+    if _CONFIGURED_ROOTS not in config.stash:
+        paths = config.getvalue("memray_project_root")
+        if not paths:
+            paths = config.getini("memray_project_roots")
+        config.stash[_CONFIGURED_ROOTS] = ProjectRoots(paths) if paths else None
+    return config.stash[_CONFIGURED_ROOTS]
+
+
+def project_roots_or_rootdir(config: Config) -> ProjectRoots:
+    """Return the configured project roots, or pytest's rootdir if none were."""
+    roots = project_roots(config)
+    if roots is not None:
+        return roots
+    if _DEFAULT_ROOTS not in config.stash:
+        config.stash[_DEFAULT_ROOTS] = ProjectRoots([config.rootpath])
+    return config.stash[_DEFAULT_ROOTS]
+
+
+__all__ = [
+    "ProjectRoots",
+    "project_roots",
+    "project_roots_or_rootdir",
+]
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import atexit
+import os
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator
+
+# Where a spawned Python process writes its capture (with its pid appended),
+# and how it should be tracked. Both are read by the sitecustomize module in
+# _site, which is put first on the PYTHONPATH of the processes a test starts.
+CAPTURE_ENV = "PYTEST_MEMRAY_CHILD_CAPTURE"
+OPTIONS_ENV = "PYTEST_MEMRAY_CHILD_OPTIONS"
+
+_SITE_DIR = Path(__file__).parent / "_site"
+
+
+@contextmanager
+def tracking_spawned_children(
+    result_file: Path, native: bool, trace_python_allocators: bool
+) -> Generator[None, None, None]:
+    """Make the Python processes started inside track their own memory.
+
+    Each one writes a capture next to *result_file*, named after it with the
+    pid of the process appended, like memray names the captures of the
+    processes forked by a tracker that follows forks.
+    """
+    saved = {name: os.environ.get(name) for name in (CAPTURE_ENV, OPTIONS_ENV)}
+    saved["PYTHONPATH"] = os.environ.get("PYTHONPATH")
+    options = [
+        name
+        for name, enabled in (
+            ("native", native),
+            ("trace_python_allocators", trace_python_allocators),
+        )
+        if enabled
+    ]
+    os.environ[CAPTURE_ENV] = str(result_file)
+    os.environ[OPTIONS_ENV] = ",".join(options)
+    os.environ["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [str(_SITE_DIR), saved["PYTHONPATH"]])
+    )
+    try:
+        yield
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def track_this_process() -> None:  # pragma: no cover (runs in the children)
+    """Track this process until it exits, if a tracked test started it."""
+    base = os.environ.get(CAPTURE_ENV)
+    if not base:
+        return
+    from memray import FileFormat
+    from memray import Tracker
+
+    options = os.environ.get(OPTIONS_ENV, "").split(",")
+    # Captures in this format are written as the process runs, so they can be
+    # read even if it is killed, or is still running when the test ends.
+    tracker = Tracker(
+        f"{base}.{os.getpid()}",
+        native_traces="native" in options,
+        trace_python_allocators="trace_python_allocators" in options,
+        follow_fork=True,
+        file_format=FileFormat.ALL_ALLOCATIONS,
+    )
+    tracker.__enter__()
+    atexit.register(tracker.__exit__, None, None, None)
+
+
+def child_captures(result_file: Path) -> dict[int, Path]:
+    """Return the captures of the processes started by a test, by their pid."""
+    captures = {}
+    for path in result_file.parent.glob(f"{result_file.name}.*"):
+        pid = path.name[len(result_file.name) + 1 :]
+        if pid.isdigit():
+            captures[int(pid)] = path
+    return captures
+
+
+def child_peaks(result_file: Path) -> dict[int, int]:
+    """Return the peak memory of each process started by a test, by its pid."""
+    from memray import FileReader
+
+    peaks = {}
+    for pid, path in sorted(child_captures(result_file).items()):
+        try:
+            peaks[pid] = FileReader(path).metadata.peak_memory
+        except OSError:
+            # The process was killed before it wrote anything.
+            continue
+    return peaks
+
+
+__all__ = [
+    "CAPTURE_ENV",
+    "OPTIONS_ENV",
+    "child_captures",
+    "child_peaks",
+    "track_this_process",
+    "tracking_spawned_children",
+]
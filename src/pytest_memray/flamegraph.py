@@ -0,0 +1,127 @@
+from __future__ import annotations
+
+import collections
+import html
+import zlib
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+from typing import Iterable
+from typing import Mapping
+from typing import Tuple
+
+from .utils import sizeof_fmt
+
+Frame = Tuple[str, str, int]
+
+# Frame name used for allocations with no Python stack at all.
+UNKNOWN_FRAME = "<unknown>"
+
+_WIDTH = 1200
+_ROW_HEIGHT = 16
+_CHAR_WIDTH = 7
+# Don't draw frames narrower than this many pixels.
+_MIN_WIDTH = 0.5
+
+
+def fold_stack(stack_trace: Iterable[Frame]) -> str:
+    """Return the collapsed-stack representation of a stack, root first."""
+    frames = [f"{function} ({file}:{line})" for function, file, line in stack_trace]
+    if not frames:
+        return UNKNOWN_FRAME
+    return ";".join(reversed(frames))
+
+
+def write_collapsed(stacks: Mapping[str, int], path: Path) -> None:
+    """Write stacks in the collapsed format understood by most flame graph tools."""
+    with open(path, "w", encoding="utf-8") as file:
+        for stack, size in sorted(stacks.items()):
+            file.write(f"{stack} {size}\n")
+
+
+def read_collapsed(path: Path) -> collections.Counter[str]:
+    """Read back stacks written by `write_collapsed`."""
+    stacks: collections.Counter[str] = collections.Counter()
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            stack, _, size = line.rstrip("\n").rpartition(" ")
+            stacks[stack] += int(size)
+    return stacks
+
+
+@dataclass
+class _Node:
+    name: str
+    value: int = 0
+    children: dict[str, _Node] = field(default_factory=dict)
+
+
+def _build_tree(stacks: Mapping[str, int]) -> _Node:
+    root = _Node("all")
+    for stack, size in stacks.items():
+        root.value += size
+        node = root
+        for name in stack.split(";"):
+            node = node.children.setdefault(name, _Node(name))
+            node.value += size
+    return root
+
+
+def _color(name: str) -> str:
+    # Hash the name so that the same frame gets the same color everywhere.
+    seed = zlib.crc32(name.encode("utf-8"))
+    return f"rgb(230,{100 + seed % 110},{seed // 110 % 60})"
+
+
+def write_html(stacks: Mapping[str, int], path: Path, title: str) -> None:
+    """Write a self-contained HTML page with a flame graph of the stacks.
+
+    The flame graph is drawn as an inline SVG, so it needs neither scripts
+    nor network access to be displayed.
+    """
+    root = _build_tree(stacks)
+    scale = _WIDTH / root.value if root.value else 0.0
+    rects = []
+    max_depth = 0
+    pending = [(root, 0.0, 0)]
+    while pending:
+        node, x, depth = pending.pop()
+        width = node.value * scale
+        if width < _MIN_WIDTH:
+            continue
+        max_depth = max(max_depth, depth)
+        label = f"{node.name} ({sizeof_fmt(node.value)})"
+        text = node.name[: int(width // _CHAR_WIDTH)]
+        y = depth * _ROW_HEIGHT
+        rects.append(
+            f"<g><title>{html.escape(label)}</title>"
+            f'<rect x="{x:.1f}" y="{y}" width="{width:.1f}" '
+            f'height="{_ROW_HEIGHT - 1}" fill="{_color(node.name)}"/>'
+            f'<text x="{x + 2:.1f}" y="{y + _ROW_HEIGHT - 4}">'
+            f"{html.escape(text)}</text></g>"
+        )
+        child_x = x
+        for child in sorted(node.children.values(), key=lambda c: c.name):
+            pending.append((child, child_x, depth + 1))
+            child_x += child.value * scale
+
+    height = (max_depth + 1) * _ROW_HEIGHT
+    page = (
+        "<!DOCTYPE html>\n"
+        '<html><head><meta charset="utf-8">'
+        f"<title>{html.escape(title)}</title></head><body>"
+        f"<h1>{html.escape(title)}</h1>"
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{_WIDTH}" '
+        f'height="{height}" font-family="monospace" font-size="11">'
+        + "".join(rects)
+        + "</svg></body></html>\n"
+    )
+    path.write_text(page, encoding="utf-8")
+
+
+__all__ = [
+    "fold_stack",
+    "read_collapsed",
+    "write_collapsed",
+    "write_html",
+]
@@ -0,0 +1,170 @@
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from dataclasses import field
+from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Mapping
+from typing import Tuple
+
+if TYPE_CHECKING:
+    from memray import AllocationRecord
+
+CallSite = Tuple[str, str, int]
+
+# How many call sites per test to keep in the index. Only the biggest ones are
+# interesting when looking for what grew, and keeping all of them would make
+# the index of a big suite needlessly large.
+MAX_INDEXED_CALL_SITES = 20
+INDEX_VERSION = 1
+
+
+@dataclass
+class IndexEntry:
+    """What the index records about one test."""
+
+    peak_memory: int
+    call_sites: Dict[CallSite, int]
+    files: List[str] = field(default_factory=list)
+
+
+Index = Dict[str, IndexEntry]
+
+
+@dataclass
+class PeakChange:
+    """How the peak memory of a test changed between two runs."""
+
+    test_id: str
+    old_peak: int
+    new_peak: int
+    grown_call_sites: List[Tuple[CallSite, int]]
+
+    @property
+    def delta(self) -> int:
+        return self.new_peak - self.old_peak
+
+
+def high_watermark_call_sites(
+    records: Iterable[AllocationRecord],
+) -> dict[CallSite, int]:
+    """Return the memory at the high watermark held by the biggest call sites.
+
+    Call sites are identified by the innermost frame of the stack, so that
+    they can be matched between runs.
+    """
+    call_sites: dict[CallSite, int] = {}
+    for record in records:
+        stack_trace = record.stack_trace(max_stacks=1)
+        if not stack_trace:
+            continue
+        call_sites[stack_trace[0]] = call_sites.get(stack_trace[0], 0) + record.size
+    biggest = sorted(call_sites.items(), key=lambda item: item[1], reverse=True)
+    return dict(biggest[:MAX_INDEXED_CALL_SITES])
+
+
+def high_watermark_files(records: Iterable[AllocationRecord]) -> list[str]:
+    """Return every source file in the stacks of the given records."""
+    files: set[str] = set()
+    for record in records:
+        files.update(file for _, file, _ in record.stack_trace())
+    return sorted(files)
+
+
+def tests_touching(index: Index, changed_files: Iterable[Path]) -> set[str]:
+    """Return the tests whose high watermark stacks run code in any given file."""
+    tests_by_file: dict[str, set[str]] = {}
+    for test_id, entry in index.items():
+        for file in entry.files:
+            tests_by_file.setdefault(file, set()).add(test_id)
+    selected: set[str] = set()
+    for changed_file in changed_files:
+        selected.update(tests_by_file.get(str(changed_file), ()))
+    return selected
+
+
+def write_index(path: Path, index: Mapping[str, IndexEntry]) -> None:
+    tests = {
+        test_id: {
+            "peak_memory": entry.peak_memory,
+            "call_sites": [
+                [function, file, line, size]
+                for (function, file, line), size in entry.call_sites.items()
+            ],
+            "files": entry.files,
+        }
+        for test_id, entry in index.items()
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump({"version": INDEX_VERSION, "tests": tests}, file)
+
+
+def read_index(path: Path) -> Index:
+    """Read an index written by `write_index`.
+
+    *path* can be the index file itself or a directory containing exactly
+    one index file.
+    """
+    if path.is_dir():
+        candidates = sorted(path.glob("*index.json"))
+        if len(candidates) != 1:
+            raise ValueError(
+                f"expected exactly one memray index in {path}, "
+                f"found {len(candidates)}"
+            )
+        path = candidates[0]
+    with open(path, encoding="utf-8") as file:
+        data = json.load(file)
+    if data.get("version") != INDEX_VERSION:
+        raise ValueError(f"unsupported memray index version in {path}")
+    return {
+        test_id: IndexEntry(
+            peak_memory=entry["peak_memory"],
+            call_sites={
+                (function, file, line): size
+                for function, file, line, size in entry["call_sites"]
+            },
+            files=entry.get("files", []),
+        )
+        for test_id, entry in data["tests"].items()
+    }
+
+
+def diff_indexes(old: Index, new: Index) -> list[PeakChange]:
+    """Compare the tests present in both indexes.
+
+    Only tests whose peak memory changed are returned, sorted by how much it
+    changed, biggest change first.
+    """
+    changes = []
+    for test_id, new_entry in new.items():
+        old_entry = old.get(test_id)
+        if old_entry is None or old_entry.peak_memory == new_entry.peak_memory:
+            continue
+        grown = [
+            (call_site, size - old_entry.call_sites.get(call_site, 0))
+            for call_site, size in new_entry.call_sites.items()
+            if size > old_entry.call_sites.get(call_site, 0)
+        ]
+        grown.sort(key=lambda item: item[1], reverse=True)
+        changes.append(
+            PeakChange(test_id, old_entry.peak_memory, new_entry.peak_memory, grown)
+        )
+    changes.sort(key=lambda change: abs(change.delta), reverse=True)
+    return changes
+
+
+__all__ = [
+    "IndexEntry",
+    "PeakChange",
+    "diff_indexes",
+    "high_watermark_call_sites",
+    "high_watermark_files",
+    "read_index",
+    "tests_touching",
+    "write_index",
+]
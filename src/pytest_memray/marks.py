@@ -1,21 +1,42 @@
 from __future__ import annotations
 
+import collections
+import functools
+import gc
+import itertools
+import math
+import random
+import sys
 from dataclasses import dataclass
+from dataclasses import field
 from pathlib import Path
+from typing import TYPE_CHECKING
+from typing import Callable
 from typing import Iterable
+from typing import Mapping
 from typing import Optional
 from typing import Protocol
 from typing import Tuple
 from typing import cast
 
-from memray import AllocationRecord
-from memray import FileReader
 from pytest import Config
 
+from .attribution import ProjectRoots
+from .attribution import project_roots
+from .attribution import project_roots_or_rootdir
+from .retention import find_retention_path
+from .retention import format_retention_path
 from .utils import parse_memory_string
+from .utils import parse_rate_string
 from .utils import sizeof_fmt
 from .utils import value_or_ini
 
+if TYPE_CHECKING:
+    # memray is only imported once something needs to be tracked or read.
+    from memray import AllocationRecord
+    from memray import FileReader
+    from memray import MemorySnapshot
+
 PytestSection = Tuple[str, str]
 
 
@@ -90,6 +111,285 @@ class LeakedObjectsFilterFunction(Protocol):
         ...
 
 
+# How many threads, and how many allocation sites per thread, to show in a
+# per-thread breakdown.
+_MAX_REPORTED_THREADS = 10
+_MAX_REPORTED_THREAD_SITES = 3
+
+# How limit_memory can combine the peak memory of the processes started by a
+# test with the memory of the test's own process.
+_PROCESS_AGGREGATES = ("sum", "max")
+
+
+@dataclass
+class _ThreadUsage:
+    """Memory attributed to a single thread of a tracked test."""
+
+    tid: int
+    name: str
+    total_memory: int
+    n_allocations: int
+    allocations: list[AllocationRecord]
+
+    @property
+    def label(self) -> str:
+        return f"thread {self.tid} ({self.name})" if self.name else f"thread {self.tid}"
+
+
+def _group_by_thread(
+    records: Iterable[AllocationRecord], main_thread_id: int
+) -> list[_ThreadUsage]:
+    """Group records that were read with ``merge_threads=False`` by thread.
+
+    The returned threads are sorted by the memory attributed to them, biggest
+    first, and each thread's allocations are sorted the same way.
+    """
+    threads: dict[int, _ThreadUsage] = {}
+    for record in records:
+        usage = threads.get(record.tid)
+        if usage is None:
+            name = record.thread_name
+            if not name and record.tid == main_thread_id:
+                name = "MainThread"
+            usage = threads[record.tid] = _ThreadUsage(record.tid, name, 0, 0, [])
+        usage.total_memory += record.size
+        usage.n_allocations += record.n_allocations
+        usage.allocations.append(record)
+    for usage in threads.values():
+        usage.allocations.sort(key=lambda r: r.size, reverse=True)
+    return sorted(threads.values(), key=lambda t: t.total_memory, reverse=True)
+
+
+# Identifies the coroutine an asyncio task was created for, as a
+# ``(function name, file name)`` pair that can be matched against stack frames.
+TaskCoroutine = Tuple[str, str]
+
+
+@dataclass
+class _TaskUsage:
+    """Memory attributed to the asyncio tasks running one coroutine."""
+
+    coroutine: Optional[TaskCoroutine]
+    task_names: list[str]
+    total_memory: int
+    n_allocations: int
+
+    @property
+    def label(self) -> str:
+        if self.coroutine is None:
+            return "(outside of any task)"
+        function, file = self.coroutine
+        names = ", ".join(self.task_names[:_MAX_REPORTED_THREAD_SITES])
+        if len(self.task_names) > _MAX_REPORTED_THREAD_SITES:
+            names += ", ..."
+        return f"{function}:{file} ({len(self.task_names)} task(s): {names})"
+
+
+def _group_by_task(
+    records: Iterable[AllocationRecord], tasks: dict[TaskCoroutine, list[str]]
+) -> list[_TaskUsage]:
+    """Attribute records to the asyncio task that made them.
+
+    A task's call stack starts at the coroutine it was created for, so the
+    outermost frame that matches one of the known task coroutines identifies
+    the task. Tasks running the same coroutine can't be told apart from their
+    stacks alone, so they are reported together.
+    """
+    usages: dict[Optional[TaskCoroutine], _TaskUsage] = {}
+    for record in records:
+        owner: Optional[TaskCoroutine] = None
+        for function, file, _ in reversed(record.stack_trace()):
+            if (function, file) in tasks:
+                owner = (function, file)
+                break
+        usage = usages.get(owner)
+        if usage is None:
+            names = tasks[owner] if owner is not None else []
+            usage = usages[owner] = _TaskUsage(owner, names, 0, 0)
+        usage.total_memory += record.size
+        usage.n_allocations += record.n_allocations
+    return sorted(usages.values(), key=lambda t: t.total_memory, reverse=True)
+
+
+# The allocator kinds that a breakdown or a limit can refer to, and the
+# names of the memray allocator types that each of them covers.
+ALLOCATOR_KINDS: dict[str, frozenset[str]] = {
+    "malloc": frozenset(
+        {
+            "MALLOC",
+            "CALLOC",
+            "REALLOC",
+            "POSIX_MEMALIGN",
+            "ALIGNED_ALLOC",
+            "MEMALIGN",
+            "VALLOC",
+            "PVALLOC",
+        }
+    ),
+    "mmap": frozenset({"MMAP"}),
+    "pymalloc": frozenset({"PYMALLOC_MALLOC", "PYMALLOC_CALLOC", "PYMALLOC_REALLOC"}),
+}
+
+
+@functools.lru_cache(maxsize=None)
+def _kind_of_allocator() -> dict[int, str]:
+    from memray import AllocatorType
+
+    return {
+        AllocatorType[name]: kind
+        for kind, names in ALLOCATOR_KINDS.items()
+        for name in names
+    }
+
+
+def _allocator_kind(record: AllocationRecord) -> str:
+    return _kind_of_allocator().get(record.allocator, "other")
+
+
+def _parse_allocator_kinds(kinds: Iterable[str]) -> frozenset[str]:
+    """Validate the allocator kinds given to a marker."""
+    if isinstance(kinds, str):
+        kinds = [kinds]
+    parsed = frozenset(kinds)
+    unknown = sorted(parsed - ALLOCATOR_KINDS.keys())
+    if unknown:
+        raise ValueError(
+            f"Unknown allocator kind(s) {', '.join(map(repr, unknown))}, "
+            f"expected some of {', '.join(map(repr, ALLOCATOR_KINDS))}"
+        )
+    return parsed
+
+
+@dataclass
+class _AllocatorUsage:
+    """Memory attributed to one kind of allocator."""
+
+    kind: str
+    total_memory: int
+    n_allocations: int
+
+
+def _group_by_allocator(records: Iterable[AllocationRecord]) -> list[_AllocatorUsage]:
+    """Aggregate records by allocator kind, biggest first."""
+    usages: dict[str, _AllocatorUsage] = {}
+    for record in records:
+        kind = _allocator_kind(record)
+        usage = usages.get(kind)
+        if usage is None:
+            usage = usages[kind] = _AllocatorUsage(kind, 0, 0)
+        usage.total_memory += record.size
+        usage.n_allocations += record.n_allocations
+    return sorted(usages.values(), key=lambda u: u.total_memory, reverse=True)
+
+
+def _generate_allocator_breakdown_text(allocators: list[_AllocatorUsage]) -> str:
+    padding = " " * 4
+    text_lines = ["Per-allocator breakdown:"]
+    for usage in allocators:
+        text_lines.append(
+            f"{padding}- {usage.kind}: {sizeof_fmt(usage.total_memory)} "
+            f"in {usage.n_allocations} allocation(s)"
+        )
+    return "\n".join(text_lines)
+
+
+# How many first-party functions to show in a breakdown.
+_MAX_REPORTED_OWNERS = 10
+
+
+@dataclass
+class _OwnerUsage:
+    """Memory attributed to the innermost first-party frame of its stacks."""
+
+    frame: Optional[Tuple[str, str, int]]
+    total_memory: int
+    n_allocations: int
+
+    @property
+    def label(self) -> str:
+        if self.frame is None:
+            return "(no first-party frame)"
+        function, file, line = self.frame
+        return f"{function}:{file}:{line}"
+
+
+def _group_by_owner(
+    records: Iterable[AllocationRecord], roots: Optional[ProjectRoots]
+) -> list[_OwnerUsage]:
+    """Attribute records to the innermost frame of their stack in project code.
+
+    Nothing is attributed if no project roots were given.
+    """
+    if roots is None:
+        return []
+    usages: dict[Optional[Tuple[str, str, int]], _OwnerUsage] = {}
+    for record in records:
+        frame = roots.first_party_frame(record.stack_trace())
+        usage = usages.get(frame)
+        if usage is None:
+            usage = usages[frame] = _OwnerUsage(frame, 0, 0)
+        usage.total_memory += record.size
+        usage.n_allocations += record.n_allocations
+    return sorted(usages.values(), key=lambda u: u.total_memory, reverse=True)
+
+
+def _generate_owner_breakdown_text(owners: list[_OwnerUsage]) -> str:
+    padding = " " * 4
+    text_lines = ["Per-function breakdown of first-party code:"]
+    for usage in owners[:_MAX_REPORTED_OWNERS]:
+        text_lines.append(
+            f"{padding}- {usage.label}: {sizeof_fmt(usage.total_memory)} "
+            f"in {usage.n_allocations} allocation(s)"
+        )
+    if len(owners) > _MAX_REPORTED_OWNERS:
+        extra = len(owners) - _MAX_REPORTED_OWNERS
+        text_lines.append(f"{padding}...and {extra} more functions")
+    return "\n".join(text_lines)
+
+
+def _generate_thread_breakdown_text(
+    threads: list[_ThreadUsage], native_stacks: bool
+) -> str:
+    padding = " " * 4
+    text_lines = ["Per-thread breakdown:"]
+    for usage in threads[:_MAX_REPORTED_THREADS]:
+        text_lines.append(
+            f"{padding}- {usage.label}: {sizeof_fmt(usage.total_memory)} "
+            f"in {usage.n_allocations} allocation(s)"
+        )
+        for record in usage.allocations[:_MAX_REPORTED_THREAD_SITES]:
+            stack_trace = (
+                record.hybrid_stack_trace() if native_stacks else record.stack_trace()
+            )
+            if not stack_trace:
+                continue
+            function, file, line = stack_trace[0]
+            text_lines.append(
+                f"{padding*2}{function}:{file}:{line} -> {sizeof_fmt(record.size)}"
+            )
+    if len(threads) > _MAX_REPORTED_THREADS:
+        extra = len(threads) - _MAX_REPORTED_THREADS
+        text_lines.append(f"{padding}...and {extra} more threads")
+    return "\n".join(text_lines)
+
+
+def _generate_process_breakdown_text(
+    own_memory: int, child_peaks: dict[int, int]
+) -> str:
+    padding = " " * 4
+    text_lines = [
+        "Per-process breakdown:",
+        f"{padding}- test process: {sizeof_fmt(own_memory)}",
+    ]
+    largest = sorted(child_peaks.items(), key=lambda child: child[1], reverse=True)
+    for pid, peak in largest[:_MAX_REPORTED_THREADS]:
+        text_lines.append(f"{padding}- child process {pid}: {sizeof_fmt(peak)}")
+    if len(largest) > _MAX_REPORTED_THREADS:
+        extra = len(largest) - _MAX_REPORTED_THREADS
+        text_lines.append(f"{padding}...and {extra} more processes")
+    return "\n".join(text_lines)
+
+
 @dataclass
 class _MemoryInfo:
     """Type that holds memory-related info for a failed test."""
@@ -100,6 +400,20 @@ class _MemoryInfo:
     native_stacks: bool
     total_allocated_memory: int
     verbosity: int
+    threads: list[_ThreadUsage] = field(default_factory=list)
+    thread_limit: Optional[float] = None
+    allocators: list[_AllocatorUsage] = field(default_factory=list)
+    # The allocator kinds the limit applies to, if not all of them.
+    allocator_kinds: Optional[frozenset[str]] = None
+    owners: list[_OwnerUsage] = field(default_factory=list)
+    first_party_only: bool = False
+    # Whether the test was stopped while it ran, as it used far too much.
+    stopped_early: bool = False
+    # The peak memory of the processes started by the test, by their pid, and
+    # how they count towards the limit along with the test's own process.
+    child_peaks: dict[int, int] = field(default_factory=dict)
+    processes: str = "sum"
+    own_memory: int = 0
 
     @property
     def section(self) -> Optional[PytestSection]:
@@ -115,18 +429,58 @@ class _MemoryInfo:
         remaining = len(self.allocations) - len(allocations)
         if remaining > 0:
             body += f"\n    ...and {remaining} more"
-        return (
-            "memray-max-memory",
-            "List of allocations:\n" + body,
-        )
+        text = "List of allocations:\n" + body
+        if len(self.allocators) > 1 or self.allocator_kinds is not None:
+            text += "\n\n" + _generate_allocator_breakdown_text(self.allocators)
+        if self.owners:
+            text += "\n\n" + _generate_owner_breakdown_text(self.owners)
+        if len(self.threads) > 1 or self.thread_limit is not None:
+            text += "\n\n" + _generate_thread_breakdown_text(
+                self.threads, self.native_stacks
+            )
+        if self.child_peaks:
+            text += "\n\n" + _generate_process_breakdown_text(
+                self.own_memory, self.child_peaks
+            )
+        return ("memray-max-memory", text)
 
     @property
     def long_repr(self) -> str:
         """Generate a longrepr user-facing error message."""
-        return (
-            f"Test was limited to {sizeof_fmt(self.max_memory)} "
-            f"but allocated {sizeof_fmt(self.total_allocated_memory)}"
-        )
+        if (
+            self.thread_limit is not None
+            and self.total_allocated_memory < self.max_memory
+        ):
+            worst = self.threads[0]
+            return (
+                f"Test was limited to {sizeof_fmt(self.thread_limit)} per thread "
+                f"but {worst.label} allocated {sizeof_fmt(worst.total_memory)}"
+            )
+        kinds = ""
+        if self.allocator_kinds is not None:
+            kinds = f" of {'/'.join(sorted(self.allocator_kinds))} memory"
+        if self.first_party_only:
+            kinds += " in first-party code"
+        if self.child_peaks and self.processes == "max":
+            pid, peak = max(self.child_peaks.items(), key=lambda child: child[1])
+            culprit = "the test process"
+            if peak > self.own_memory:
+                culprit = f"child process {pid}"
+            message = (
+                f"Test was limited to {sizeof_fmt(self.max_memory)}{kinds} per "
+                f"process but {culprit} allocated "
+                f"{sizeof_fmt(self.total_allocated_memory)}"
+            )
+        else:
+            message = (
+                f"Test was limited to {sizeof_fmt(self.max_memory)}{kinds} "
+                f"but allocated {sizeof_fmt(self.total_allocated_memory)}"
+            )
+            if self.child_peaks:
+                message += f" across {len(self.child_peaks) + 1} processes"
+        if self.stopped_early:
+            message += " before it was stopped"
+        return message
 
 
 @dataclass
@@ -137,24 +491,48 @@ class _LeakedInfo:
     allocations: list[AllocationRecord]
     num_stacks: int
     native_stacks: bool
+    threads: list[_ThreadUsage] = field(default_factory=list)
+    # How much each allocation leaked per iteration, when the test was repeated.
+    leak_rates: Optional[list[int]] = None
+    allocators: list[_AllocatorUsage] = field(default_factory=list)
+    owners: list[_OwnerUsage] = field(default_factory=list)
 
     @property
     def section(self) -> PytestSection:
         """Return a tuple in the format expected by section reporters."""
-        body = _generate_section_text(
-            self.allocations, self.native_stacks, self.num_stacks
-        )
-        return (
-            "memray-leaked-memory",
-            "List of leaked allocations:\n" + body,
-        )
+        if self.leak_rates is None:
+            body = _generate_section_text(
+                self.allocations, self.native_stacks, self.num_stacks
+            )
+        else:
+            body = "\n".join(
+                line
+                for record, rate in zip(self.allocations, self.leak_rates)
+                for line in _format_stack(
+                    record,
+                    f"{sizeof_fmt(rate)} leaked here per iteration",
+                    self.native_stacks,
+                    self.num_stacks,
+                )
+            )
+        text = "List of leaked allocations:\n" + body
+        if len(self.allocators) > 1:
+            text += "\n\n" + _generate_allocator_breakdown_text(self.allocators)
+        if self.owners:
+            text += "\n\n" + _generate_owner_breakdown_text(self.owners)
+        if len(self.threads) > 1:
+            text += "\n\n" + _generate_thread_breakdown_text(
+                self.threads, self.native_stacks
+            )
+        return ("memray-leaked-memory", text)
 
     @property
     def long_repr(self) -> str:
         """Generate a longrepr user-facing error message."""
+        per_iteration = " per iteration" if self.leak_rates is not None else ""
         return (
             f"Test was allowed to leak {sizeof_fmt(self.max_memory)} "
-            "per location but at least one location leaked more"
+            f"per location{per_iteration} but at least one location leaked more"
         )
 
 
@@ -186,24 +564,36 @@ def _generate_section_text(
     text_lines = []
     for record in allocations:
         size = record.size
-        stack_trace = (
-            record.hybrid_stack_trace() if native_stacks else record.stack_trace()
+        text_lines.extend(
+            _format_stack(
+                record,
+                f"{sizeof_fmt(size)} allocated here",
+                native_stacks,
+                num_stacks,
+            )
         )
-        if not stack_trace:
-            continue
-        padding = " " * 4
-        text_lines.append(f"{padding}- {sizeof_fmt(size)} allocated here:")
-        stacks_left = num_stacks
-        for function, file, line in stack_trace:
-            if stacks_left <= 0:
-                text_lines.append(f"{padding*2}...")
-                break
-            text_lines.append(f"{padding*2}{function}:{file}:{line}")
-            stacks_left -= 1
 
     return "\n".join(text_lines)
 
 
+def _format_stack(
+    record: AllocationRecord, header: str, native_stacks: bool, num_stacks: int
+) -> list[str]:
+    stack_trace = record.hybrid_stack_trace() if native_stacks else record.stack_trace()
+    if not stack_trace:
+        return []
+    padding = " " * 4
+    text_lines = [f"{padding}- {header}:"]
+    stacks_left = num_stacks
+    for function, file, line in stack_trace:
+        if stacks_left <= 0:
+            text_lines.append(f"{padding*2}...")
+            break
+        text_lines.append(f"{padding*2}{function}:{file}:{line}")
+        stacks_left -= 1
+    return text_lines
+
+
 def _passes_filter(
     stack: Iterable[Tuple[str, str, int]], filter_fn: Optional[LeaksFilterFunction]
 ) -> bool:
@@ -214,25 +604,103 @@ def _passes_filter(
     return filter_fn(Stack(frames))
 
 
+def _thread_usage(
+    reader: FileReader,
+    *,
+    leaked: bool,
+    current_thread_only: bool,
+    allocator_kinds: Optional[frozenset[str]] = None,
+) -> list[_ThreadUsage]:
+    main_thread_id = reader.metadata.main_thread_id
+    get_records = (
+        reader.get_leaked_allocation_records
+        if leaked
+        else reader.get_high_watermark_allocation_records
+    )
+    return _group_by_thread(
+        (
+            record
+            for record in get_records(merge_threads=False)
+            if (not current_thread_only or record.tid == main_thread_id)
+            and (allocator_kinds is None or _allocator_kind(record) in allocator_kinds)
+        ),
+        main_thread_id,
+    )
+
+
 def limit_memory(
     limit: str,
     *,
     current_thread_only: bool = False,
+    thread_limit: Optional[str] = None,
+    allocators: Optional[Iterable[str]] = None,
+    first_party_only: bool = False,
+    abort_at: Optional[float] = None,
+    check_interval: float = 0.1,
+    processes: str = "sum",
+    _stopped_early: bool = False,
+    _child_peaks: Optional[Mapping[int, int]] = None,
     _result_file: Path,
     _config: Config,
     _test_id: str,
 ) -> _MemoryInfo | _MoreMemoryInfo | None:
     """Limit memory used by the test."""
+    from memray import FileReader
+
+    if processes not in _PROCESS_AGGREGATES:
+        raise ValueError(
+            f"Unknown processes {processes!r}, "
+            f"expected one of {', '.join(map(repr, _PROCESS_AGGREGATES))}"
+        )
+
+    allocator_kinds = (
+        _parse_allocator_kinds(allocators) if allocators is not None else None
+    )
+    roots = (
+        project_roots_or_rootdir(_config)
+        if first_party_only
+        else project_roots(_config)
+    )
     reader = FileReader(_result_file)
-    allocations: list[AllocationRecord] = [
+    all_allocations: list[AllocationRecord] = [
         record
         for record in reader.get_high_watermark_allocation_records(
             merge_threads=not current_thread_only
         )
         if not current_thread_only or record.tid == reader.metadata.main_thread_id
     ]
+    allocations = [
+        record
+        for record in all_allocations
+        if (allocator_kinds is None or _allocator_kind(record) in allocator_kinds)
+        and (
+            roots is None
+            or not first_party_only
+            or roots.first_party_frame(record.stack_trace()) is not None
+        )
+    ]
     max_memory = parse_memory_string(limit)
-    total_allocated_memory = sum(record.size for record in allocations)
+    max_thread_memory = (
+        parse_memory_string(thread_limit) if thread_limit is not None else None
+    )
+    own_memory = sum(record.size for record in allocations)
+    # The processes started by the test are only known by their peak memory,
+    # which counts in full whatever the other arguments select.
+    child_peaks = dict(_child_peaks or {})
+    total_allocated_memory = own_memory
+    if processes == "sum":
+        total_allocated_memory += sum(child_peaks.values())
+    else:
+        total_allocated_memory = max([own_memory, *child_peaks.values()])
+
+    threads: list[_ThreadUsage] = []
+    if max_thread_memory is not None:
+        threads = _thread_usage(
+            reader,
+            leaked=False,
+            current_thread_only=current_thread_only,
+            allocator_kinds=allocator_kinds,
+        )
 
     if _config.cache is not None:
         cache = _config.cache.get(f"memray/{_test_id}", {})
@@ -244,8 +712,24 @@ def limit_memory(
         cache["total_allocated_memory"] = total_allocated_memory
         _config.cache.set(f"memray/{_test_id}", cache)
 
-    if total_allocated_memory < max_memory:
+    thread_limit_exceeded = max_thread_memory is not None and any(
+        usage.total_memory >= max_thread_memory for usage in threads
+    )
+    # A test stopped for using far too much memory fails, even if what was
+    # captured until then is still under the limit.
+    if (
+        total_allocated_memory < max_memory
+        and not thread_limit_exceeded
+        and not _stopped_early
+    ):
         return None
+    if max_thread_memory is None:
+        threads = _thread_usage(
+            reader,
+            leaked=False,
+            current_thread_only=current_thread_only,
+            allocator_kinds=allocator_kinds,
+        )
     num_stacks: int = cast(int, value_or_ini(_config, "stacks"))
     native_stacks: bool = cast(bool, value_or_ini(_config, "native"))
     return _MemoryInfo(
@@ -255,19 +739,106 @@ def limit_memory(
         native_stacks=native_stacks,
         total_allocated_memory=total_allocated_memory,
         verbosity=_config.get_verbosity("memray"),
+        threads=threads,
+        thread_limit=max_thread_memory,
+        allocators=_group_by_allocator(all_allocations),
+        allocator_kinds=allocator_kinds,
+        owners=_group_by_owner(allocations, roots),
+        first_party_only=first_party_only,
+        stopped_early=_stopped_early,
+        child_peaks=child_peaks,
+        processes=processes,
+        own_memory=own_memory,
     )
 
 
+def _mark_iteration() -> None:
+    """Mark the start of a new iteration of a repeated test in its capture.
+
+    The allocation made here is recognized by `_leaks_per_iteration` from its
+    stack, so that the allocations in between can be told apart.
+    """
+    bytearray(4096)
+
+
+def _is_iteration_mark(record: AllocationRecord) -> bool:
+    stack_trace = record.stack_trace(max_stacks=1)
+    return bool(stack_trace) and stack_trace[0][:2] == (
+        _mark_iteration.__name__,
+        _mark_iteration.__code__.co_filename,
+    )
+
+
+def _leaks_per_iteration(
+    reader: FileReader, repeat: int, current_thread_only: bool
+) -> list[tuple[AllocationRecord, list[int]]]:
+    """Return each leaking location with how much it leaked in each iteration.
+
+    This replays every allocation in the capture, so it needs a capture in
+    the ``ALL_ALLOCATIONS`` format.
+    """
+    from memray import AllocatorType
+
+    deallocators = {
+        AllocatorType.FREE,
+        AllocatorType.PYMALLOC_FREE,
+        AllocatorType.MUNMAP,
+    }
+    live: dict[int, tuple[AllocationRecord, int]] = {}
+    iteration = 0
+    in_mark = False
+    for record in reader.get_allocation_records():
+        if record.allocator in deallocators:
+            live.pop(record.address, None)
+        elif _is_iteration_mark(record):
+            # A mark makes more than one allocation, but counts only once.
+            iteration += not in_mark
+            in_mark = True
+            continue
+        else:
+            live[record.address] = (record, iteration)
+        in_mark = False
+
+    main_thread_id = reader.metadata.main_thread_id
+    locations: dict[tuple[int, int], tuple[AllocationRecord, list[int]]] = {}
+    for record, iteration in live.values():
+        if current_thread_only and record.tid != main_thread_id:
+            continue
+        key = (record.stack_id, record.native_stack_id)
+        _, sizes = locations.setdefault(key, (record, [0] * repeat))
+        sizes[min(iteration, repeat - 1)] += record.size
+    return list(locations.values())
+
+
 def limit_leaks(
     location_limit: str,
     *,
     filter_fn: Optional[LeaksFilterFunction] = None,
     current_thread_only: bool = False,
+    warmup: int = 0,
+    repeat: int = 1,
     _result_file: Path,
     _config: Config,
     _test_id: str,
 ) -> _LeakedInfo | None:
+    from memray import FileReader
+
+    if warmup < 0 or repeat < 1:
+        raise ValueError("limit_leaks needs a warmup >= 0 and a repeat >= 1")
     reader = FileReader(_result_file)
+    memory_limit = parse_memory_string(location_limit)
+    num_stacks: int = max(cast(int, value_or_ini(_config, "stacks")), 5)
+    if repeat > 1:
+        return _limit_repeated_leaks(
+            reader,
+            memory_limit,
+            repeat,
+            filter_fn=filter_fn,
+            current_thread_only=current_thread_only,
+            num_stacks=num_stacks,
+            roots=project_roots(_config),
+        )
+
     allocations: list[AllocationRecord] = [
         record
         for record in reader.get_leaked_allocation_records(
@@ -276,8 +847,6 @@ def limit_leaks(
         if not current_thread_only or record.tid == reader.metadata.main_thread_id
     ]
 
-    memory_limit = parse_memory_string(location_limit)
-
     leaked_allocations = list(
         allocation
         for allocation in allocations
@@ -290,12 +859,377 @@ def limit_leaks(
     if not leaked_allocations:
         return None
 
-    num_stacks: int = max(cast(int, value_or_ini(_config, "stacks")), 5)
     return _LeakedInfo(
         max_memory=memory_limit,
         allocations=leaked_allocations,
         num_stacks=num_stacks,
         native_stacks=True,
+        threads=_thread_usage(
+            reader, leaked=True, current_thread_only=current_thread_only
+        ),
+        allocators=_group_by_allocator(allocations),
+        owners=_group_by_owner(allocations, project_roots(_config)),
+    )
+
+
+def _limit_repeated_leaks(
+    reader: FileReader,
+    memory_limit: float,
+    repeat: int,
+    *,
+    filter_fn: Optional[LeaksFilterFunction],
+    current_thread_only: bool,
+    num_stacks: int,
+    roots: Optional[ProjectRoots],
+) -> _LeakedInfo | None:
+    allocations = []
+    leak_rates = []
+    for record, sizes in _leaks_per_iteration(reader, repeat, current_thread_only):
+        # Whatever the first iteration leaks may be a cache being filled, so
+        # only locations that keep leaking in every later iteration count.
+        later_sizes = sizes[1:]
+        if not all(later_sizes):
+            continue
+        rate = sum(later_sizes) // len(later_sizes)
+        if rate >= memory_limit and _passes_filter(
+            record.hybrid_stack_trace(), filter_fn
+        ):
+            allocations.append(record)
+            leak_rates.append(rate)
+
+    if not allocations:
+        return None
+
+    return _LeakedInfo(
+        max_memory=memory_limit,
+        allocations=allocations,
+        num_stacks=num_stacks,
+        native_stacks=True,
+        threads=_thread_usage(
+            reader, leaked=True, current_thread_only=current_thread_only
+        ),
+        leak_rates=leak_rates,
+        allocators=_group_by_allocator(allocations),
+        owners=_group_by_owner(allocations, roots),
+    )
+
+
+# How many memory snapshots are needed before a leak rate is trusted, and how
+# many of them to show in a leak rate report.
+_MIN_RATE_SNAPSHOTS = 10
+_MAX_REPORTED_SNAPSHOTS = 10
+
+
+def _fit_leak_rate(snapshots: list[MemorySnapshot]) -> tuple[float, float]:
+    """Fit the heap size against time.
+
+    Return the growth rate in bytes per second and its standard error.
+    """
+    times = [(snapshot.time - snapshots[0].time) / 1000 for snapshot in snapshots]
+    heaps = [snapshot.heap for snapshot in snapshots]
+    mean_time = sum(times) / len(times)
+    mean_heap = sum(heaps) / len(heaps)
+    variance = sum((t - mean_time) ** 2 for t in times)
+    if not variance:
+        return 0.0, math.inf
+    rate = sum((t - mean_time) * (h - mean_heap) for t, h in zip(times, heaps))
+    rate /= variance
+    squared_error = sum(
+        (h - mean_heap - rate * (t - mean_time)) ** 2 for t, h in zip(times, heaps)
+    )
+    return rate, math.sqrt(squared_error / (len(times) - 2) / variance)
+
+
+def _exceeded_leak_rate(
+    snapshots: list[MemorySnapshot], max_rate: float
+) -> float | None:
+    """Return the leak rate if it is clearly above *max_rate*, or None."""
+    if len(snapshots) < _MIN_RATE_SNAPSHOTS:
+        return None
+    rate, standard_error = _fit_leak_rate(snapshots)
+    # Two standard errors keep one-off jumps, like a cache being filled,
+    # from looking like a steady leak.
+    if rate - 2 * standard_error <= max_rate:
+        return None
+    return rate
+
+
+@dataclass
+class _LeakRateInfo:
+    """Type that holds leak rate info for a failed test."""
+
+    max_rate: float
+    rate: float
+    snapshots: list[MemorySnapshot]
+    stopped_early: bool
+
+    @property
+    def section(self) -> PytestSection:
+        """Return a tuple in the format expected by section reporters."""
+        step = max(1, len(self.snapshots) // _MAX_REPORTED_SNAPSHOTS)
+        start = self.snapshots[0].time
+        text_lines = [
+            f"    {(snapshot.time - start) / 1000:.1f}s: {sizeof_fmt(snapshot.heap)}"
+            for snapshot in self.snapshots[::step]
+        ]
+        return ("memray-leak-rate", "Heap size over time:\n" + "\n".join(text_lines))
+
+    @property
+    def long_repr(self) -> str:
+        """Generate a longrepr user-facing error message."""
+        message = (
+            f"Test was allowed to leak {sizeof_fmt(self.max_rate * 60)}/min "
+            f"but leaked {sizeof_fmt(self.rate * 60)}/min"
+        )
+        if self.stopped_early:
+            duration = (self.snapshots[-1].time - self.snapshots[0].time) / 1000
+            message += f" (stopped after {duration:.1f}s)"
+        return message
+
+
+def limit_leak_rate(
+    rate: str,
+    *,
+    check_interval: float = 10.0,
+    _stopped_early: bool = False,
+    _result_file: Path,
+    _config: Config,
+    _test_id: str,
+) -> _LeakRateInfo | None:
+    """Limit how fast the memory used by the test grows."""
+    from memray import FileReader
+
+    max_rate = parse_rate_string(rate)
+    snapshots = list(FileReader(_result_file).get_memory_snapshots())
+    leak_rate = _exceeded_leak_rate(snapshots, max_rate)
+    if leak_rate is None and _stopped_early:
+        # The test was stopped because the rate was clearly too high while
+        # it ran, so fail even if the last few snapshots blur the fit.
+        leak_rate = _fit_leak_rate(snapshots)[0]
+    if leak_rate is None:
+        return None
+    return _LeakRateInfo(
+        max_rate=max_rate,
+        rate=leak_rate,
+        snapshots=snapshots,
+        stopped_early=_stopped_early,
+    )
+
+
+# How many call sites to show in an allocation count report.
+_MAX_REPORTED_CALL_SITES = 10
+
+
+@dataclass
+class _CallSiteCount:
+    """Number of allocations made from one call stack."""
+
+    record: AllocationRecord
+    n_allocations: int
+    total_size: int
+
+
+@dataclass
+class _AllocationCountInfo:
+    """Type that holds allocation count info for a failed test."""
+
+    max_count: Optional[int]
+    max_churn: Optional[int]
+    total_allocations: int
+    call_sites: list[_CallSiteCount]
+    num_stacks: int
+    native_stacks: bool
+
+    @property
+    def section(self) -> PytestSection:
+        """Return a tuple in the format expected by section reporters."""
+        text_lines = []
+        for site in self.call_sites[:_MAX_REPORTED_CALL_SITES]:
+            text_lines.extend(
+                _format_stack(
+                    site.record,
+                    f"{site.n_allocations} allocations "
+                    f"({sizeof_fmt(site.total_size)}) made here",
+                    self.native_stacks,
+                    self.num_stacks,
+                )
+            )
+        remaining = len(self.call_sites) - _MAX_REPORTED_CALL_SITES
+        if remaining > 0:
+            text_lines.append(f"    ...and {remaining} more")
+        return (
+            "memray-allocation-count",
+            "List of call sites by number of allocations:\n" + "\n".join(text_lines),
+        )
+
+    @property
+    def long_repr(self) -> str:
+        """Generate a longrepr user-facing error message."""
+        if self.max_count is not None and self.total_allocations > self.max_count:
+            return (
+                f"Test was limited to {self.max_count} allocations "
+                f"but made {self.total_allocations}"
+            )
+        return (
+            f"Test was limited to {self.max_churn} allocations per call site "
+            f"but one call site made {self.call_sites[0].n_allocations}"
+        )
+
+
+def _count_allocations_by_call_site(reader: FileReader) -> list[_CallSiteCount]:
+    """Count every allocation in a capture, grouped by call stack.
+
+    This needs a capture in the ``ALL_ALLOCATIONS`` format. The call sites are
+    sorted by number of allocations, most first.
+    """
+    # Every allocation is either freed before the test ends, and so shows up
+    # as a temporary allocation given a large enough threshold, or leaked.
+    # Both come back already aggregated by call stack.
+    records = itertools.chain(
+        reader.get_temporary_allocation_records(
+            merge_threads=True, threshold=sys.maxsize
+        ),
+        reader.get_leaked_allocation_records(merge_threads=True),
+    )
+    by_stack: dict[int, _CallSiteCount] = {}
+    for record in records:
+        site = by_stack.get(record.stack_id)
+        if site is None:
+            by_stack[record.stack_id] = _CallSiteCount(
+                record, record.n_allocations, record.size
+            )
+        else:
+            site.n_allocations += record.n_allocations
+            site.total_size += record.size
+    return sorted(by_stack.values(), key=lambda s: s.n_allocations, reverse=True)
+
+
+def limit_allocations(
+    count: Optional[int] = None,
+    *,
+    churn: Optional[int] = None,
+    _result_file: Path,
+    _config: Config,
+    _test_id: str,
+) -> _AllocationCountInfo | None:
+    """Limit the number of allocations made by the test."""
+    from memray import FileReader
+
+    if count is None and churn is None:
+        raise ValueError("limit_allocations needs a count or a churn limit")
+    call_sites = _count_allocations_by_call_site(FileReader(_result_file))
+    total_allocations = sum(site.n_allocations for site in call_sites)
+
+    count_exceeded = count is not None and total_allocations > count
+    churn_exceeded = (
+        churn is not None and bool(call_sites) and call_sites[0].n_allocations > churn
+    )
+    if not count_exceeded and not churn_exceeded:
+        return None
+    return _AllocationCountInfo(
+        max_count=count,
+        max_churn=churn,
+        total_allocations=total_allocations,
+        call_sites=call_sites,
+        num_stacks=cast(int, value_or_ini(_config, "stacks")),
+        native_stacks=cast(bool, value_or_ini(_config, "native")),
+    )
+
+
+# The complexities memory_scaling knows about, slowest growing first.
+_COMPLEXITIES: dict[str, tuple[str, Callable[[float], float]]] = {
+    "constant": ("O(1)", lambda n: 0.0),
+    "linear": ("O(n)", lambda n: n),
+    "nlogn": ("O(n log n)", lambda n: n * math.log(n) if n > 0 else 0.0),
+    "quadratic": ("O(n^2)", lambda n: n * n),
+}
+
+
+def _fit_error(complexity: str, peaks: list[tuple[float, int]]) -> float:
+    """Return the RMS error of the best fit of ``peak = a + b * f(n)``."""
+    _, growth = _COMPLEXITIES[complexity]
+    xs = [growth(n) for n, _ in peaks]
+    ys = [peak for _, peak in peaks]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    slope = 0.0
+    if variance:
+        # Memory never shrinks as the input grows, so don't fit a negative slope.
+        slope = max(
+            0.0, sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+        )
+    intercept = mean_y - slope * mean_x
+    squared_error = sum((y - intercept - slope * x) ** 2 for x, y in zip(xs, ys))
+    return math.sqrt(squared_error / len(peaks))
+
+
+@dataclass
+class _MemoryScalingInfo:
+    """Type that holds memory scaling info for a failed group of tests."""
+
+    param: str
+    declared: str
+    fitted: str
+    peaks: list[tuple[float, int]]
+
+    @property
+    def section(self) -> PytestSection:
+        """Return a tuple in the format expected by section reporters."""
+        text_lines = [
+            f"    {self.param}={n:g}: {sizeof_fmt(peak)}" for n, peak in self.peaks
+        ]
+        return (
+            "memray-memory-scaling",
+            f"Peak memory by {self.param}:\n" + "\n".join(text_lines),
+        )
+
+    @property
+    def long_repr(self) -> str:
+        """Generate a longrepr user-facing error message."""
+        return (
+            f"Peak memory grows as {_COMPLEXITIES[self.fitted][0]} in {self.param} "
+            f"but was declared to grow as {_COMPLEXITIES[self.declared][0]}"
+        )
+
+
+def memory_scaling(
+    param: str,
+    complexity: str = "linear",
+    *,
+    tolerance: float = 0.05,
+    _result_file: Path,
+    _config: Config,
+    _test_id: str,
+) -> _MemoryScalingInfo | None:
+    """Limit how fast peak memory grows with a parameter of the test.
+
+    Nothing can be checked from a single test: the peaks of all the
+    parametrizations are fitted once the session is over, by
+    `_fit_memory_scaling`.
+    """
+    return None
+
+
+def _fit_memory_scaling(
+    param: str, complexity: str, tolerance: float, peaks: list[tuple[float, int]]
+) -> _MemoryScalingInfo | None:
+    """Check the peaks of a group of parametrizations against a complexity.
+
+    There must be at least three distinct values of the parameter.
+    """
+    peaks = sorted(peaks)
+    errors = {name: _fit_error(name, peaks) for name in _COMPLEXITIES}
+    fitted = min(errors, key=errors.__getitem__)
+    names = list(_COMPLEXITIES)
+    # A faster growing curve always fits noise a little better, so only fail
+    # when the declared complexity fits the peaks badly.
+    if names.index(fitted) <= names.index(complexity) or errors[
+        complexity
+    ] <= tolerance * max(peak for _, peak in peaks):
+        return None
+    return _MemoryScalingInfo(
+        param=param, declared=complexity, fitted=fitted, peaks=peaks
     )
 
 
@@ -304,13 +1238,181 @@ def limit_leaks(
 _MAX_REPORTED_TYPES = 10
 _MAX_REPORTED_SAMPLES = 10
 _MAX_REPR_LEN = 100
+# How many leaked objects to walk from a single one when computing its
+# retained size. Whatever is left is accounted for on its own.
+_MAX_RETAINED_VISITS = 100_000
+
+
+def _short_repr(obj: object) -> str:  # pragma: no cover
+    try:
+        obj_repr = repr(obj)
+    except Exception:
+        obj_repr = "<repr failed>"
+    # Truncate long representations
+    if len(obj_repr) > _MAX_REPR_LEN:
+        obj_repr = obj_repr[: _MAX_REPR_LEN - 3] + "..."
+    return obj_repr
+
+
+@dataclass
+class _LeakedObjectSample:  # pragma: no cover
+    type_name: str
+    repr: str
+    # How the object is reachable, if that was asked for and could be found.
+    retention_path: Optional[str] = None
+
+
+@dataclass
+class _LeakedObjectsSummary:  # pragma: no cover
+    """What is left of the objects that survived a test once summarized.
+
+    No references to the objects themselves are kept, only their counts and
+    approximate sizes per type and a description of a few of them.
+    """
+
+    total: int = 0
+    counts: collections.Counter[str] = field(default_factory=collections.Counter)
+    sizes: collections.Counter[str] = field(default_factory=collections.Counter)
+    samples: list[_LeakedObjectSample] = field(default_factory=list)
+    # Only filled in when retained sizes were asked for.
+    retained_sizes: Optional[collections.Counter[str]] = None
+
+    def type_size(self, type_name: str) -> int:
+        """Return the size used to rank the given type in the report."""
+        if self.retained_sizes is not None:
+            return self.retained_sizes[type_name]
+        return self.sizes[type_name]
+
+
+def _retained_sizes(objects: list[object]) -> dict[int, int]:  # pragma: no cover
+    """Return the retained size of the leaked objects, keyed by their id.
+
+    The retained size of a leaked object that no other leaked object refers
+    to (a root) is the shallow size of the leaked objects that only it
+    reaches, through other leaked objects: those it keeps alive on its own.
+    Objects reached from several roots are shared, and credited to none of
+    them. Leaked objects that only refer to each other in a cycle, without a
+    root, are only credited with their own size. Whatever order the objects
+    come in, the result is the same.
+    """
+    leaked = {id(obj) for obj in objects}
+    referenced: set[int] = set()
+    for obj in objects:
+        for referent in gc.get_referents(obj):
+            if id(referent) in leaked and referent is not obj:
+                referenced.add(id(referent))
+    roots = [obj for obj in objects if id(obj) not in referenced]
+
+    # Label every object reachable from a root with the id of that root, or
+    # as shared once a second root reaches it. An object is walked again
+    # when it becomes shared, so each one is walked at most twice.
+    shared = 0
+    owner = {id(root): id(root) for root in roots}
+    pending = list(roots)
+    visits = 0
+    while pending and visits < _MAX_RETAINED_VISITS:
+        node = pending.pop()
+        visits += 1
+        label = owner[id(node)]
+        for referent in gc.get_referents(node):
+            if id(referent) not in leaked:
+                continue
+            current = owner.get(id(referent))
+            if current is None or (current != label and current != shared):
+                owner[id(referent)] = label if current is None else shared
+                pending.append(referent)
+
+    retained: dict[int, int] = {}
+    for obj in objects:
+        label = owner.get(id(obj), id(obj))
+        if label != shared:
+            retained[label] = retained.get(label, 0) + sys.getsizeof(obj, 0)
+    return retained
+
+
+def _summarize_leaked_objects(  # pragma: no cover
+    objects: list[object],
+    filter_fn: Optional[LeakedObjectsFilterFunction],
+    *,
+    retention_paths: bool = False,
+    retained_sizes: bool = False,
+) -> _LeakedObjectsSummary:
+    """Summarize the surviving objects in a single pass.
+
+    The list is emptied as it is consumed, so that each object can be freed
+    as soon as it has been looked at. The samples are a uniform reservoir
+    sample, so that they don't all come from whatever leaked first, and only
+    they are kept alive until the pass is over.
+    """
+    summary = _LeakedObjectsSummary()
+    retained: dict[int, int] = {}
+    if retained_sizes:
+        # This needs every object at once, so it runs before any is freed.
+        retained = _retained_sizes(objects)
+        summary.retained_sizes = collections.Counter()
+    sampled: list[object] = []
+    rng = random.Random(0)
+    objects.reverse()
+    while objects:
+        obj = objects.pop()
+        if filter_fn is not None and not filter_fn(obj):
+            continue
+        type_name = type(obj).__name__
+        summary.total += 1
+        summary.counts[type_name] += 1
+        summary.sizes[type_name] += sys.getsizeof(obj, 0)
+        if summary.retained_sizes is not None:
+            summary.retained_sizes[type_name] += retained.pop(id(obj), 0)
+        if len(sampled) < _MAX_REPORTED_SAMPLES:
+            sampled.append(obj)
+        else:
+            slot = rng.randrange(summary.total)
+            if slot < _MAX_REPORTED_SAMPLES:
+                sampled[slot] = obj
+
+    while sampled:
+        obj = sampled.pop(0)
+        sample = _LeakedObjectSample(type(obj).__name__, _short_repr(obj))
+        if retention_paths:
+            chain = find_retention_path(obj, ignored=[objects, sampled])
+            if chain is not None:
+                sample.retention_path = format_retention_path(chain)
+            del chain
+        summary.samples.append(sample)
+    return summary
+
+
+def _exceeded_object_budgets(  # pragma: no cover
+    summary: _LeakedObjectsSummary,
+    type_budgets: Optional[Mapping[str, int]],
+    total_budget: Optional[int],
+) -> dict[Optional[str], tuple[int, int]]:
+    """Return the budgets that the leaked objects went over.
+
+    Types that have no budget of their own may not leak at all, unless only a
+    total budget was given. Without any budget, nothing may leak.
+    """
+    exceeded: dict[Optional[str], tuple[int, int]] = {}
+    if type_budgets is not None:
+        for type_name, count in summary.counts.most_common():
+            allowed = type_budgets.get(type_name, 0)
+            if count > allowed:
+                exceeded[type_name] = (count, allowed)
+    if total_budget is None and type_budgets is None:
+        total_budget = 0
+    if total_budget is not None and summary.total > total_budget:
+        exceeded[None] = (summary.total, total_budget)
+    return exceeded
 
 
 @dataclass
 class _TrackedObjectsInfo:  # pragma: no cover
     """Type that holds information about objects that survived tracking."""
 
-    surviving_objects: list[object]
+    leaked_objects: _LeakedObjectsSummary
+    # The budgets that were exceeded, as (leaked, allowed) per type name, and
+    # for all objects together under the None key.
+    exceeded_budgets: dict[Optional[str], tuple[int, int]] = field(default_factory=dict)
 
     @property
     def section(self) -> PytestSection:
@@ -324,48 +1426,68 @@ class _TrackedObjectsInfo:  # pragma: no cover
     @property
     def long_repr(self) -> str:
         """Generate a longrepr user-facing error message."""
-        return f"Test leaked {len(self.surviving_objects)} objects"
+        if not self.exceeded_budgets:
+            return f"Test leaked {self.leaked_objects.total} objects"
+        reasons = [
+            (
+                f"{leaked} {type_name} objects ({allowed} allowed)"
+                if type_name is not None
+                else f"{leaked} objects in total ({allowed} allowed)"
+            )
+            for type_name, (leaked, allowed) in self.exceeded_budgets.items()
+        ]
+        return f"Test leaked {', '.join(reasons)}"
 
     def _generate_section_text(self) -> str:
         """Generate a text summary of leaked objects."""
-        from collections import Counter
-
-        # Group objects by type
-        type_counts = Counter(type(obj).__name__ for obj in self.surviving_objects)
-
+        summary = self.leaked_objects
         text_lines = []
         padding = " " * 4
 
+        if self.exceeded_budgets:
+            text_lines.append(f"{padding}Budgets exceeded:")
+            for type_name, (leaked, allowed) in self.exceeded_budgets.items():
+                name = type_name if type_name is not None else "total"
+                text_lines.append(
+                    f"{padding*2}- {name}: {leaked} leaked, {allowed} allowed"
+                )
+            text_lines.append("")
+
         # Show top object types that leaked
         text_lines.append(
-            f"{padding}Object types that leaked (total: {len(self.surviving_objects)} objects):"
+            f"{padding}Object types that leaked (total: {summary.total} objects):"
         )
-        top_types = type_counts.most_common(_MAX_REPORTED_TYPES)
+        # Rank by size, so that a few huge objects aren't hidden by many
+        # small ones.
+        top_types = sorted(
+            summary.counts.items(),
+            key=lambda item: (summary.type_size(item[0]), item[1]),
+            reverse=True,
+        )[:_MAX_REPORTED_TYPES]
         max_count_len = max(len(str(count)) for _, count in top_types)
         for obj_type, count in top_types:
+            size = f"~{sizeof_fmt(summary.sizes[obj_type])}"
+            if summary.retained_sizes is not None:
+                retained = sizeof_fmt(summary.retained_sizes[obj_type])
+                size += f", ~{retained} retained"
             text_lines.append(
-                f"{padding*2}- {count:>{max_count_len}} {obj_type} instance(s)"
+                f"{padding*2}- {count:>{max_count_len}} {obj_type} instance(s) "
+                f"({size})"
             )
-        if len(type_counts) > _MAX_REPORTED_TYPES:
+        if len(summary.counts) > _MAX_REPORTED_TYPES:
             text_lines.append(
-                f"{padding*2}... and {len(type_counts) - _MAX_REPORTED_TYPES} more types"
+                f"{padding*2}... and {len(summary.counts) - _MAX_REPORTED_TYPES} more types"
             )
 
         # Show a sample of the actual objects
         text_lines.append(f"\n{padding}Sample of leaked objects:")
-        for obj in self.surviving_objects[:_MAX_REPORTED_SAMPLES]:
-            try:
-                obj_repr = repr(obj)
-            except Exception:
-                obj_repr = "<repr failed>"
-
-            # Truncate long representations
-            if len(obj_repr) > _MAX_REPR_LEN:
-                obj_repr = obj_repr[: _MAX_REPR_LEN - 3] + "..."
-            text_lines.append(f"{padding*2}- {type(obj).__name__}: {obj_repr}")
-
-        if len(self.surviving_objects) > _MAX_REPORTED_SAMPLES:
-            extra = len(self.surviving_objects) - _MAX_REPORTED_SAMPLES
+        for sample in summary.samples:
+            text_lines.append(f"{padding*2}- {sample.type_name}: {sample.repr}")
+            if sample.retention_path is not None:
+                text_lines.append(f"{padding*3}kept alive by {sample.retention_path}")
+
+        if summary.total > len(summary.samples):
+            extra = summary.total - len(summary.samples)
             text_lines.append(f"{padding*2}... and {extra} more")
 
         return "\n".join(text_lines)
@@ -374,30 +1496,39 @@ class _TrackedObjectsInfo:  # pragma: no cover
 def limit_leaked_objects(  # pragma: no cover
     *,
     filter_fn: Optional[LeakedObjectsFilterFunction] = None,
+    retention_paths: bool = False,
+    retained_sizes: bool = False,
+    type_budgets: Optional[Mapping[str, int]] = None,
+    total_budget: Optional[int] = None,
     _result_file: Path,
     _config: Config,
     _test_id: str,
-    _surviving_objects: list[object] | None = None,
+    _leaked_objects: _LeakedObjectsSummary | None = None,
 ) -> _TrackedObjectsInfo | None:
     """Track objects that survive the test execution."""
-
-    if _surviving_objects is None:
-        _surviving_objects = []
-
-    _surviving_objects = [
-        obj for obj in _surviving_objects if not filter_fn or filter_fn(obj)
-    ]
-
-    if not _surviving_objects:
+    # filter_fn, retention_paths and retained_sizes were already used when
+    # the surviving objects were summarized, right after the test finished.
+    if _leaked_objects is None or not _leaked_objects.total:
         return None
 
-    return _TrackedObjectsInfo(surviving_objects=_surviving_objects)
+    exceeded = _exceeded_object_budgets(_leaked_objects, type_budgets, total_budget)
+    if not exceeded:
+        return None
+    if type_budgets is None and total_budget is None:
+        # Without budgets, any leak is a failure on its own.
+        exceeded = {}
+    return _TrackedObjectsInfo(
+        leaked_objects=_leaked_objects, exceeded_budgets=exceeded
+    )
 
 
 __all__ = [
     "limit_memory",
     "limit_leaks",
+    "limit_allocations",
     "limit_leaked_objects",
+    "limit_leak_rate",
+    "memory_scaling",
     "LeaksFilterFunction",
     "Stack",
     "StackFrame",
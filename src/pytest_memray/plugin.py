@@ -1,53 +1,110 @@
 from __future__ import annotations
 
+import abc
 import collections
 import functools
 import gc
-import hashlib
 import inspect
 import math
+import multiprocessing
 import os
-import pickle
 import sys
+import threading
+import time
 import uuid
+from array import array
 from contextlib import contextmanager
+from contextlib import nullcontext
 from dataclasses import dataclass
 from itertools import islice
 from pathlib import Path
 from tempfile import TemporaryDirectory
+from typing import TYPE_CHECKING
 from typing import Any
+from typing import ContextManager
 from typing import Generator
 from typing import Iterable
 from typing import List
+from typing import Optional
+from typing import Protocol
 from typing import Tuple
 from typing import cast
-from typing import Protocol
 
 from _pytest.terminal import TerminalReporter
-from memray import AllocationRecord
-from memray import FileFormat
-from memray import FileReader
-from memray import Metadata
-from memray import Tracker
 from pytest import CallInfo
 from pytest import CollectReport
 from pytest import Config
 from pytest import ExitCode
 from pytest import Function
 from pytest import Item
+from pytest import Mark
 from pytest import Parser
+from pytest import PytestWarning
+from pytest import Session
+from pytest import StashKey
 from pytest import TestReport
 from pytest import UsageError
 from pytest import hookimpl
 
-from .marks import limit_memory
-from .marks import limit_leaks
+from .attribution import project_roots
+from .children import child_captures
+from .children import child_peaks
+from .children import tracking_spawned_children
+from .index import CallSite
+from .index import IndexEntry
+from .index import diff_indexes
+from .index import high_watermark_call_sites
+from .index import high_watermark_files
+from .index import read_index
+from .index import tests_touching
+from .index import write_index
+from .marks import _COMPLEXITIES
+from .marks import TaskCoroutine
+from .marks import _count_allocations_by_call_site
+from .marks import _exceeded_leak_rate
+from .marks import _fit_memory_scaling
+from .marks import _group_by_allocator
+from .marks import _group_by_owner
+from .marks import _group_by_task
+from .marks import _group_by_thread
+from .marks import _LeakedObjectsSummary
+from .marks import _mark_iteration
+from .marks import _MemoryScalingInfo
+from .marks import _OwnerUsage
+from .marks import _summarize_leaked_objects
+from .marks import _TaskUsage
+from .marks import _ThreadUsage
+from .marks import limit_allocations
+from .marks import limit_leak_rate
 from .marks import limit_leaked_objects
+from .marks import limit_leaks
+from .marks import limit_memory
+from .marks import memory_scaling
+from .policy import BudgetPolicy
+from .timeline import ResidentMemory
+from .timeline import Timeline
+from .timeline import TimelineRecorder
+from .timeline import read_timeline
+from .timeline import write_timeline
+from .timeline import write_timelines
 from .utils import WriteEnabledDirectoryAction
+from .utils import parse_memory_string
+from .utils import parse_rate_string
 from .utils import positive_int
 from .utils import sizeof_fmt
 from .utils import value_or_ini
 
+if TYPE_CHECKING:
+    # This module is loaded by every pytest run, so memray (a big native
+    # extension) is only imported once a test needs to be tracked.
+    import asyncio
+    from multiprocessing.connection import Connection
+
+    from memray import AllocationRecord
+    from memray import FileReader
+    from memray import Metadata
+    from memray import Tracker
+
 
 class SectionMetadata(Protocol):
     long_repr: str
@@ -68,6 +125,9 @@ MARKERS = {
     "limit_memory": limit_memory,
     "limit_leaks": limit_leaks,
     "limit_leaked_objects": limit_leaked_objects,
+    "limit_allocations": limit_allocations,
+    "limit_leak_rate": limit_leak_rate,
+    "memory_scaling": memory_scaling,
 }
 
 N_TOP_ALLOCS = 5
@@ -78,6 +138,18 @@ N_HISTOGRAM_BINS = 5
 MAX_FILENAME_LENGTH = 255 - (len(".metadata") - len(".bin"))
 
 
+# How many bars the memory of each process over the session is drawn with.
+_TIMELINE_CHART_WIDTH = 60
+
+
+def _report_name(test_id: str) -> str:
+    """Return what the names of the HTML reports of a test start with."""
+    name = test_id.replace("::", "-").replace(os.sep, "-")
+    # Leave room for the name of the reporter, and drop the .bin suffix.
+    max_length = MAX_FILENAME_LENGTH - len("-flamegraph.html") + len(".bin")
+    return _truncate_filename(f"{name}.bin", max_length)[: -len(".bin")]
+
+
 def _truncate_filename(name: str, max_length: int = MAX_FILENAME_LENGTH) -> str:
     """Shorten *name* so it fits in a single path component.
 
@@ -88,6 +160,8 @@ def _truncate_filename(name: str, max_length: int = MAX_FILENAME_LENGTH) -> str:
     encoded = name.encode("utf-8")
     if len(encoded) <= max_length:
         return name
+    import hashlib
+
     digest = hashlib.sha256(encoded).hexdigest()[:16]
     suffix = f"-{digest}.bin"
     keep = max_length - len(suffix)
@@ -124,41 +198,519 @@ def cli_hist(data: Iterable[float], bins: int, *, log_scale: bool = True) -> str
 ResultElement = List[Tuple[object, int]]
 
 
+def _allocation_hotspots(reader: FileReader) -> dict[CallSite, tuple[int, int]]:
+    """Return the number and bytes of allocations made by each call site.
+
+    Call sites are identified by the innermost frame of the stack, so that
+    they can be compared across captures.
+    """
+    hotspots: dict[CallSite, tuple[int, int]] = {}
+    for site in _count_allocations_by_call_site(reader):
+        stack_trace = site.record.stack_trace(max_stacks=1)
+        if not stack_trace:
+            continue
+        count, size = hotspots.get(stack_trace[0], (0, 0))
+        hotspots[stack_trace[0]] = (
+            count + site.n_allocations,
+            size + site.total_size,
+        )
+    return hotspots
+
+
 @dataclass
 class Result:
     test_id: str
     metadata: Metadata
     result_file: Path
+    async_tasks: dict[TaskCoroutine, list[str]] | None = None
+    hotspots: dict[CallSite, tuple[int, int]] | None = None
+    call_sites: dict[CallSite, int] | None = None
+    files: list[str] | None = None
+    # How long it took to settle the objects tracked by limit_leaked_objects.
+    settle_time: float | None = None
+    # The peak memory of each process the test started, by its pid, if they
+    # were followed (see --memray-follow-children).
+    child_peaks: dict[int, int] | None = None
+
+
+@dataclass(frozen=True)
+class TrackingPlan:
+    """How a test is tracked, resolved when the tests are collected."""
+
+    # The memray markers applied to the test, closest first.
+    marks: tuple[Mark, ...]
+    native: bool
+    trace_python_allocators: bool
+    # Keep every allocation rather than only the aggregated ones.
+    all_allocations: bool
+    warmup: int
+    repeat: int
+    track_objects: bool
+    track_async_tasks: bool
+    # Track the processes started by the test too.
+    follow_children: bool
+
+    @functools.cached_property
+    def names(self) -> frozenset[str]:
+        return frozenset(mark.name for mark in self.marks)
+
+    def mark(self, name: str) -> Mark | None:
+        """Return the closest marker with the given name, if any."""
+        return next((mark for mark in self.marks if mark.name == name), None)
+
+
+# The plan of each test, or None if it isn't tracked at all.
+_TRACKING_PLAN = StashKey[Optional[TrackingPlan]]()
+
+
+def _memray_marks(item: Item) -> tuple[Mark, ...]:
+    """Return the memray markers applied to a test, closest first."""
+    return tuple(mark for mark in item.iter_markers() if mark.name in MARKERS)
+
+
+@contextmanager
+def _recording_async_tasks(
+    tasks: dict[TaskCoroutine, list[str]],
+) -> Generator[None, None, None]:
+    """Record the coroutine and name of every asyncio task created inside."""
+    import asyncio
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # Not running under asyncio (e.g. the trio backend of anyio)
+        yield
+        return
+    previous_factory = loop.get_task_factory()
+    created: list[tuple[TaskCoroutine, asyncio.Task[Any]]] = []
+
+    def task_factory(
+        loop: asyncio.AbstractEventLoop, coro: Any, **kwargs: Any
+    ) -> asyncio.Future[Any]:
+        if previous_factory is not None:
+            task = previous_factory(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        code = getattr(coro, "cr_code", None)
+        if code is not None and isinstance(task, asyncio.Task):
+            created.append(((code.co_name, code.co_filename), task))
+        return task
+
+    loop.set_task_factory(task_factory)
+    try:
+        yield
+    finally:
+        loop.set_task_factory(previous_factory)
+        # Names are read only now, as the name given to create_task() is set
+        # after the task factory returns.
+        for key, task in created:
+            tasks.setdefault(key, []).append(task.get_name())
+
+
+class _TestStopped(BaseException):
+    """Raised inside a test to stop it once it is known to fail its marker.
+
+    This is a BaseException so that the test can't swallow it by accident.
+    """
+
+
+GCState = List[int]
+
+
+def _gc_state() -> GCState:
+    """Return how many collections each generation went through so far."""
+    return [generation["collections"] for generation in gc.get_stats()]
+
+
+def _settle_generation(before: GCState) -> int:  # pragma: no cover
+    """Return the oldest generation that can hold garbage made since *before*.
+
+    Objects only move to an older generation by surviving a collection of a
+    younger one, so if no collection ran, whatever was created since is still
+    in the youngest one. That one is always collected: how many containers it
+    holds can't tell whether the test made any, as freeing older ones lowers
+    the count too.
+    """
+    collections = _gc_state()
+    for generation in reversed(range(len(collections) - 1)):
+        if collections[generation] > before[generation]:
+            return generation + 1
+    return 0
+
+
+def _raise_in_thread(thread_id: int, exc_type: type[BaseException]) -> None:
+    import ctypes
+
+    ctypes.pythonapi.PyThreadState_SetAsyncExc(
+        ctypes.c_ulong(thread_id), ctypes.py_object(exc_type)
+    )
+
+
+# How many checks, and how many seconds, limit_leak_rate waits for at least
+# before it can stop a test early.
+_MIN_EARLY_STOP_CHECKS = 5
+_MIN_EARLY_STOP_SECONDS = 5.0
+
+
+def _current_asyncio_task() -> asyncio.Task[Any] | None:
+    import asyncio
+
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        # Not running under asyncio (e.g. the trio backend of anyio)
+        return None
+
+
+class _Watchdog(abc.ABC):
+    """Stop the current test from a background thread once it is known to fail.
+
+    Subclasses decide when that is in `_exceeded`, which is called every
+    *interval* seconds while the test runs, or which blocks until it knows
+    (see `_stop_watching`). The thread is started as soon as
+    the watchdog is created, so that starting it isn't tracked, and only
+    starts watching once the watchdog is entered.
+
+    A test running in an event loop is stopped by cancelling its *task* from
+    the loop instead, as an exception raised in the thread could just as well
+    land in the loop itself, between two steps of the test.
+
+    The thread runs while the test is tracked, so it waits on bare locks,
+    which unlike Events run no Python code that allocates when it wakes up.
+    """
+
+    name = "memray-watchdog"
+
+    def __init__(self, interval: float, task: asyncio.Task[Any] | None = None) -> None:
+        self.stopped_early = False
+        self._interval = interval
+        self._target = threading.get_ident()
+        self._task = task
+        # Both are held until the watchdog is entered, and left.
+        self._armed = threading.Lock()
+        self._armed.acquire()
+        self._done = threading.Lock()
+        self._done.acquire()
+        # Whether the test finished, set and read under this lock.
+        self._finished = False
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._watch, name=self.name, daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> _Watchdog:
+        self._armed.release()
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: object) -> bool:
+        try:
+            with self._lock:
+                self._finished = True
+        except _TestStopped:
+            # The exception was raised just as the test finished, and only
+            # got delivered here.
+            exc_type = _TestStopped
+        self._done.release()
+        self._stop_watching()
+        self._thread.join()
+        if self._task is None:
+            return exc_type is _TestStopped
+        from asyncio import CancelledError
+
+        if not self.stopped_early or exc_type is not CancelledError:
+            return False
+        if sys.version_info >= (3, 11):
+            self._task.uncancel()
+        return True
+
+    @abc.abstractmethod
+    def _exceeded(self) -> bool:
+        """Return whether the test is known to fail, so it can be stopped."""
+
+    def _stop_watching(self) -> None:
+        """Wake `_exceeded` up if it may block until the test finishes."""
+
+    def _cancel_task(self) -> None:
+        # This runs in the event loop, like the test, so it can't race with
+        # the test finishing on its own.
+        assert self._task is not None
+        if not self._finished:
+            self.stopped_early = True
+            self._task.cancel()
+
+    def _watch(self) -> None:
+        self._armed.acquire()
+        while not self._done.acquire(timeout=self._interval):
+            if not self._exceeded():
+                continue
+            with self._lock:
+                if self._finished:
+                    pass
+                elif self._task is not None:
+                    self._task.get_loop().call_soon_threadsafe(self._cancel_task)
+                else:
+                    self.stopped_early = True
+                    _raise_in_thread(self._target, _TestStopped)
+            return
+
+
+def _watch_leak_rate(
+    result_file: Path, max_rate: float, min_duration: float, done: Connection
+) -> None:
+    """Exit with status 1 once the capture in *result_file* leaks too fast.
+
+    This runs in a process of its own for `_LeakRateWatchdog`, until *done*
+    is closed by the tracked process.
+    """
+    from memray import FileReader
+
+    start = time.monotonic()
+    next_read = start + min_duration
+    while not done.poll(max(next_read - time.monotonic(), 0)):
+        now = time.monotonic()
+        next_read = now + (now - start) / 2
+        try:
+            snapshots = list(FileReader(result_file).get_memory_snapshots())
+        except OSError:
+            continue
+        if _exceeded_leak_rate(snapshots, max_rate) is not None:
+            sys.exit(1)
+
+
+class _LeakRateWatchdog(_Watchdog):
+    """Stop the current test once its capture shows it leaks too fast.
+
+    Reading the capture allocates a lot of memory, which would count towards
+    the leak rate if it was read by the tracked process, so it is read by a
+    process of its own, started before the test is tracked, which exits with
+    status 1 once the rate is exceeded. The thread of the watchdog just waits
+    for it to exit, which allocates nothing until it does.
+
+    Reading the memory snapshots means parsing the whole capture, which keeps
+    growing, so it is read less and less often: the time until the next read
+    is half the time the test ran so far. All the reads together then parse
+    about three times what the capture holds at the end, however long the
+    test runs. Reading the capture while it is written needs the
+    ``ALL_ALLOCATIONS`` file format.
+    """
+
+    name = "memray-leak-rate"
+
+    def __init__(
+        self,
+        result_file: Path,
+        max_rate: float,
+        interval: float,
+        task: asyncio.Task[Any] | None = None,
+    ) -> None:
+        # A few checks over a few seconds are needed before a leak can be
+        # told apart from memory that is allocated once, or comes and goes.
+        min_duration = max(_MIN_EARLY_STOP_SECONDS, _MIN_EARLY_STOP_CHECKS * interval)
+        # The process starts from scratch, as forking one that runs threads
+        # can deadlock.
+        context = multiprocessing.get_context("spawn")
+        done, self._finishing = context.Pipe(duplex=False)
+        self._process = context.Process(
+            target=_watch_leak_rate,
+            args=(result_file, max_rate, min_duration, done),
+            name=self.name,
+            daemon=True,
+        )
+        self._process.start()
+        done.close()
+        super().__init__(interval, task)
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: object) -> bool:
+        try:
+            return super().__exit__(exc_type, *_)
+        finally:
+            self._finishing.close()
+            self._process.join()
+
+    def _stop_watching(self) -> None:
+        self._finishing.close()
+
+    def _exceeded(self) -> bool:
+        # Nothing is ever written to the sentinel, so this returns once the
+        # process exits.
+        os.read(self._process.sentinel, 1)
+        self._process.join()
+        return self._process.exitcode == 1
+
+
+class _MemoryWatchdog(_Watchdog):
+    """Stop the current test once the process grew by more than *max_growth*.
+
+    The capture can't be read while it is written in the default format, so
+    the resident memory of the process is sampled instead.
+    """
+
+    name = "memray-memory"
+
+    def __init__(
+        self,
+        max_growth: float,
+        interval: float,
+        task: asyncio.Task[Any] | None = None,
+    ) -> None:
+        super().__init__(interval, task)
+        self._max_growth = max_growth
+        self._resident_memory = ResidentMemory()
+        self._start = 0
+
+    def __enter__(self) -> _Watchdog:
+        self._start = self._resident_memory()
+        return super().__enter__()
+
+    def __exit__(self, exc_type: type[BaseException] | None, *_: object) -> bool:
+        try:
+            return super().__exit__(exc_type, *_)
+        finally:
+            self._resident_memory.close()
+
+    def _exceeded(self) -> bool:
+        return self._resident_memory() - self._start > self._max_growth
 
 
 class Manager:
     def __init__(self, config: Config) -> None:
         self.results: dict[str, Result] = {}
-        self.surviving_objects: dict[str, list[object]] = {}  # Store separately
+        # Summaries of the objects that survived each test (the objects
+        # themselves can't be pickled, and are let go as soon as possible)
+        self.leaked_objects: dict[str, _LeakedObjectsSummary] = {}
+        # Tests stopped by limit_leak_rate before they finished.
+        self.stopped_early: set[str] = set()
         self.config = config
+        # Check the options before anything is created on disk or in the
+        # environment, as nothing would clean it up afterwards.
+        if config.getvalue("memray_changed_files") and not config.getvalue(
+            "memray_compare"
+        ):
+            raise UsageError("--memray-changed-files requires --memray-compare")
         path: Path | None = config.getvalue("memray_bin_path")
         self._tmp_dir: None | TemporaryDirectory[str] = None
+        # Unless a directory was given, where to store the results is only
+        # decided once the first test needs to be tracked (see result_path).
+        self._result_path: Path | None = path
+        self._result_metadata_path: Path | None = None
         if path is None:
             # Check the MEMRAY_RESULT_PATH environment variable. If this
             # is set, it means that we are running in a worker and the main
             # process has set it so we'll use it as the directory to store
             # the results.
             result_path = os.getenv("MEMRAY_RESULT_PATH")
-            if not result_path:
-                # We are not running in a worker, so we'll create a temporary
-                # directory to store the results. Other possible workers will
-                # use this directory by reading the MEMRAY_RESULT_PATH environment
-                # variable.
-                self._tmp_dir = TemporaryDirectory()
-                os.environ["MEMRAY_RESULT_PATH"] = self._tmp_dir.name
-                result_path = self._tmp_dir.name
-            self.result_path: Path = Path(result_path)
-        else:
-            self._tmp_dir = None
-            self.result_path = path
+            if result_path:
+                self._result_path = Path(result_path)
+            elif getattr(config.option, "dist", "no") != "no":
+                # pytest-xdist workers are started before any test runs, so
+                # they must be told where to store their results right away.
+                self.result_path
         self._bin_prefix = config.getvalue("memray_bin_prefix") or uuid.uuid4().hex
-        self.result_metadata_path = self.result_path / "metadata"
-        self.result_metadata_path.mkdir(exist_ok=True, parents=True)
+        self._name_by_test = bool(path)
+
+        # The options are read once, rather than for every test.
+        self._track_all = bool(value_or_ini(config, "memray"))
+        self._native = bool(value_or_ini(config, "native"))
+        self._trace_python_allocators = bool(
+            value_or_ini(config, "trace_python_allocators")
+        )
+        self._track_async_tasks = bool(value_or_ini(config, "track_async_tasks"))
+        self._follow_children = bool(value_or_ini(config, "memray_follow_children"))
+        self._settle = value_or_ini(config, "memray_settle")
+        self._collect_hotspots = self._max_hotspots() > 0
+        abort_at = value_or_ini(config, "memray_abort_at")
+        self._abort_at = float(cast(str, abort_at)) if abort_at else None
+
+        compare = config.getvalue("memray_compare")
+        self._compare_path = Path(compare).absolute() if compare else None
+        # Only keep what's needed to build an index if it can be written
+        # somewhere that outlives the run, or compared with a previous one.
+        self._index_results = path is not None or self._compare_path is not None
+        # The index compared with, read before this run can overwrite it with
+        # its own, or why it couldn't be read.
+        self._previous_index: dict[str, IndexEntry] = {}
+        self._previous_index_error: Exception | None = None
+        changed_files = config.getvalue("memray_changed_files")
+        self._changed_files: Path | None = None
+        if changed_files is not None:
+            self._changed_files = Path(changed_files).absolute()
+        # Tests that --memray would track, but that don't need to be tracked as
+        # none of the changed files show up in their memory profile. Their
+        # previous index entries are carried over into the index of this run.
+        self._unaffected_tests: dict[str, IndexEntry] = {}
+        # The memory_scaling marker compares the parametrizations of a test.
+        # Each one is put in a group, along with the value of the parameter,
+        # and the peaks of the group are fitted once the session is over, from
+        # the reports of its tests (sent by the workers under xdist).
+        self._scaling_of: dict[str, tuple[str, float, str, str, float]] = {}
+        self._scaling_groups: dict[str, tuple[str, str, float]] = {}
+        self._scaling_peaks: dict[str, list[tuple[float, int]]] = {}
+        self._scaling_failures: dict[str, _MemoryScalingInfo] = {}
+
+        suite_flamegraph = config.getvalue("memray_suite_flamegraph")
+        self._suite_flamegraph: Path | None = None
+        self._suite_stacks: collections.Counter[str] = collections.Counter()
+        if suite_flamegraph is not None:
+            self._suite_flamegraph = Path(suite_flamegraph).absolute()
+            if path is not None and not hasattr(config, "workerinput"):
+                # Don't merge stacks left behind by a previous run that used
+                # the same --memray-bin-path.
+                for stale in self.result_metadata_path.glob("*.folded"):
+                    stale.unlink()
+
+        html_reports = config.getvalue("memray_html_reports")
+        self._html_reports: Path | None = (
+            Path(html_reports).absolute() if html_reports is not None else None
+        )
+        # The marker that failed each test, as reported by whichever process
+        # ran it, and the HTML reports rendered for them at the end.
+        self._failed_markers: dict[str, str] = {}
+        self._rendered_reports: dict[str, list[Path] | BaseException] = {}
+
+        # The live display of the peak memory of the tests as they finish: the
+        # worst test so far, and the memory of the tests run by each worker.
+        self._live = bool(value_or_ini(config, "memray_live"))
+        self._live_interval: float = config.getvalue("memray_live_interval")
+        self._live_worst: tuple[int, str] | None = None
+        self._live_bytes: collections.Counter[str] = collections.Counter()
+        self._live_tests: collections.Counter[str] = collections.Counter()
+        self._live_shown_at = -math.inf
+
+        # The memory of each process over the whole session. Under pytest-xdist
+        # only the workers run tests, so the controller isn't sampled.
+        self._timelines: dict[str, Timeline] = {}
+        self._timeline_recorder: TimelineRecorder | None = None
+        if value_or_ini(config, "memray_timeline"):
+            xdist_controller = not hasattr(config, "workerinput") and (
+                getattr(config.option, "dist", "no") != "no"
+            )
+            if not xdist_controller:
+                self._timeline_recorder = TimelineRecorder(
+                    config.getvalue("memray_timeline_interval")
+                )
+            if path is not None and not hasattr(config, "workerinput"):
+                for stale in self.result_metadata_path.glob("*.timeline"):
+                    stale.unlink()
+
+    @property
+    def result_path(self) -> Path:
+        """The directory where the captures are written."""
+        if self._result_path is None:
+            # We are not running in a worker, so we'll create a temporary
+            # directory to store the results. Other possible workers will
+            # use this directory by reading the MEMRAY_RESULT_PATH environment
+            # variable.
+            self._tmp_dir = TemporaryDirectory()
+            os.environ["MEMRAY_RESULT_PATH"] = self._tmp_dir.name
+            self._result_path = Path(self._tmp_dir.name)
+        return self._result_path
+
+    @property
+    def result_metadata_path(self) -> Path:
+        """The directory where the results of each test are written."""
+        if self._result_metadata_path is None:
+            self._result_metadata_path = self.result_path / "metadata"
+            self._result_metadata_path.mkdir(exist_ok=True, parents=True)
+        return self._result_metadata_path
 
     @hookimpl(hookwrapper=True)
     def pytest_unconfigure(self, config: Config) -> Generator[None, None, None]:
@@ -170,6 +722,17 @@ class Manager:
 
     @hookimpl
     def pytest_collection_modifyitems(self, config: Config, items: list[Item]) -> None:
+        if self._changed_files is not None:
+            self._select_affected_tests(items)
+        policy = self._budget_policy()
+        if policy is not None:
+            # Explicit markers take precedence over the policy.
+            for item in items:
+                if any(mark.name in MARKERS for mark in item.iter_markers()):
+                    continue
+                budget = policy.match(item.nodeid)
+                if budget is not None:
+                    item.add_marker(budget)
         # The limit_leaked_objects marker requires Python 3.13.3+. Fail at
         # collection time (as documented) rather than letting the test run and
         # error during the call phase.
@@ -185,49 +748,267 @@ class Manager:
                     f"{'.'.join(map(str, sys.version_info[:3]))}"
                 )
 
-    @hookimpl(hookwrapper=True)
-    def pytest_pyfunc_call(self, pyfuncitem: Function) -> Iterable[None]:
-        func = pyfuncitem.obj
+    @hookimpl
+    def pytest_collection_finish(self, session: Session) -> None:
+        for item in session.items:
+            item.stash[_TRACKING_PLAN] = self._plan_tracking(item, _memray_marks(item))
+        for item in session.items:
+            marker = item.get_closest_marker("memory_scaling")
+            if marker is None:
+                continue
+            param = marker.kwargs.get("param", marker.args[0] if marker.args else None)
+            complexity = marker.kwargs.get(
+                "complexity", marker.args[1] if len(marker.args) > 1 else "linear"
+            )
+            if complexity not in _COMPLEXITIES:
+                raise UsageError(
+                    f"{item.nodeid}: unknown memory_scaling complexity "
+                    f"{complexity!r}, expected one of {', '.join(_COMPLEXITIES)}"
+                )
+            callspec = getattr(item, "callspec", None)
+            if callspec is None or param not in callspec.params:
+                raise UsageError(
+                    f"{item.nodeid}: memory_scaling needs a test parametrized "
+                    f"over {param!r}"
+                )
+            value = callspec.params[param]
+            if not isinstance(value, (int, float)):
+                try:
+                    value = len(value)
+                except TypeError:
+                    raise UsageError(
+                        f"{item.nodeid}: the {param!r} parameter of memory_scaling "
+                        "must be a number or have a length"
+                    ) from None
+            # Parametrizations that only differ in the scaling parameter are
+            # compared with each other.
+            other_params = ", ".join(
+                f"{name}={other!r}"
+                for name, other in sorted(callspec.params.items())
+                if name != param
+            )
+            group = item.nodeid.partition("[")[0]
+            if other_params:
+                group += f" ({other_params})"
+            tolerance = marker.kwargs.get("tolerance", 0.05)
+            self._scaling_of[item.nodeid] = (
+                group,
+                float(value),
+                param,
+                complexity,
+                tolerance,
+            )
+
+    def _budget_policy(self) -> BudgetPolicy | None:
+        policy = BudgetPolicy()
+        budgets_file = self.config.getvalue("memray_budgets")
+        try:
+            policy.add_lines(self.config.getini("memray_budgets"), "memray_budgets")
+            if budgets_file is not None:
+                with open(budgets_file, encoding="utf-8") as file:
+                    policy.add_lines(file, budgets_file)
+        except OSError as exc:
+            raise UsageError(f"Cannot read the memray budgets: {exc}") from exc
+        except ValueError as exc:
+            raise UsageError(str(exc)) from exc
+        return policy if policy.size else None
+
+    def _plan_tracking(
+        self, item: Item, marks: tuple[Mark, ...]
+    ) -> TrackingPlan | None:
+        if not marks and (not self._track_all or item.nodeid in self._unaffected_tests):
+            return None
+        names = {mark.name for mark in marks}
+        native = self._native
+        trace_python_allocators = self._trace_python_allocators
 
-        markers = {
-            marker.name
-            for marker in pyfuncitem.iter_markers()
-            if marker.name in MARKERS
+        warmup, repeat = 0, 1
+        if "limit_leaks" in names:
+            native = trace_python_allocators = True
+            leaks_marker = item.get_closest_marker("limit_leaks")
+            assert leaks_marker is not None
+            warmup = leaks_marker.kwargs.get("warmup", 0)
+            repeat = leaks_marker.kwargs.get("repeat", 1)
+            if warmup < 0 or repeat < 1:
+                # The test would otherwise never run, and have no result.
+                raise UsageError(
+                    f"{item.nodeid}: limit_leaks needs a warmup >= 0 and a "
+                    f"repeat >= 1, got warmup={warmup} and repeat={repeat}"
+                )
+
+        memory_marker = item.get_closest_marker("limit_memory")
+        if memory_marker is not None and "pymalloc" in memory_marker.kwargs.get(
+            "allocators", ()
+        ):
+            # A limit on pymalloc memory can't be checked without seeing it.
+            trace_python_allocators = True
+        # Counting every allocation needs the full allocation history, which
+        # the default aggregated format throws away. Most short-lived
+        # allocations come from pymalloc, so those need to be seen too.
+        all_allocations = False
+        if "limit_allocations" in names:
+            all_allocations = trace_python_allocators = True
+        return TrackingPlan(
+            marks=marks,
+            native=native,
+            trace_python_allocators=trace_python_allocators,
+            # Telling the iterations of a repeated test apart needs every
+            # allocation in the order it was made, and only captures in this
+            # format can be read once forked processes exit without finishing
+            # theirs.
+            all_allocations=(
+                all_allocations
+                or self._collect_hotspots
+                or repeat > 1
+                or "limit_leak_rate" in names
+                or self._follow_children
+            ),
+            warmup=warmup,
+            repeat=repeat,
+            # Object tracking requires Python 3.13.3+; this is enforced at
+            # collection time (see pytest_collection_modifyitems).
+            track_objects="limit_leaked_objects" in names,
+            track_async_tasks=self._track_async_tasks,
+            follow_children=self._follow_children,
+        )
+
+    def _tracking_plan(self, item: Item) -> TrackingPlan | None:
+        # Items that didn't go through collection (e.g. ones created by other
+        # plugins as the tests run) are planned when they are first seen, and
+        # markers can still be added after it (e.g. by request.applymarker()
+        # in a fixture), so the plan is made again if they changed.
+        marks = _memray_marks(item)
+        plan = item.stash.get(_TRACKING_PLAN, None)
+        if _TRACKING_PLAN not in item.stash or (plan.marks if plan else ()) != marks:
+            plan = item.stash[_TRACKING_PLAN] = self._plan_tracking(item, marks)
+        return plan
+
+    def _check_memory_scaling(self, session: Session) -> None:
+        """Fit the peaks of each group of memory_scaling tests."""
+        import warnings
+
+        for group, (param, complexity, tolerance) in self._scaling_groups.items():
+            peaks = self._scaling_peaks.get(group, [])
+            distinct = len({value for value, _ in peaks})
+            if distinct < 3:
+                # Tests that failed or were skipped leave too few to fit.
+                warnings.warn(
+                    PytestWarning(
+                        f"{group}: memory_scaling needs at least 3 distinct values "
+                        f"of {param} to fit, but only {distinct} passed"
+                    )
+                )
+                continue
+            info = _fit_memory_scaling(param, complexity, tolerance, peaks)
+            if info is not None:
+                self._scaling_failures[group] = info
+        if self._scaling_failures and session.exitstatus == ExitCode.OK:
+            session.exitstatus = ExitCode.TESTS_FAILED
+
+    def _select_affected_tests(self, items: list[Item]) -> None:
+        assert self._compare_path is not None and self._changed_files is not None
+        if self._previous_index_error is not None:
+            raise UsageError(
+                f"Cannot select the tests to track: {self._previous_index_error}"
+            )
+        previous = self._previous_index
+        try:
+            lines = self._changed_files.read_text(encoding="utf-8").splitlines()
+        except OSError as exc:
+            raise UsageError(f"Cannot select the tests to track: {exc}") from exc
+        rootpath = self.config.rootpath
+        changed = [
+            (rootpath / line.strip()).resolve() for line in lines if line.strip()
+        ]
+        affected = tests_touching(previous, changed)
+        # Tests that aren't in the index have no memory profile yet, so they
+        # are tracked to build one.
+        self._unaffected_tests = {
+            item.nodeid: previous[item.nodeid]
+            for item in items
+            if item.nodeid in previous and item.nodeid not in affected
         }
 
-        if not markers and not value_or_ini(self.config, "memray"):
+    @hookimpl(hookwrapper=True)
+    def pytest_pyfunc_call(self, pyfuncitem: Function) -> Iterable[None]:
+        plan = self._tracking_plan(pyfuncitem)
+        if plan is None:
             yield
             return
 
-        if len(markers) > 1:
+        if len(plan.names) > 1:
             raise ValueError("Only one Memray marker can be applied to each test")
 
+        func = pyfuncitem.obj
+        import pickle
+
+        from memray import FileFormat
+        from memray import FileReader
+        from memray import Tracker
+
         def _build_bin_path() -> Path:
-            if self._tmp_dir is None and not os.getenv("MEMRAY_RESULT_PATH"):
+            result_path = self.result_path
+            if self._name_by_test:
                 of_id = pyfuncitem.nodeid.replace("::", "-")
                 of_id = of_id.replace(os.sep, "-")
                 name = _truncate_filename(f"{self._bin_prefix}-{of_id}.bin")
             else:
                 name = f"{uuid.uuid4().hex}.bin"
-            result_file = self.result_path / name
+            result_file = result_path / name
             if self._tmp_dir is None and result_file.exists():
                 result_file.unlink()
+                for stale in child_captures(result_file).values():
+                    stale.unlink()
             return result_file
 
-        native: bool = bool(value_or_ini(self.config, "native"))
-        trace_python_allocators: bool = bool(
-            value_or_ini(self.config, "trace_python_allocators")
+        warmup, repeat = plan.warmup, plan.repeat
+        file_format = (
+            FileFormat.ALL_ALLOCATIONS
+            if plan.all_allocations
+            else FileFormat.AGGREGATED_ALLOCATIONS
         )
-
-        if markers and "limit_leaks" in markers:
-            native = trace_python_allocators = True
-
-        # Object tracking requires Python 3.13.3+; this is enforced at
-        # collection time (see pytest_collection_modifyitems).
-        track_objects = "limit_leaked_objects" in markers
+        max_leak_rate: float | None = None
+        max_growth: float | None = None
+        check_interval = 0.0
+        rate_marker = plan.mark("limit_leak_rate")
+        if rate_marker is not None:
+            max_leak_rate = parse_rate_string(
+                rate_marker.kwargs["rate"]
+                if "rate" in rate_marker.kwargs
+                else rate_marker.args[0]
+            )
+            check_interval = rate_marker.kwargs.get("check_interval", 10.0)
+        memory_marker = plan.mark("limit_memory")
+        if memory_marker is not None:
+            abort_at = memory_marker.kwargs.get("abort_at", self._abort_at)
+            if abort_at is not None:
+                limit = (
+                    memory_marker.kwargs["limit"]
+                    if "limit" in memory_marker.kwargs
+                    else memory_marker.args[0]
+                )
+                max_growth = parse_memory_string(limit) * float(abort_at)
+                check_interval = memory_marker.kwargs.get("check_interval", 0.1)
+
+        track_objects = plan.track_objects
+        settle = self._settle
+        # When settling started and ended. The clock is read into an array,
+        # because a float object made while tracking would show up as a leak.
+        settle_clock = array("d", [0.0, 0.0])
+
+        async_tasks: dict[TaskCoroutine, list[str]] | None = None
+        if plan.track_async_tasks and inspect.iscoroutinefunction(func):
+            # The test body itself runs in a task created before we can
+            # install our task factory, so register its coroutine by hand.
+            code = func.__code__
+            async_tasks = {(code.co_name, code.co_filename): [pyfuncitem.name]}
 
         @contextmanager
-        def memory_reporting() -> Generator[Tuple[Tracker, bool], None, None]:
+        def memory_reporting() -> Generator[
+            Tuple[ContextManager[object], Tracker, ContextManager[object], bool],
+            None,
+            None,
+        ]:
             # Restore the original function. This is needed because some
             # pytest plugins (e.g. flaky) will call our pytest_pyfunc_call
             # hook again with whatever is here, which will cause the wrapper
@@ -236,29 +1017,92 @@ class Manager:
 
             result_file = _build_bin_path()
             tracker_kwargs = {
-                "native_traces": native,
-                "trace_python_allocators": trace_python_allocators,
-                "file_format": FileFormat.AGGREGATED_ALLOCATIONS,
+                "native_traces": plan.native,
+                "trace_python_allocators": plan.trace_python_allocators,
+                "file_format": file_format,
             }
 
             # Add track_object_lifetimes if tracking objects
             if track_objects:  # pragma: no cover
                 tracker_kwargs["track_object_lifetimes"] = True
 
+            # Forked processes are tracked by memray itself, and spawned Python
+            # processes are made to track themselves. Either way each of them
+            # writes its own capture, named after the test's with its pid.
+            children: ContextManager[object] = nullcontext()
+            if plan.follow_children:
+                tracker_kwargs["follow_fork"] = True
+                children = tracking_spawned_children(
+                    result_file, plan.native, plan.trace_python_allocators
+                )
+
             # mypy can't resolve the overload when using **kwargs unpacking
             tracker = Tracker(result_file, **tracker_kwargs)  # type: ignore[call-overload]
-            yield (tracker, track_objects)
+            # Memray tracks every thread, so the session timeline is only
+            # sampled while no test is tracked.
+            sampling: ContextManager[object] = nullcontext()
+            if self._timeline_recorder is not None:
+                sampling = self._timeline_recorder.paused()
+            watchdog: ContextManager[object] = nullcontext()
+            is_async = inspect.iscoroutinefunction(func)
+            task = _current_asyncio_task() if is_async else None
+            if is_async and task is None:
+                # There is no asyncio task to cancel, so the test runs to the end.
+                pass
+            elif max_leak_rate is not None:
+                watchdog = _LeakRateWatchdog(
+                    result_file, max_leak_rate, check_interval, task
+                )
+            elif max_growth is not None:
+                watchdog = _MemoryWatchdog(max_growth, check_interval, task)
+            with children:
+                yield (sampling, tracker, watchdog, track_objects)
+
+            if isinstance(watchdog, _Watchdog) and watchdog.stopped_early:
+                self.stopped_early.add(pyfuncitem.nodeid)
 
-            # Get surviving objects if tracking was enabled
-            surviving_objects = None
+            # Summarize the surviving objects if tracking was enabled
+            leaked_objects = None
             if track_objects:  # pragma: no cover
-                surviving_objects = list(tracker.get_surviving_objects())
+                objects_marker = plan.mark("limit_leaked_objects")
+                assert objects_marker is not None
+                # Memray returns a tuple, which would keep every object alive
+                # until the end. A list can be emptied as it is summarized.
+                leaked_objects = _summarize_leaked_objects(
+                    list(tracker.get_surviving_objects()),
+                    objects_marker.kwargs.get("filter_fn"),
+                    retention_paths=objects_marker.kwargs.get("retention_paths", False),
+                    retained_sizes=objects_marker.kwargs.get("retained_sizes", False),
+                )
 
             try:
-                metadata = FileReader(result_file).metadata
+                reader = FileReader(result_file)
             except OSError:
                 return
-            result = Result(pyfuncitem.nodeid, metadata, result_file)
+            high_watermark_records: list[AllocationRecord] = []
+            if self._suite_flamegraph is not None or self._index_results:
+                high_watermark_records = list(
+                    reader.get_high_watermark_allocation_records(merge_threads=True)
+                )
+            result = Result(
+                pyfuncitem.nodeid,
+                reader.metadata,
+                result_file,
+                async_tasks,
+                _allocation_hotspots(reader) if self._collect_hotspots else None,
+                (
+                    high_watermark_call_sites(high_watermark_records)
+                    if self._index_results
+                    else None
+                ),
+                (
+                    high_watermark_files(high_watermark_records)
+                    if self._index_results
+                    else None
+                ),
+                settle_clock[1] - settle_clock[0] if track_objects else None,
+                child_peaks(result_file) if plan.follow_children else None,
+            )
             metadata_path = (
                 self.result_metadata_path / result_file.with_suffix(".metadata").name
             )
@@ -266,34 +1110,67 @@ class Manager:
                 pickle.dump(result, file_handler)
             self.results[pyfuncitem.nodeid] = result
 
-            # Store surviving objects separately (they can't be pickled)
-            if surviving_objects is not None:  # pragma: no cover
-                self.surviving_objects[pyfuncitem.nodeid] = surviving_objects
+            if self._suite_flamegraph is not None:
+                from .flamegraph import fold_stack
+
+                # Merge this test into the suite-wide call tree right away, so
+                # that only one capture needs to be read at a time.
+                for record in high_watermark_records:
+                    self._suite_stacks[fold_stack(record.stack_trace())] += record.size
+
+            if leaked_objects is not None:  # pragma: no cover
+                self.leaked_objects[pyfuncitem.nodeid] = leaked_objects
 
-        def _settle_tracked_objects(track_objects: bool) -> None:
+        def _settle_tracked_objects(before: GCState | None) -> None:
             # Collect cycles and drop interpreter-internal caches so that
             # objects kept alive only by them aren't reported as leaks.
-            if track_objects:
-                gc.collect()
+            if before is not None:  # pragma: no cover
+                settle_clock[0] = time.perf_counter()
+                if settle == "generational":
+                    gc.collect(_settle_generation(before))
+                else:
+                    gc.collect()
                 sys._clear_internal_caches()  # type: ignore[attr-defined]
+                settle_clock[1] = time.perf_counter()
 
         @functools.wraps(func)
         def wrapper(*args: Any, **kwargs: Any) -> Any:
-            with memory_reporting() as (tracker, track_objects):
-                with tracker:
+            # Warm-up runs fill lazily initialized caches before tracking.
+            for _ in range(warmup):
+                func(*args, **kwargs)
+            with memory_reporting() as (sampling, tracker, watchdog, track_objects):
+                before = _gc_state() if track_objects else None
+                with sampling, tracker, watchdog:
                     try:
-                        return func(*args, **kwargs)
+                        # Run every iteration from the same line, so that
+                        # their allocations get the same stacks.
+                        for iteration in range(repeat):
+                            if iteration:
+                                _mark_iteration()
+                            result = func(*args, **kwargs)
+                        return result
                     finally:
-                        _settle_tracked_objects(track_objects)
+                        _settle_tracked_objects(before)
 
         @functools.wraps(func)
         async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
-            with memory_reporting() as (tracker, track_objects):
-                with tracker:
+            for _ in range(warmup):
+                await func(*args, **kwargs)
+            with memory_reporting() as (sampling, tracker, watchdog, track_objects):
+                before = _gc_state() if track_objects else None
+                with _recording_async_tasks(
+                    async_tasks if async_tasks is not None else {}
+                ), sampling, tracker, watchdog:
                     try:
-                        return await func(*args, **kwargs)
+                        # Run every iteration from the same line, so that
+                        # their allocations get the same stacks.
+                        for iteration in range(repeat):
+                            if iteration:
+                                _mark_iteration()
+                            result = await func(*args, **kwargs)
+                        return result
                     finally:
-                        _settle_tracked_objects(track_objects)
+                        _settle_tracked_objects(before)
 
         if inspect.iscoroutinefunction(func):
             pyfuncitem.obj = async_wrapper
@@ -302,35 +1179,202 @@ class Manager:
 
         yield
 
+    def _load_results(self) -> None:
+        if not self.results and self._result_path is not None:
+            # If there are not results is because we are likely running under
+            # pytest-xdist, and the master process is not running the tests.  In
+            # this case, we can retrieve the results from the metadata directory
+            # instead, that is common for all workers.
+            import pickle
+
+            for result_file in self.result_metadata_path.glob("*.metadata"):
+                result = pickle.loads(result_file.read_bytes())
+                self.results[result.test_id] = result
+
+    def _index(self) -> dict[str, IndexEntry]:
+        return {
+            **self._unaffected_tests,
+            **{
+                test_id: IndexEntry(
+                    result.metadata.peak_memory,
+                    result.call_sites,
+                    result.files or [],
+                )
+                for test_id, result in self.results.items()
+                if result.call_sites is not None
+            },
+        }
+
+    @hookimpl
+    def pytest_sessionstart(self, session: Session) -> None:
+        if self._compare_path is not None:
+            try:
+                self._previous_index = read_index(self._compare_path)
+            except (OSError, ValueError) as exc:
+                self._previous_index_error = exc
+        if self._timeline_recorder is not None:
+            self._timeline_recorder.start()
+
+    @hookimpl
+    def pytest_runtest_logstart(self, nodeid: str) -> None:
+        if self._timeline_recorder is not None:
+            self._timeline_recorder.mark_test(nodeid)
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        workerinput = getattr(self.config, "workerinput", None)
+        if workerinput is None:
+            self._check_memory_scaling(session)
+        if self._suite_flamegraph is not None:
+            self._write_suite_flamegraph(workerinput)
+        if value_or_ini(self.config, "memray_timeline"):
+            self._collect_timelines(workerinput)
+        if workerinput is None and self._html_reports is not None:
+            self._render_html_reports(self._html_reports)
+        if workerinput is None and self.config.getvalue("memray_bin_path"):
+            self._load_results()
+            write_index(
+                self.result_path / self._prefixed_name("index.json"), self._index()
+            )
+            if self._timelines:
+                write_timelines(
+                    self._timelines,
+                    self.result_path / self._prefixed_name("timeline.json"),
+                )
+
+    def _prefixed_name(self, suffix: str) -> str:
+        name = f"{self._bin_prefix}-{suffix}"
+        if len(name.encode("utf-8")) > MAX_FILENAME_LENGTH:
+            import hashlib
+
+            digest = hashlib.sha256(self._bin_prefix.encode("utf-8")).hexdigest()
+            name = f"{digest}-{suffix}"
+        return name
+
+    def _collect_timelines(self, workerinput: dict[str, Any] | None) -> None:
+        if self._timeline_recorder is not None:
+            timeline = self._timeline_recorder.stop()
+            if workerinput is None:
+                self._timelines["main"] = timeline
+                return
+            # The controller gathers the timelines of all workers.
+            name = f"{workerinput['workerid']}.timeline"
+            write_timeline(timeline, self.result_metadata_path / name)
+            return
+        for path in sorted(self.result_metadata_path.glob("*.timeline")):
+            self._timelines[path.stem] = read_timeline(path)
+
+    def _render_html_reports(self, output_dir: Path) -> None:
+        from .reports import ReportJob
+        from .reports import render_all_reports
+
+        self._load_results()
+        test_ids = [
+            test_id for test_id in self._failed_markers if test_id in self.results
+        ]
+        if self.config.getvalue("memray_html_reports_for_summary"):
+            test_ids.extend(
+                test_id
+                for test_id in self._summary_tests()
+                if test_id not in self._failed_markers
+            )
+        if not test_ids:
+            return
+        output_dir.mkdir(parents=True, exist_ok=True)
+        self._rendered_reports = render_all_reports(
+            ReportJob(
+                test_id,
+                self.results[test_id].result_file,
+                output_dir,
+                _report_name(test_id),
+                leaks=self._failed_markers.get(test_id) == "limit_leaks",
+            )
+            for test_id in test_ids
+        )
+
+    def _summary_tests(self) -> list[str]:
+        """Return the tests shown in the summary, biggest peak first."""
+        total_sizes = collections.Counter(
+            {
+                node_id: result.metadata.peak_memory
+                for node_id, result in self.results.items()
+                if result.result_file.exists()
+            }
+        )
+        max_results = cast(int, value_or_ini(self.config, "most_allocations"))
+        if max_results == 0:
+            max_results = len(total_sizes)
+        return [test_id for test_id, _ in total_sizes.most_common(max_results)]
+
+    def _write_suite_flamegraph(self, workerinput: dict[str, Any] | None) -> None:
+        from .flamegraph import read_collapsed
+        from .flamegraph import write_collapsed
+        from .flamegraph import write_html
+
+        assert self._suite_flamegraph is not None
+        if workerinput is not None:
+            # Hand our share of the stacks over to the controller process.
+            worker_stacks = (
+                self.result_metadata_path / f"{workerinput['workerid']}.folded"
+            )
+            write_collapsed(self._suite_stacks, worker_stacks)
+            return
+        for worker_stacks in self.result_metadata_path.glob("*.folded"):
+            self._suite_stacks.update(read_collapsed(worker_stacks))
+        if self._suite_flamegraph.suffix == ".html":
+            title = "Memory at the high watermark of all tracked tests"
+            write_html(self._suite_stacks, self._suite_flamegraph, title)
+        else:
+            write_collapsed(self._suite_stacks, self._suite_flamegraph)
+
     @hookimpl(hookwrapper=True)
     def pytest_runtest_makereport(
         self, item: Item, call: CallInfo[None]
     ) -> Generator[None, TestReport | None, TestReport | None]:
         outcome = yield
-        if call.when != "call" or outcome is None:
+        if outcome is None:
             return None
+        if item.nodeid in self._scaling_of:
+            # Travels with the reports to the controller under xdist, which
+            # fits the peaks of each group once the session is over. Every
+            # report carries it, so that groups whose tests were all skipped
+            # or failed are known too.
+            outcome.get_result().memray_scaling = self._scaling_of[item.nodeid]
+        if call.when != "call":
+            return None
+        if item.nodeid in self._unaffected_tests:
+            # Travels with the report to the controller under xdist, which
+            # carries the previous index entry of the test over.
+            outcome.get_result().memray_unaffected = True
 
+        plan = self._tracking_plan(item)
+        if plan is None:
+            return None
         report = outcome.get_result()
+        result = self.results.get(item.nodeid)
+        if result is not None:
+            # Travels with the report to the controller under xdist.
+            report.memray_peak = result.metadata.peak_memory
+        if not plan.marks:
+            return None
         if report.when != "call" or report.outcome != "passed":
             return None
 
-        for marker in item.iter_markers():
-            maybe_marker_fn = MARKERS.get(marker.name)
-            if not maybe_marker_fn:
-                continue
-            marker_fn: PluginFn = cast(PluginFn, maybe_marker_fn)
-            result = self.results.get(item.nodeid)
-            if not result:
-                continue
-            # Pass surviving_objects for object tracking markers
+        if result is None:
+            return None
+        for marker in plan.marks:
+            marker_fn: PluginFn = cast(PluginFn, MARKERS[marker.name])
+            # Pass the leaked objects summary for object tracking markers
             kwargs = dict(marker.kwargs)
             if marker.name == "limit_leaked_objects":  # pragma: no cover
-                # Pop rather than get: the Manager lives for the whole session,
-                # so keeping a reference here would hold every "leaked" object
-                # (and everything it references) alive until pytest exits.
-                surviving_objects = self.surviving_objects.pop(item.nodeid, None)
-                if surviving_objects is not None:
-                    kwargs["_surviving_objects"] = surviving_objects
+                leaked_objects = self.leaked_objects.pop(item.nodeid, None)
+                if leaked_objects is not None:
+                    kwargs["_leaked_objects"] = leaked_objects
+            if marker.name in ("limit_leak_rate", "limit_memory"):
+                kwargs["_stopped_early"] = item.nodeid in self.stopped_early
+                self.stopped_early.discard(item.nodeid)
+            if marker.name == "limit_memory":
+                kwargs["_child_peaks"] = result.child_peaks or {}
 
             res = marker_fn(
                 *marker.args,
@@ -342,11 +1386,64 @@ class Manager:
             if res:
                 report.outcome = "failed"
                 report.longrepr = res.long_repr
+                # Travels with the report to the controller under xdist.
+                report.memray_marker = marker.name
                 if res.section is not None:
                     report.sections.append(res.section)
                 outcome.force_result(report)
         return None
 
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        peak = getattr(report, "memray_peak", None)
+        scaling = getattr(report, "memray_scaling", None)
+        if scaling is not None:
+            group, value, param, complexity, tolerance = scaling
+            self._scaling_groups[group] = (param, complexity, tolerance)
+            if report.when == "call" and report.passed and peak is not None:
+                self._scaling_peaks.setdefault(group, []).append((value, peak))
+        if getattr(report, "memray_unaffected", False):
+            self._unaffected_tests[report.nodeid] = self._previous_index[report.nodeid]
+        marker = getattr(report, "memray_marker", None)
+        if report.when == "call" and marker is not None:
+            self._failed_markers[report.nodeid] = marker
+        if (
+            self._live
+            and report.when == "call"
+            and peak is not None
+            and not hasattr(self.config, "workerinput")
+        ):
+            self._update_live_display(report, peak)
+
+    def _update_live_display(self, report: TestReport, peak: int) -> None:
+        worker = getattr(report, "worker_id", None) or "main"
+        self._live_bytes[worker] += peak
+        self._live_tests[worker] += 1
+        if self._live_worst is None or peak > self._live_worst[0]:
+            self._live_worst = (peak, report.nodeid)
+        now = time.monotonic()
+        if now - self._live_shown_at < self._live_interval:
+            return
+        terminalreporter = self.config.pluginmanager.get_plugin("terminalreporter")
+        if terminalreporter is None:
+            return
+        self._live_shown_at = now
+        worst_peak, worst_test = self._live_worst
+        workers = ", ".join(
+            f"{worker}: {sizeof_fmt(self._live_bytes[worker])} "
+            f"over {self._live_tests[worker]} tests"
+            for worker in sorted(self._live_bytes)
+        )
+        terminalreporter.ensure_newline()
+        if terminalreporter._tw.width_of_current_line:
+            # Under pytest-xdist the progress isn't written after a file name,
+            # so the reporter doesn't know that a line was started.
+            terminalreporter._tw.line()
+        terminalreporter.write_line(
+            f"memray: worst so far {worst_test} ({sizeof_fmt(worst_peak)}); "
+            f"{workers}"
+        )
+
     @hookimpl(hookwrapper=True, trylast=True)
     def pytest_report_teststatus(
         self, report: CollectReport | TestReport
@@ -363,22 +1460,21 @@ class Manager:
     def pytest_terminal_summary(
         self, terminalreporter: TerminalReporter, exitstatus: ExitCode
     ) -> None:
-        if value_or_ini(self.config, "hide_memray_summary") or not value_or_ini(
-            self.config, "memray"
-        ):
+        if self._scaling_failures:
+            self._report_scaling_failures(terminalreporter)
+        if value_or_ini(self.config, "hide_memray_summary"):
+            return
+        if self._timelines:
+            self._report_timelines(terminalreporter)
+        if not value_or_ini(self.config, "memray"):
             return
 
+        from memray import FileReader
+
         terminalreporter.write_line("")
         terminalreporter.write_sep("=", "MEMRAY REPORT")
 
-        if not self.results:
-            # If there are not results is because we are likely running under
-            # pytest-xdist, and the master process is not running the tests.  In
-            # this case, we can retrieve the results from the metadata directory
-            # instead, that is common for all workers.
-            for result_file in self.result_metadata_path.glob("*.metadata"):
-                result = pickle.loads(result_file.read_bytes())
-                self.results[result.test_id] = result
+        self._load_results()
 
         total_sizes = collections.Counter(
             {
@@ -399,23 +1495,180 @@ class Manager:
             records = list(func(merge_threads=True))
             if not records:
                 continue
+            threads = _group_by_thread(
+                func(merge_threads=False), reader.metadata.main_thread_id
+            )
+            tasks = None
+            if result.async_tasks:
+                tasks = _group_by_task(records, result.async_tasks)
             self._report_records_for_test(
                 records,
                 test_id=test_id,
                 metadata=reader.metadata,
                 terminalreporter=terminalreporter,
+                threads=threads,
+                tasks=tasks,
+                owners=_group_by_owner(records, project_roots(self.config)),
+                children=result.child_peaks,
             )
-        if self._tmp_dir is None:
+        max_hotspots = self._max_hotspots()
+        if max_hotspots > 0:
+            self._report_hotspots(max_hotspots, terminalreporter)
+        if self._compare_path is not None:
+            self._report_comparison(self._compare_path, max_results, terminalreporter)
+        if self._suite_flamegraph is not None:
+            terminalreporter.write_line(
+                f"Wrote the suite flame graph to {self._suite_flamegraph}"
+            )
+        self._report_settle_times(terminalreporter)
+        if self._rendered_reports:
+            self._report_html_reports(terminalreporter)
+        if self._tmp_dir is None and self._result_path is not None:
             msg = f"Created {len(total_sizes)} binary dumps at {self.result_path}"
             msg += f" with prefix {self._bin_prefix}"
             terminalreporter.write_line(msg)
 
+    def _report_scaling_failures(self, terminalreporter: TerminalReporter) -> None:
+        terminalreporter.write_line("")
+        terminalreporter.write_sep("=", "MEMRAY MEMORY SCALING FAILURES")
+        for group, info in self._scaling_failures.items():
+            terminalreporter.write_line(f"{group}: {info.long_repr}")
+            _, text = info.section
+            terminalreporter.write_line(text)
+            terminalreporter.write_line("")
+
+    def _report_timelines(self, terminalreporter: TerminalReporter) -> None:
+        terminalreporter.write_line("")
+        terminalreporter.write_sep("=", "MEMRAY SESSION TIMELINE")
+        for name, timeline in sorted(self._timelines.items()):
+            peak, offset = timeline.peak()
+            duration = timeline.times[-1]
+            line = (
+                f"{name}: {sizeof_fmt(timeline.samples[0])} -> "
+                f"{sizeof_fmt(timeline.samples[-1])} over {duration:.1f}s, "
+                f"peak {sizeof_fmt(peak)} at {offset:.1f}s"
+            )
+            test = timeline.test_at(offset)
+            if test is not None:
+                line += f" during {test}"
+            terminalreporter.write_line(line)
+            terminalreporter.write_line(f"\t{timeline.chart(_TIMELINE_CHART_WIDTH)}")
+
+    def _report_html_reports(self, terminalreporter: TerminalReporter) -> None:
+        writeln = terminalreporter.write_line
+        writeln(f"HTML reports written to {self._html_reports}:")
+        for test_id, outcome in self._rendered_reports.items():
+            if isinstance(outcome, BaseException):
+                writeln(f"\t- {test_id}: failed to render ({outcome!r})")
+                continue
+            writeln(f"\t- {test_id}:")
+            for path in outcome:
+                writeln(f"\t\t{path}")
+
+    def _report_settle_times(
+        self, terminalreporter: TerminalReporter
+    ) -> None:  # pragma: no cover
+        settle_times = {
+            test_id: result.settle_time
+            for test_id, result in self.results.items()
+            if result.settle_time is not None
+        }
+        if not settle_times:
+            return
+        slowest = max(settle_times, key=settle_times.__getitem__)
+        terminalreporter.write_line(
+            f"Settling tracked objects took {sum(settle_times.values()):.3f}s "
+            f"over {len(settle_times)} tests, at most "
+            f"{settle_times[slowest]:.3f}s for {slowest}"
+        )
+
+    def _report_comparison(
+        self, path: Path, max_results: int, terminalreporter: TerminalReporter
+    ) -> None:
+        writeln = terminalreporter.write_line
+        if self._previous_index_error is not None:
+            writeln(
+                f"Could not compare with the previous run at {path}: "
+                f"{self._previous_index_error}"
+            )
+            return
+        previous = self._previous_index
+        current = self._index()
+        changes = diff_indexes(previous, current)
+        writeln(f"Peak memory compared to the previous run at {path}")
+        writeln("")
+        if self._changed_files is not None:
+            writeln(
+                f"\t 🎯 Skipped tracking {len(self._unaffected_tests)} tests "
+                f"not affected by the files listed in {self._changed_files}"
+            )
+        writeln(
+            f"\t 🔁 {len(changes)} of {len(current.keys() & previous.keys())} "
+            "tests in both runs changed their peak memory"
+        )
+        new_tests = len(current.keys() - previous.keys())
+        if new_tests:
+            writeln(f"\t 🆕 {new_tests} tests were not in the previous run")
+        for change in islice(changes, max_results):
+            sign = "+" if change.delta > 0 else "-"
+            percentage = (
+                f", {sign}{abs(change.delta) / change.old_peak:.1%}"
+                if change.old_peak
+                else ""
+            )
+            writeln(
+                f"\t\t- {change.test_id}: {sizeof_fmt(change.old_peak)} -> "
+                f"{sizeof_fmt(change.new_peak)} "
+                f"({sign}{sizeof_fmt(abs(change.delta))}{percentage})"
+            )
+            for (function, file, line), growth in islice(change.grown_call_sites, 3):
+                writeln(
+                    f"\t\t\t  {function}:{file}:{line} grew by {sizeof_fmt(growth)}"
+                )
+        writeln("\n")
+
+    def _max_hotspots(self) -> int:
+        # Unset ini values come back as an empty string
+        return int(cast(int, value_or_ini(self.config, "allocation_hotspots")) or 0)
+
+    def _report_hotspots(
+        self, max_hotspots: int, terminalreporter: TerminalReporter
+    ) -> None:
+        counts: collections.Counter[CallSite] = collections.Counter()
+        sizes: collections.Counter[CallSite] = collections.Counter()
+        for result in self.results.values():
+            for call_site, (count, size) in (result.hotspots or {}).items():
+                counts[call_site] += count
+                sizes[call_site] += size
+        if not counts:
+            return
+
+        writeln = terminalreporter.write_line
+        writeln(f"Allocation hot spots across {len(self.results)} tests")
+        writeln("")
+        writeln("\t 🔥 Most allocations:")
+        for (function, file, line), count in counts.most_common(max_hotspots):
+            total = sizeof_fmt(sizes[function, file, line])
+            writeln(f"\t\t- {function}:{file}:{line} -> {count} allocations ({total})")
+        writeln("\t 💰 Most bytes allocated:")
+        for (function, file, line), size in sizes.most_common(max_hotspots):
+            count = counts[function, file, line]
+            writeln(
+                f"\t\t- {function}:{file}:{line} -> {sizeof_fmt(size)} "
+                f"({count} allocations)"
+            )
+        writeln("\n")
+
     @staticmethod
     def _report_records_for_test(
         records: Iterable[AllocationRecord],
         test_id: str,
         metadata: Metadata,
         terminalreporter: TerminalReporter,
+        threads: list[_ThreadUsage] | None = None,
+        tasks: list[_TaskUsage] | None = None,
+        owners: list[_OwnerUsage] | None = None,
+        children: dict[int, int] | None = None,
     ) -> None:
         writeln = terminalreporter.write_line
         writeln(f"Allocation results for {test_id} at the high watermark")
@@ -437,6 +1690,50 @@ class Manager:
                 continue
             (function, file, line), *_ = stack_trace
             writeln(f"\t\t- {function}:{file}:{line} -> {sizeof_fmt(record.size)}")
+        if threads is not None and len(threads) > 1:
+            writeln("\t 🧵 Memory by thread:")
+            for usage in islice(threads, N_TOP_ALLOCS):
+                writeln(
+                    f"\t\t- {usage.label} -> {sizeof_fmt(usage.total_memory)} "
+                    f"in {usage.n_allocations} allocation(s)"
+                )
+                for record in islice(usage.allocations, 1):
+                    stack_trace = record.stack_trace()
+                    if stack_trace:
+                        (function, file, line), *_ = stack_trace
+                        writeln(f"\t\t\t  top site: {function}:{file}:{line}")
+        if owners:
+            writeln("\t 🏠 Biggest allocating first-party functions:")
+            for owner_usage in islice(owners, N_TOP_ALLOCS):
+                writeln(
+                    f"\t\t- {owner_usage.label} -> "
+                    f"{sizeof_fmt(owner_usage.total_memory)}"
+                )
+        allocators = _group_by_allocator(sorted_records)
+        if len(allocators) > 1:
+            writeln("\t 🧮 Memory by allocator:")
+            for allocator_usage in allocators:
+                writeln(
+                    f"\t\t- {allocator_usage.kind} -> "
+                    f"{sizeof_fmt(allocator_usage.total_memory)} "
+                    f"in {allocator_usage.n_allocations} allocation(s)"
+                )
+        if tasks:
+            writeln("\t 🔀 Memory by asyncio task:")
+            for task_usage in islice(tasks, N_TOP_ALLOCS):
+                writeln(
+                    f"\t\t- {task_usage.label} -> "
+                    f"{sizeof_fmt(task_usage.total_memory)} "
+                    f"in {task_usage.n_allocations} allocation(s)"
+                )
+        if children:
+            writeln(
+                f"\t 👪 Peak memory of {len(children)} child process(es): "
+                f"{sizeof_fmt(sum(children.values()))} in total"
+            )
+            largest = sorted(children.items(), key=lambda child: child[1], reverse=True)
+            for pid, peak in islice(largest, N_TOP_ALLOCS):
+                writeln(f"\t\t- pid {pid} -> {sizeof_fmt(peak)}")
         writeln("\n")
 
 
@@ -459,6 +1756,97 @@ def pytest_addoption(parser: Parser) -> None:
         default=None,
         help="Prefix to use for the binary dump (by default a random UUID4 hex)",
     )
+    group.addoption(
+        "--memray-compare",
+        default=None,
+        help="Compare the peak memory of each test with a previous run, given the "
+        "--memray-bin-path directory or the index file it wrote",
+    )
+    group.addoption(
+        "--memray-changed-files",
+        default=None,
+        help="Only track tests whose memory profile in the --memray-compare run "
+        "touches one of the files listed (one per line) in this file",
+    )
+    group.addoption(
+        "--memray-suite-flamegraph",
+        default=None,
+        help="Merge the high watermark stacks of all tests into a single flame graph "
+        "written to this path (HTML if it ends in .html, collapsed stacks otherwise)",
+    )
+    group.addoption(
+        "--memray-project-root",
+        action="append",
+        default=None,
+        help="A directory holding first-party code. Allocations are attributed to "
+        "the innermost frame inside one of these (can be given several times)",
+    )
+    group.addoption(
+        "--memray-settle",
+        choices=["full", "generational"],
+        default=None,
+        help="How to collect cycles before looking for objects leaked by "
+        "limit_leaked_objects tests: a full collection, or only the "
+        "generations that the test could have filled (faster on big heaps)",
+    )
+    group.addoption(
+        "--memray-html-reports",
+        default=None,
+        help="Render memray's HTML flame graph and table reports for every test "
+        "that fails a memray marker into this directory",
+    )
+    group.addoption(
+        "--memray-html-reports-for-summary",
+        action="store_true",
+        default=False,
+        help="Also render HTML reports for the tests shown in the memray summary",
+    )
+    group.addoption(
+        "--memray-budgets",
+        default=None,
+        help="Apply memray markers to the tests matching the patterns in this file "
+        "(one 'PATTERN marker(...)' per line), unless they have one already",
+    )
+    group.addoption(
+        "--memray-abort-at",
+        type=float,
+        default=None,
+        help="Stop a limit_memory test as soon as the process grew by more than "
+        "this many times its limit, instead of letting it run to the end",
+    )
+    group.addoption(
+        "--memray-timeline",
+        action="store_true",
+        default=None,
+        help="Sample the memory of each process over the whole session, and show "
+        "when it peaked and which test was running",
+    )
+    group.addoption(
+        "--memray-timeline-interval",
+        type=float,
+        default=0.1,
+        help="Sample the memory for --memray-timeline every N seconds (default 0.1)",
+    )
+    group.addoption(
+        "--memray-follow-children",
+        action="store_true",
+        default=None,
+        help="Also track the processes that tracked tests fork, and the Python "
+        "processes they start, with one capture per process",
+    )
+    group.addoption(
+        "--memray-live",
+        action="store_true",
+        default=None,
+        help="Show the test with the highest peak memory so far, and the memory "
+        "of the tests run by each worker, while the tests run",
+    )
+    group.addoption(
+        "--memray-live-interval",
+        type=float,
+        default=5.0,
+        help="Show the live memory display at most every N seconds (default 5)",
+    )
     group.addoption(
         "--hide-memray-summary",
         action="store_true",
@@ -471,6 +1859,13 @@ def pytest_addoption(parser: Parser) -> None:
         default=5,
         help="Show the N tests that allocate most memory (N=0 for all)",
     )
+    group.addoption(
+        "--allocation-hotspots",
+        type=int,
+        default=None,
+        help="Show the N call sites that allocate most often, and the N that "
+        "allocate the most bytes, across all tests (will be slower)",
+    )
     group.addoption(
         "--stacks",
         type=positive_int,
@@ -490,6 +1885,13 @@ def pytest_addoption(parser: Parser) -> None:
         default=False,
         help="Record allocations made by the Pymalloc allocator (will be slower)",
     )
+    group.addoption(
+        "--track-async-tasks",
+        action="store_true",
+        default=False,
+        help="Attribute the memory used by async tests to the asyncio tasks "
+        "that allocated it",
+    )
     group.addoption(
         "--fail-on-increase",
         action="store_true",
@@ -498,6 +1900,44 @@ def pytest_addoption(parser: Parser) -> None:
     )
 
     parser.addini("memray", "Activate pytest.ini setting", type="bool")
+    parser.addini(
+        "memray_project_roots",
+        help="Directories holding first-party code. Allocations are attributed to "
+        "the innermost frame inside one of these",
+        type="paths",
+    )
+    parser.addini(
+        "memray_settle",
+        help="How to collect cycles before looking for objects leaked by "
+        "limit_leaked_objects tests (full or generational)",
+        default="full",
+    )
+    parser.addini(
+        "memray_budgets",
+        "Apply memray markers to the tests matching these patterns "
+        "(one 'PATTERN marker(...)' per line), unless they have one already",
+        type="linelist",
+    )
+    parser.addini(
+        "memray_abort_at",
+        "Stop a limit_memory test as soon as the process grew by more than "
+        "this many times its limit",
+    )
+    parser.addini(
+        "memray_timeline",
+        "Sample the memory of each process over the whole session",
+        type="bool",
+    )
+    parser.addini(
+        "memray_follow_children",
+        "Also track the processes started by tracked tests",
+        type="bool",
+    )
+    parser.addini(
+        "memray_live",
+        "Show the peak memory of the tests while they run",
+        type="bool",
+    )
     parser.addini(
         "hide_memray_summary",
         "Hide the memray summary at the end of the execution",
@@ -519,6 +1959,12 @@ def pytest_addoption(parser: Parser) -> None:
         help="Record allocations made by the Pymalloc allocator (will be slower)",
         type="bool",
     )
+    parser.addini(
+        "track_async_tasks",
+        help="Attribute the memory used by async tests to the asyncio tasks "
+        "that allocated it",
+        type="bool",
+    )
     parser.addini(
         "fail-on-increase",
         help="Fail a test with the limit_memory marker if it uses more memory than its last successful run",
@@ -537,6 +1983,11 @@ def pytest_addoption(parser: Parser) -> None:
     )
     help_msg = "Show the N tests that allocate most memory (N=0 for all)"
     parser.addini("most_allocations", help_msg)
+    parser.addini(
+        "allocation_hotspots",
+        "Show the N call sites that allocate most often, and the N that "
+        "allocate the most bytes, across all tests (will be slower)",
+    )
 
 
 def pytest_configure(config: Config) -> None:
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import ast
+import inspect
+import re
+from dataclasses import dataclass
+from dataclasses import field
+from typing import Iterable
+from typing import Optional
+from typing import cast
+
+import pytest
+from pytest import MarkDecorator
+
+from . import marks
+
+# The markers a budget policy can apply. The others need arguments that can't
+# be written in a policy, or only make sense on specific tests.
+POLICY_MARKERS = frozenset(
+    {"limit_memory", "limit_leaks", "limit_allocations", "limit_leak_rate"}
+)
+
+
+@dataclass
+class _Node:
+    """A node of the pattern trie, reached by matching some leading components."""
+
+    literals: dict[str, _Node] = field(default_factory=dict)
+    globs: list[tuple[re.Pattern[str], _Node]] = field(default_factory=list)
+    # The node reached through a ``**`` component, which matches any number of
+    # components (including none).
+    anything: Optional[_Node] = None
+    # Whether this node is reached through ``**``, and so is reached again by
+    # every further component.
+    repeats: bool = False
+    # The budgets of the patterns that end here, by their position in the policy.
+    budgets: list[tuple[int, MarkDecorator]] = field(default_factory=list)
+
+
+def _split_nodeid(nodeid: str) -> list[str]:
+    """Split a node id (or pattern) into its directories, file and names."""
+    path, *names = nodeid.split("::")
+    return path.split("/") + names
+
+
+def _compile_glob(component: str) -> re.Pattern[str]:
+    # Only * and ? are special, as the brackets of parametrize ids are common.
+    regex = "".join(
+        ".*" if char == "*" else "." if char == "?" else re.escape(char)
+        for char in component
+    )
+    return re.compile(regex, re.DOTALL)
+
+
+def parse_budget(text: str) -> MarkDecorator:
+    """Parse a marker call such as ``limit_memory("10 MB")``."""
+    try:
+        call = ast.parse(text.strip(), mode="eval").body
+    except SyntaxError:
+        raise ValueError(f"{text!r} is not a marker call") from None
+    if not (
+        isinstance(call, ast.Call)
+        and isinstance(call.func, ast.Name)
+        and call.func.id in POLICY_MARKERS
+    ):
+        raise ValueError(
+            f"{text!r} is not a call to one of {', '.join(sorted(POLICY_MARKERS))}"
+        )
+    try:
+        args = [ast.literal_eval(arg) for arg in call.args]
+        kwargs = {
+            keyword.arg: ast.literal_eval(keyword.value)
+            for keyword in call.keywords
+            if keyword.arg is not None
+        }
+    except ValueError:
+        raise ValueError(f"the arguments of {text!r} must be literals") from None
+    # Check the arguments now, as they would only fail once a test is tracked.
+    signature = inspect.signature(getattr(marks, call.func.id))
+    try:
+        if any(name.startswith("_") for name in kwargs):
+            raise TypeError("private arguments can't be given")
+        bound = signature.bind_partial(*args, **kwargs)
+    except TypeError as exc:
+        raise ValueError(f"invalid arguments in {text!r}: {exc}") from None
+    missing = [
+        name
+        for name, parameter in signature.parameters.items()
+        if parameter.default is parameter.empty
+        and not name.startswith("_")
+        and name not in bound.arguments
+    ]
+    if missing:
+        raise ValueError(f"{text!r} is missing {', '.join(missing)}")
+    return cast(MarkDecorator, getattr(pytest.mark, call.func.id)(*args, **kwargs))
+
+
+class BudgetPolicy:
+    """Memory budgets applied to the tests whose node ids match a pattern.
+
+    Each line of the policy is a pattern followed by a marker call, e.g.
+    ``tests/io limit_memory("100 MB")``. A pattern is split into components
+    at ``/`` and ``::``, and applies to every test whose leading components it
+    matches, so directories and modules cover the tests inside them. Within a
+    component, ``*`` matches anything and ``?`` any one character, while a
+    ``**`` component matches any number of components. A test function also
+    covers its parametrizations. When several patterns match a test, the last
+    one wins.
+
+    The patterns are compiled into a trie of their components, so that
+    matching a test only follows the components of its node id.
+    """
+
+    def __init__(self) -> None:
+        self._root = _Node()
+        self.size = 0
+
+    def add_lines(self, lines: Iterable[str], source: str) -> None:
+        """Add the budgets of a policy, read from *source* (used in errors)."""
+        for number, line in enumerate(lines, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            pattern, _, budget = line.partition(" ")
+            try:
+                mark = parse_budget(budget)
+            except ValueError as exc:
+                raise ValueError(
+                    f"Invalid memray budget at {source}:{number}: {exc}"
+                ) from None
+            self.size += 1
+            self._add(pattern, self.size, mark)
+
+    def _add(self, pattern: str, position: int, mark: MarkDecorator) -> None:
+        node = self._root
+        for component in _split_nodeid(pattern):
+            if component == "**":
+                if node.anything is None:
+                    node.anything = _Node(repeats=True)
+                node = node.anything
+            elif "*" in component or "?" in component:
+                regex = _compile_glob(component)
+                for existing, child in node.globs:
+                    if existing.pattern == regex.pattern:
+                        node = child
+                        break
+                else:
+                    child = _Node()
+                    node.globs.append((regex, child))
+                    node = child
+            else:
+                node = node.literals.setdefault(component, _Node())
+        node.budgets.append((position, mark))
+
+    @staticmethod
+    def _with_anything(nodes: Iterable[_Node]) -> list[_Node]:
+        """Add the nodes that a ``**`` matching no component leads to."""
+        expanded: dict[int, _Node] = {}
+        for node in nodes:
+            current: _Node | None = node
+            while current is not None and id(current) not in expanded:
+                expanded[id(current)] = current
+                current = current.anything
+        return list(expanded.values())
+
+    def match(self, nodeid: str) -> MarkDecorator | None:
+        """Return the budget that applies to a test, if any."""
+        best: tuple[int, MarkDecorator] | None = None
+        active = self._with_anything([self._root])
+        for component in _split_nodeid(nodeid):
+            # A test function covers its parametrizations.
+            names = {component, component.partition("[")[0]}
+            reached = []
+            for node in active:
+                for name in names:
+                    child = node.literals.get(name)
+                    if child is not None:
+                        reached.append(child)
+                for regex, child in node.globs:
+                    if any(regex.fullmatch(name) for name in names):
+                        reached.append(child)
+            reached.extend(node for node in active if node.repeats)
+            active = self._with_anything(reached)
+            if not active:
+                break
+            for node in active:
+                for budget in node.budgets:
+                    if best is None or budget[0] > best[0]:
+                        best = budget
+        return best[1] if best is not None else None
+
+
+__all__ = [
+    "BudgetPolicy",
+    "POLICY_MARKERS",
+    "parse_budget",
+]
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+from memray import FileReader
+from memray.reporters.flamegraph import FlameGraphReporter
+from memray.reporters.table import TableReporter
+
+# The memray reporters to render for each test, by the suffix of the file
+# they are written to.
+REPORTERS: dict[str, type[FlameGraphReporter] | type[TableReporter]] = {
+    "flamegraph": FlameGraphReporter,
+    "table": TableReporter,
+}
+
+
+@dataclass
+class ReportJob:
+    """The HTML reports to render for one test."""
+
+    test_id: str
+    result_file: Path
+    output_dir: Path
+    # What the names of the report files start with.
+    name: str
+    # Show what leaked rather than what was alive at the high watermark.
+    leaks: bool
+
+
+def render_reports(job: ReportJob) -> list[Path]:
+    """Render every reporter for one test, and return the files written."""
+    reader = FileReader(job.result_file)
+    if job.leaks:
+        records = list(reader.get_leaked_allocation_records(merge_threads=True))
+    else:
+        records = list(reader.get_high_watermark_allocation_records(merge_threads=True))
+    memory_records = tuple(reader.get_memory_snapshots())
+    written = []
+    for name, reporter_type in REPORTERS.items():
+        reporter = reporter_type.from_snapshot(
+            records,
+            memory_records=memory_records,
+            native_traces=reader.metadata.has_native_traces,
+        )
+        path = job.output_dir / f"{job.name}-{name}.html"
+        with open(path, "w", encoding="utf-8") as file:
+            reporter.render(
+                outfile=file,
+                metadata=reader.metadata,
+                show_memory_leaks=job.leaks,
+                merge_threads=True,
+                inverted=False,
+                no_web=True,
+            )
+        written.append(path)
+    return written
+
+
+def render_all_reports(
+    jobs: Iterable[ReportJob], max_workers: int | None = None
+) -> dict[str, list[Path] | BaseException]:
+    """Render the reports of several tests in a pool of processes.
+
+    Return the files written for each test, or the exception that stopped
+    its reports from being rendered.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return {}
+    # Forking a process that runs threads (as pytest plugins often do) can
+    # deadlock, so the workers start from scratch.
+    context = multiprocessing.get_context("spawn")
+    outcomes: dict[str, list[Path] | BaseException] = {}
+    with ProcessPoolExecutor(
+        max_workers=min(len(jobs), max_workers or multiprocessing.cpu_count()),
+        mp_context=context,
+    ) as pool:
+        futures = [(job, pool.submit(render_reports, job)) for job in jobs]
+        for job, future in futures:
+            try:
+                outcomes[job.test_id] = future.result()
+            except Exception as exc:
+                outcomes[job.test_id] = exc
+    return outcomes
+
+
+__all__ = [
+    "ReportJob",
+    "render_all_reports",
+    "render_reports",
+]
@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+import gc
+import sys
+from types import FrameType
+from typing import Iterable
+
+# How far from the leaked object, and through how many referrers in total, to
+# look for what keeps it alive before giving up.
+MAX_RETENTION_DEPTH = 12
+MAX_RETENTION_VISITS = 10_000
+
+
+def _module_dicts() -> dict[int, str]:
+    """Map the id of the globals of each imported module to its name."""
+    return {
+        id(vars(module)): name
+        for name, module in list(sys.modules.items())
+        if module is not None and hasattr(module, "__dict__")
+    }
+
+
+def _is_root(obj: object, module_dicts: dict[int, str]) -> bool:
+    return id(obj) in module_dicts or isinstance(obj, (type, FrameType))
+
+
+def find_retention_path(
+    target: object, ignored: Iterable[object] = ()
+) -> list[object] | None:
+    """Find the shortest chain of references keeping *target* alive.
+
+    The referrers of *target* are searched breadth first until a module's
+    globals, a class or a frame is found. The returned chain starts at that
+    root and ends at *target*. Objects in *ignored*, the frames of the
+    caller's stack and the containers used by the search itself are never
+    considered as referrers.
+    """
+    module_dicts = _module_dicts()
+    ignored_ids = {id(obj) for obj in ignored}
+    frame: FrameType | None = sys._getframe()
+    while frame is not None:
+        ignored_ids.add(id(frame))
+        frame = frame.f_back
+
+    came_from: dict[int, object] = {}
+    visited = {id(target)}
+    frontier: tuple[object, ...] = (target,)
+    # The lists returned by gc.get_referrers() are kept alive until the end,
+    # so that their ids can't be reused by an object we should look at.
+    searched: list[object] = []
+    ignored_ids.update({id(came_from), id(searched)})
+    for _ in range(MAX_RETENTION_DEPTH):
+        # Each call to gc.get_referrers() walks the whole heap, so the
+        # referrers of a whole level are found at once, and each one is
+        # matched back to the object it refers to from its own referents.
+        by_id = {id(node): node for node in frontier}
+        searched.append(frontier)
+        searched.append(by_id)
+        ignored_ids.update({id(frontier), id(by_id)})
+        referrers = gc.get_referrers(*frontier)
+        searched.append(referrers)
+        ignored_ids.add(id(referrers))
+        next_frontier: list[object] = []
+        ignored_ids.add(id(next_frontier))
+        for referrer in referrers:
+            if id(referrer) in visited or id(referrer) in ignored_ids:
+                continue
+            node = next(
+                (
+                    referent
+                    for referent in gc.get_referents(referrer)
+                    if id(referent) in by_id
+                ),
+                None,
+            )
+            if node is None:  # pragma: no cover
+                continue
+            visited.add(id(referrer))
+            came_from[id(referrer)] = node
+            if _is_root(referrer, module_dicts):
+                chain = [referrer]
+                while chain[-1] is not target:
+                    chain.append(came_from[id(chain[-1])])
+                return chain
+            if len(visited) > MAX_RETENTION_VISITS:
+                return None
+            next_frontier.append(referrer)
+        frontier = tuple(next_frontier)
+        if not frontier:
+            break
+    return None
+
+
+def _edge_label(parent: object, child: object, namespace: bool) -> str:
+    """Describe how *parent* refers to *child*."""
+    if isinstance(parent, dict):
+        for key, value in parent.items():
+            if value is child:
+                if namespace and isinstance(key, str):
+                    return f".{key}"
+                return f"[{key!r}]"
+        return ".keys()"
+    if isinstance(parent, (list, tuple)):
+        for index, value in enumerate(parent):
+            if value is child:
+                return f"[{index}]"
+    if isinstance(parent, FrameType):
+        for name, value in parent.f_locals.items():
+            if value is child:
+                return f".f_locals[{name!r}]"
+    for frame_attribute in ("gi_frame", "cr_frame", "ag_frame"):
+        frame = getattr(parent, frame_attribute, None)
+        if isinstance(frame, FrameType):
+            for name, value in frame.f_locals.items():
+                if value is child:
+                    return f".{frame_attribute}.f_locals[{name!r}]"
+    for name, value in getattr(parent, "__dict__", {}).items():
+        if value is child:
+            return f".{name}"
+    return f" <in {type(parent).__name__}>"
+
+
+def format_retention_path(chain: list[object]) -> str:
+    """Format a chain returned by `find_retention_path` as an access path."""
+    module_dicts = _module_dicts()
+    root = chain[0]
+    if id(root) in module_dicts:
+        text = module_dicts[id(root)]
+    elif isinstance(root, type):
+        text = f"{root.__module__}.{root.__qualname__}"
+    elif isinstance(root, FrameType):
+        text = (
+            f"<frame of {root.f_code.co_name} at "
+            f"{root.f_code.co_filename}:{root.f_lineno}>"
+        )
+    else:  # pragma: no cover
+        text = f"<{type(root).__name__}>"
+
+    for index in range(1, len(chain)):
+        parent, child = chain[index - 1], chain[index]
+        # Attribute lookups go through the namespace dict of an object, which
+        # is shown as a plain attribute access in the next step.
+        if isinstance(child, dict) and (
+            isinstance(parent, type) or getattr(parent, "__dict__", None) is child
+        ):
+            continue
+        grandparent = chain[index - 2] if index >= 2 else None
+        namespace = id(parent) in module_dicts or (
+            isinstance(parent, dict)
+            and (
+                isinstance(grandparent, type)
+                or getattr(grandparent, "__dict__", None) is parent
+            )
+        )
+        text += _edge_label(parent, child, namespace)
+    return text
+
+
+__all__ = [
+    "find_retention_path",
+    "format_retention_path",
+]
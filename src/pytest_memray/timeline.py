@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import sys
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import asdict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+from typing import Generator
+from typing import Mapping
+
+# How many samples a timeline keeps. Once they are all used, every other one
+# is dropped and the interval doubles, so that a session of any length fits.
+TIMELINE_CAPACITY = 4096
+
+_BARS = "▁▂▃▄▅▆▇█"
+
+
+class ResidentMemory:
+    """Read how much memory the process uses, without allocating memory.
+
+    This is read from background threads while tests are tracked, and memray
+    tracks every thread, so anything allocated here would be charged to the
+    test. /proc/self/statm is opened once and read into a preallocated buffer,
+    which is parsed in place. Each thread needs its own reader.
+    """
+
+    def __init__(self) -> None:
+        self._buffer = bytearray(256)
+        self._buffers = [self._buffer]
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+        self._fd: int | None = None
+        try:
+            self._fd = os.open("/proc/self/statm", os.O_RDONLY)
+        except OSError:  # pragma: no cover
+            pass
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    def __call__(self) -> int:
+        if self._fd is None:  # pragma: no cover
+            import resource
+
+            # Only the peak is known here, which is never below the current
+            # usage.
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+        buffer = self._buffer
+        os.preadv(self._fd, self._buffers, 0)
+        # The resident size is the second field, after the total program size.
+        index = buffer.index(b" ") + 1
+        pages = 0
+        while buffer[index] != 0x20:
+            pages = pages * 10 + buffer[index] - 0x30
+            index += 1
+        return pages * self._page_size
+
+
+@dataclass
+class Timeline:
+    """The memory of one process over a session, sampled at a fixed interval."""
+
+    interval: float
+    samples: list[int]
+    # When each sample was taken, and when each test started, in seconds since
+    # the session started.
+    times: list[float]
+    tests: list[tuple[float, str]]
+
+    def test_at(self, offset: float) -> str | None:
+        """Return the test that was running *offset* seconds into the session."""
+        index = bisect.bisect_right([start for start, _ in self.tests], offset)
+        return self.tests[index - 1][1] if index else None
+
+    def peak(self) -> tuple[int, float]:
+        """Return the highest sample, and how far into the session it was taken."""
+        index = max(range(len(self.samples)), key=self.samples.__getitem__)
+        return self.samples[index], self.times[index]
+
+    def chart(self, width: int) -> str:
+        """Draw the samples as a line of bars, each the peak of its stretch."""
+        count = len(self.samples)
+        parts = min(width, count)
+        peaks = [
+            max(self.samples[part * count // parts : (part + 1) * count // parts])
+            for part in range(parts)
+        ]
+        # The bars start at zero, so that small wobbles don't look like spikes.
+        scale = max(peaks) or 1
+        return "".join(_BARS[value * (len(_BARS) - 1) // scale] for value in peaks)
+
+
+class TimelineRecorder:
+    """Sample the memory of this process from a background thread.
+
+    Memray tracks every thread, so samples taken while a test is tracked would
+    be charged to the test. Sampling is paused for that time instead, and the
+    peak resident memory of the process is recorded when it resumes if it
+    rose meanwhile, or else its current resident memory. The samples go into preallocated
+    arrays, so that keeping them doesn't make the session grow.
+    """
+
+    def __init__(self, interval: float, capacity: int = TIMELINE_CAPACITY) -> None:
+        self._interval = interval
+        self._samples = array("q", bytes(8 * capacity))
+        self._times = array("d", bytes(8 * capacity))
+        self._count = 0
+        self._tests: list[tuple[float, str]] = []
+        self._start = 0.0
+        # Released to stop the thread. Waiting on a bare lock, unlike an Event,
+        # runs no Python code that could allocate when the thread wakes up.
+        self._done = threading.Lock()
+        self._done.acquire()
+        # Held by the thread while it samples, and while sampling is paused.
+        self._sampling = threading.Lock()
+        self._resident_memory = ResidentMemory()
+        self._thread = threading.Thread(
+            target=self._record, name="memray-timeline", daemon=True
+        )
+
+    def start(self) -> None:
+        self._start = time.monotonic()
+        self._thread.start()
+
+    def stop(self) -> Timeline:
+        self._done.release()
+        self._thread.join()
+        self._resident_memory.close()
+        return Timeline(
+            self._interval,
+            self._samples[: self._count].tolist(),
+            self._times[: self._count].tolist(),
+            self._tests,
+        )
+
+    def mark_test(self, nodeid: str) -> None:
+        """Record that a test starts now."""
+        self._tests.append((time.monotonic() - self._start, nodeid))
+
+    @contextmanager
+    def paused(self) -> Generator[None, None, None]:
+        """Take no samples inside, then record the peak reached meanwhile."""
+        self._sampling.acquire()
+        try:
+            peak_before = _peak_resident_memory()
+            yield
+            peak = _peak_resident_memory()
+            # The peak of the process only tells what happened meanwhile if
+            # it rose then, as it can't be reset without affecting everything
+            # else that reads it.
+            if peak is None or peak_before is None or peak <= peak_before:
+                peak = self._resident_memory()
+            self._add_sample(peak)
+        finally:
+            self._sampling.release()
+
+    def _add_sample(self, value: int) -> None:
+        if self._count == len(self._samples):
+            # Keep every other sample, and take them half as often.
+            self._count = (len(self._samples) + 1) // 2
+            self._samples[: self._count] = self._samples[::2]
+            self._times[: self._count] = self._times[::2]
+            self._interval *= 2
+        self._times[self._count] = time.monotonic() - self._start
+        self._samples[self._count] = value
+        self._count += 1
+
+    def _record(self) -> None:
+        next_sample = self._start
+        while True:
+            with self._sampling:
+                self._add_sample(self._resident_memory())
+            # Sample on a fixed schedule rather than sleeping for the interval,
+            # so that the time it takes to sample doesn't add up, but don't
+            # catch up on the samples missed while paused.
+            next_sample = max(next_sample + self._interval, time.monotonic())
+            if self._done.acquire(timeout=max(0.0, next_sample - time.monotonic())):
+                return
+
+
+def _peak_resident_memory() -> int | None:
+    """Return the peak resident memory of the process since it started."""
+    try:
+        with open("/proc/self/status", "rb") as status:
+            for line in status:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:  # pragma: no cover
+        pass
+    return None  # pragma: no cover
+
+
+def _from_json(data: Mapping[str, Any]) -> Timeline:
+    return Timeline(
+        data["interval"],
+        data["samples"],
+        data["times"],
+        [(start, nodeid) for start, nodeid in data["tests"]],
+    )
+
+
+def write_timeline(timeline: Timeline, path: Path) -> None:
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(asdict(timeline), file)
+
+
+def read_timeline(path: Path) -> Timeline:
+    with open(path, encoding="utf-8") as file:
+        return _from_json(json.load(file))
+
+
+def write_timelines(timelines: Mapping[str, Timeline], path: Path) -> None:
+    """Export the timeline of each process, by name, into a single JSON file."""
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(
+            {name: asdict(timelines[name]) for name in sorted(timelines)},
+            file,
+            indent=1,
+        )
+
+
+def read_timelines(path: Path) -> dict[str, Timeline]:
+    """Read back timelines written by `write_timelines`."""
+    with open(path, encoding="utf-8") as file:
+        return {name: _from_json(data) for name, data in json.load(file).items()}
+
+
+__all__ = [
+    "ResidentMemory",
+    "Timeline",
+    "TimelineRecorder",
+    "read_timeline",
+    "read_timelines",
+    "write_timeline",
+    "write_timelines",
+]
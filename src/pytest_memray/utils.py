@@ -46,6 +46,30 @@ def parse_memory_string(mem_str: str) -> float:
     return float(quantity) * UNIT_TO_MULTIPLIER[unit.upper()]
 
 
+RATE_REGEXP = re.compile(r"(?P<size>.+?)\s*/\s*(?P<unit>[a-z]+)", re.IGNORECASE)
+TIME_UNIT_TO_SECONDS = {
+    "s": 1,
+    "sec": 1,
+    "second": 1,
+    "m": 60,
+    "min": 60,
+    "minute": 60,
+    "h": 3600,
+    "hour": 3600,
+}
+
+
+def parse_rate_string(rate_str: str) -> float:
+    """Parse a memory growth rate like ``1MB/min`` into bytes per second."""
+    match = RATE_REGEXP.fullmatch(rate_str.strip())
+    if not match:
+        raise ValueError(f"Invalid memory rate format: {rate_str}")
+    seconds = TIME_UNIT_TO_SECONDS.get(match["unit"].lower())
+    if seconds is None:
+        raise ValueError(f"Invalid memory rate format: {rate_str}")
+    return parse_memory_string(match["size"]) / seconds
+
+
 def value_or_ini(config: Config, key: str) -> object:
     value = config.getvalue(key)
     if value is not None:
@@ -90,6 +114,7 @@ def positive_int(value: str) -> int:
 __all__ = [
     "WriteEnabledDirectoryAction",
     "parse_memory_string",
+    "parse_rate_string",
     "sizeof_fmt",
     "value_or_ini",
     "positive_int",
@@ -1,3 +1,16 @@
 from __future__ import annotations
 
+# The plugin only imports memray once a test is tracked. Import it up front so
+# that pytester's in-process runs, which drop the modules they imported when
+# they finish, never load memray's Python modules twice over one native module.
+import memray  # noqa: F401
+import pytest
+
 pytest_plugins = "pytester"
+
+
+@pytest.fixture(autouse=True)
+def _own_result_path(monkeypatch: pytest.MonkeyPatch) -> None:
+    # When this suite runs under pytest-xdist, its workers inherit the result
+    # directory of its controller. The runs made by the tests must not share it.
+    monkeypatch.delenv("MEMRAY_RESULT_PATH", raising=False)
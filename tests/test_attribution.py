@@ -0,0 +1,26 @@
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from pytest_memray.attribution import ProjectRoots
+
+
+def test_owns(tmp_path: Path) -> None:
+    roots = ProjectRoots([tmp_path / "app"])
+
+    assert roots.owns(str(tmp_path / "app" / "main.py"))
+    assert not roots.owns(str(tmp_path / "application.py"))
+    assert not roots.owns(str(tmp_path / "app" / ".venv" / "site-packages" / "x.py"))
+
+
+def test_owns_through_symlinks(tmp_path: Path) -> None:
+    (tmp_path / "real" / "app").mkdir(parents=True)
+    (tmp_path / "real" / "app" / "main.py").touch()
+    os.symlink(tmp_path / "real", tmp_path / "link")
+
+    for root, filename in [
+        (tmp_path / "link" / "app", tmp_path / "real" / "app" / "main.py"),
+        (tmp_path / "real" / "app", tmp_path / "link" / "app" / "main.py"),
+    ]:
+        assert ProjectRoots([root]).owns(str(filename))
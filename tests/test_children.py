@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from pytest_memray.children import CAPTURE_ENV
+from pytest_memray.children import child_captures
+from pytest_memray.children import child_peaks
+from pytest_memray.children import tracking_spawned_children
+
+
+def test_child_captures(tmp_path: Path) -> None:
+    result_file = tmp_path / "test.bin"
+    for name in ("test.bin", "test.bin.12", "test.bin.34", "test.bin.x", "other.bin.5"):
+        (tmp_path / name).touch()
+
+    assert child_captures(result_file) == {
+        12: tmp_path / "test.bin.12",
+        34: tmp_path / "test.bin.34",
+    }
+
+
+def test_environment_is_restored(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("PYTHONPATH", "somewhere")
+    monkeypatch.delenv(CAPTURE_ENV, raising=False)
+
+    with tracking_spawned_children(tmp_path / "test.bin", False, False):
+        assert os.environ[CAPTURE_ENV] == str(tmp_path / "test.bin")
+        assert os.environ["PYTHONPATH"].endswith(os.pathsep + "somewhere")
+
+    assert CAPTURE_ENV not in os.environ
+    assert os.environ["PYTHONPATH"] == "somewhere"
+
+
+def test_spawned_python_tracks_itself(tmp_path: Path) -> None:
+    result_file = tmp_path / "test.bin"
+
+    with tracking_spawned_children(result_file, False, False):
+        subprocess.run(
+            [sys.executable, "-c", "data = b'x' * (16 * 1024 * 1024)"], check=True
+        )
+
+    (peak,) = child_peaks(result_file).values()
+    assert 16 * 1024 * 1024 <= peak < 32 * 1024 * 1024
+
+
+def test_other_sitecustomize_still_runs(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    (tmp_path / "sitecustomize.py").write_text("print('other sitecustomize')")
+    monkeypatch.setenv("PYTHONPATH", str(tmp_path))
+
+    with tracking_spawned_children(tmp_path / "test.bin", False, False):
+        output = subprocess.run(
+            [sys.executable, "-c", "pass"], check=True, capture_output=True, text=True
+        )
+
+    assert output.stdout == "other sitecustomize\n"
+    assert list(child_captures(tmp_path / "test.bin")) != []
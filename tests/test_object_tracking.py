@@ -1,5 +1,6 @@
 """Tests for object tracking functionality."""
 
+import re
 import sys
 
 import pytest
@@ -103,6 +104,87 @@ class TestObjectTracking:
         assert "list" not in output
         assert "dict" not in output
 
+    def test_leaked_object_budgets(self, pytester):
+        """Test that types can leak up to their budget."""
+        pytester.makepyfile(
+            """
+            import pytest
+
+            class Cached:
+                pass
+
+            class Model:
+                pass
+
+            @pytest.mark.limit_leaked_objects(type_budgets={"Cached": 5, "list": 1})
+            def test_within_budget():
+                test_within_budget._leaked = [Cached() for _ in range(5)]
+
+            @pytest.mark.limit_leaked_objects(type_budgets={"Cached": 5, "list": 1})
+            def test_over_budget():
+                test_over_budget._leaked = [Cached() for _ in range(6)] + [Model()]
+
+            @pytest.mark.limit_leaked_objects(total_budget=2)
+            def test_over_total_budget():
+                test_over_total_budget._leaked = [Model(), Model()]
+            """
+        )
+
+        result = pytester.runpytest("--memray")
+
+        assert result.ret == pytest.ExitCode.TESTS_FAILED
+        result.assert_outcomes(passed=1, failed=2)
+        output = result.stdout.str()
+        assert "Test leaked 6 Cached objects (5 allowed), 1 Model objects" in output
+        assert "Test leaked 3 objects in total (2 allowed)" in output
+        assert "- Cached: 6 leaked, 5 allowed" in output
+
+    @pytest.mark.parametrize("settle", ["full", "generational"])
+    def test_settle_strategies(self, pytester, settle):
+        """Test that garbage cycles are collected with either strategy."""
+        pytester.makepyfile(
+            """
+            import gc
+            import pytest
+
+            LEAKS = []
+
+            @pytest.mark.limit_leaked_objects
+            def test_cycles():
+                for _ in range(10):
+                    cycle = []
+                    cycle.append(cycle)
+
+            @pytest.mark.limit_leaked_objects
+            def test_cycles_promoted():
+                cycle = []
+                cycle.append(cycle)
+                gc.collect(0)
+                del cycle
+
+            OLD = [{} for _ in range(5000)]
+
+            @pytest.mark.limit_leaked_objects
+            def test_cycle_while_freeing_older_containers():
+                # Fewer containers are left than before the test started.
+                cycle = []
+                cycle.append(cycle)
+                del cycle
+                OLD.clear()
+
+            @pytest.mark.limit_leaked_objects
+            def test_leak():
+                LEAKS.append([])
+            """
+        )
+
+        result = pytester.runpytest("--memray", f"--memray-settle={settle}")
+
+        result.assert_outcomes(passed=3, failed=1)
+        result.stdout.fnmatch_lines(
+            ["Settling tracked objects took *s over 4 tests, at most *s for *"]
+        )
+
     def test_no_frames_leak(self, pytester):
         """Test that when no user objects leak, no frames survive either."""
         pytester.makepyfile(
@@ -194,3 +276,114 @@ class TestObjectTracking:
         assert "instance(s)" in output
         assert "... and " in output
         assert " more" in output
+
+    def test_leaked_objects_are_summarized(self, pytester):
+        """Test that types are counted and sized, and samples span all leaks."""
+        pytester.makepyfile(
+            """
+            import pytest
+
+            class Leaked:
+                def __init__(self, value):
+                    self.value = value
+                def __repr__(self):
+                    return f"Leaked({self.value})"
+
+            @pytest.mark.limit_leaked_objects(
+                filter_fn=lambda obj: isinstance(obj, Leaked)
+            )
+            def test_many_leaks():
+                test_many_leaks._leaks = [Leaked(i) for i in range(1000)]
+            """
+        )
+
+        result = pytester.runpytest("--memray")
+
+        assert result.ret == pytest.ExitCode.TESTS_FAILED
+        output = result.stdout.str()
+        assert "Test leaked 1000 objects" in output
+        assert "1000 Leaked instance(s) (~" in output
+        assert "... and 990 more" in output
+        sampled = [int(value) for value in re.findall(r"Leaked\((\d+)\)", output)]
+        assert len(sampled) == 10
+        # A reservoir sample, not just the first objects that leaked
+        assert max(sampled) >= 10
+
+    def test_retained_sizes(self, pytester):
+        """Test that types are ranked by the memory their objects keep alive."""
+        pytester.makepyfile(
+            """
+            import pytest
+
+            LEAKS = []
+
+            @pytest.mark.limit_leaked_objects(retained_sizes=True)
+            def test_leaks():
+                LEAKS.append({"blob": b"x" * 10_000_000})
+                LEAKS.append([[i] for i in range(50)])
+            """
+        )
+
+        result = pytester.runpytest("--memray")
+
+        assert result.ret == pytest.ExitCode.TESTS_FAILED
+        output = result.stdout.str()
+        dict_line = re.search(r"1 dict instance\(s\) \(~.*, ~(.*) retained\)", output)
+        assert dict_line is not None
+        assert dict_line.group(1).endswith("MiB")
+        # The bytes are counted in the dict that keeps them alive
+        assert re.search(r"1 bytes instance\(s\) \(~.*, ~0.0B retained\)", output)
+        assert output.index("dict instance(s)") < output.index("list instance(s)")
+
+    def test_retained_sizes_shared_objects(self, pytester):
+        """Test that objects kept alive by several others are credited to none."""
+        pytester.makepyfile(
+            """
+            import pytest
+
+            LEAKS = []
+
+            @pytest.mark.limit_leaked_objects(retained_sizes=True)
+            def test_leaks():
+                blob = b"x" * 10_000_000
+                LEAKS.append({"blob": blob})
+                LEAKS.append({"blob": blob})
+            """
+        )
+
+        result = pytester.runpytest("--memray")
+
+        assert result.ret == pytest.ExitCode.TESTS_FAILED
+        output = result.stdout.str()
+        dict_line = re.search(r"2 dict instance\(s\) \(~.*, ~(.*) retained\)", output)
+        assert dict_line is not None
+        assert not dict_line.group(1).endswith("MiB")
+        assert re.search(r"1 bytes instance\(s\) \(~.*, ~0.0B retained\)", output)
+
+    def test_retention_paths(self, pytester):
+        """Test that the report shows what keeps each sampled object alive."""
+        pytester.makepyfile(
+            """
+            import pytest
+
+            class Leaked:
+                pass
+
+            class Registry:
+                entries = {}
+
+            @pytest.mark.limit_leaked_objects(
+                filter_fn=lambda obj: isinstance(obj, Leaked),
+                retention_paths=True,
+            )
+            def test_leak():
+                Registry.entries["key"] = [Leaked()]
+            """
+        )
+
+        result = pytester.runpytest("--memray")
+
+        assert result.ret == pytest.ExitCode.TESTS_FAILED
+        output = result.stdout.str()
+        assert "- Leaked: <test_retention_paths.Leaked object at" in output
+        assert "kept alive by test_retention_paths.Registry.entries['key'][0]" in output
@@ -0,0 +1,80 @@
+from __future__ import annotations
+
+import pytest
+
+from pytest_memray.policy import BudgetPolicy
+from pytest_memray.policy import parse_budget
+
+POLICY = """
+# Everything under tests/io
+tests/io limit_memory("100 MB")
+tests/io/test_big.py::test_load limit_memory("1 GB")
+**/test_leaky.py limit_leaks("1 MB", warmup=1)
+tests/api/test_*.py::Test*::test_get limit_allocations(count=10)
+tests/test_p.py::test_x[big-*] limit_memory("5 MB")
+"""
+
+
+@pytest.fixture
+def policy() -> BudgetPolicy:
+    policy = BudgetPolicy()
+    policy.add_lines(POLICY.splitlines(), "policy")
+    return policy
+
+
+@pytest.mark.parametrize(
+    "nodeid, expected",
+    [
+        ("tests/io/test_a.py::test_b", ("limit_memory", ("100 MB",), {})),
+        ("tests/io/sub/test_a.py::TestA::test_b", ("limit_memory", ("100 MB",), {})),
+        ("tests/io/test_big.py::test_load", ("limit_memory", ("1 GB",), {})),
+        ("tests/io/test_big.py::test_load[1-2]", ("limit_memory", ("1 GB",), {})),
+        ("tests/io/test_leaky.py::test_a", ("limit_leaks", ("1 MB",), {"warmup": 1})),
+        ("test_leaky.py::test_a", ("limit_leaks", ("1 MB",), {"warmup": 1})),
+        (
+            "tests/api/test_users.py::TestUsers::test_get",
+            ("limit_allocations", (), {"count": 10}),
+        ),
+        ("tests/api/test_users.py::TestUsers::test_put", None),
+        ("tests/test_p.py::test_x[big-1]", ("limit_memory", ("5 MB",), {})),
+        ("tests/test_p.py::test_x[small-1]", None),
+        ("tests/iox/test_a.py::test_b", None),
+    ],
+)
+def test_match(
+    policy: BudgetPolicy,
+    nodeid: str,
+    expected: tuple[str, tuple[object, ...], dict[str, object]] | None,
+) -> None:
+    budget = policy.match(nodeid)
+
+    if expected is None:
+        assert budget is None
+    else:
+        assert budget is not None
+        assert (budget.name, budget.args, budget.kwargs) == expected
+
+
+@pytest.mark.parametrize(
+    "text, message",
+    [
+        ("limit_memory", "not a call to one of"),
+        ("print('hi')", "not a call to one of"),
+        ("limit_memory(", "not a marker call"),
+        ("limit_memory(size)", "must be literals"),
+        ("limit_allocations(max_count=1000)", "unexpected keyword argument"),
+        ("limit_memory('1 MB', _test_id='x')", "private arguments"),
+        ("limit_memory('1 MB', '2 MB')", "too many positional arguments"),
+        ("limit_memory(current_thread_only=True)", "is missing limit"),
+    ],
+)
+def test_parse_budget_errors(text: str, message: str) -> None:
+    with pytest.raises(ValueError, match=message):
+        parse_budget(text)
+
+
+def test_errors_name_the_line() -> None:
+    policy = BudgetPolicy()
+
+    with pytest.raises(ValueError, match="at budgets.txt:2: "):
+        policy.add_lines(["tests limit_memory('1 MB')", "tests nothing"], "budgets.txt")
@@ -1,7 +1,10 @@
 from __future__ import annotations
 
 import re
+import subprocess
+import sys
 import xml.etree.ElementTree as ET
+from pathlib import Path
 from types import SimpleNamespace
 from unittest.mock import ANY
 from unittest.mock import patch
@@ -12,7 +15,11 @@ from memray import Tracker
 from pytest import ExitCode
 from pytest import Pytester
 
+from pytest_memray.index import read_index
 from pytest_memray.marks import StackFrame
+from pytest_memray.reports import ReportJob
+from pytest_memray.reports import render_reports
+from pytest_memray.timeline import read_timelines
 
 
 def extract_stacks(test_output: str) -> list[list[StackFrame]]:
@@ -52,7 +59,7 @@ def test_memray_is_called_when_activated(pytester: Pytester) -> None:
     """
     )
 
-    with patch("pytest_memray.plugin.Tracker") as mock:
+    with patch("memray.Tracker") as mock:
         result = pytester.runpytest("--memray")
 
     mock.assert_called_once()
@@ -67,13 +74,54 @@ def test_memray_is_not_called_when_not_activated(pytester: Pytester) -> None:
     """
     )
 
-    with patch("pytest_memray.plugin.Tracker") as mock:
+    with patch("memray.Tracker") as mock:
         result = pytester.runpytest()
 
     mock.assert_not_called()
     assert result.ret == ExitCode.OK
 
 
+def test_memray_is_not_loaded_when_not_activated(
+    pytester: Pytester, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.delenv("MEMRAY_RESULT_PATH", raising=False)
+    pytester.makepyfile(
+        """
+        import os
+        import sys
+
+        def test_hello_world():
+            assert 2 == 1 + 1
+
+        def test_nothing_was_set_up():
+            assert "memray" not in sys.modules
+            assert "MEMRAY_RESULT_PATH" not in os.environ
+    """
+    )
+
+    result = pytester.runpytest_subprocess()
+
+    assert result.ret == ExitCode.OK
+
+
+def test_plugin_import_is_lazy() -> None:
+    # Other plugins may import these themselves, so check in a fresh
+    # interpreter that only imports this one.
+    code = (
+        "import sys, pytest_memray.plugin; "
+        "print(*sorted(set(sys.argv[1:]) & set(sys.modules)))"
+    )
+    modules = ["asyncio", "ctypes", "memray", "pytest_memray.flamegraph"]
+    output = subprocess.run(
+        [sys.executable, "-c", code, *modules],
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+
+    assert output.stdout.strip() == ""
+
+
 @pytest.mark.parametrize(
     "size, outcome",
     [
@@ -297,7 +345,7 @@ def test_memray_report_native(native: bool, pytester: Pytester) -> None:
     """
     )
 
-    with patch("pytest_memray.plugin.Tracker", wraps=Tracker) as mock:
+    with patch("memray.Tracker", wraps=Tracker) as mock:
         result = pytester.runpytest("--memray", *(["--native"] if native else []))
 
     assert result.ret == ExitCode.TESTS_FAILED
@@ -338,7 +386,7 @@ def test_memray_report_python_allocators(
     """
     )
 
-    with patch("pytest_memray.plugin.Tracker", wraps=Tracker) as mock:
+    with patch("memray.Tracker", wraps=Tracker) as mock:
         result = pytester.runpytest(
             "--memray",
             *(["--trace-python-allocators"] if trace_python_allocators else []),
@@ -557,7 +605,7 @@ def test_plugin_calls_tests_only_once(pytester: Pytester) -> None:
         """
     )
 
-    with patch("pytest_memray.plugin.Tracker") as mock:
+    with patch("memray.Tracker") as mock:
         result = pytester.runpytest("--memray")
 
     mock.assert_called_once()
@@ -587,6 +635,7 @@ def test_bin_path(pytester: Pytester) -> None:
         "H-magic-test_a.py-test_b[2].bin",
         "H-magic-test_a.py-test_a.bin",
         "H-magic-test_a.py-test_b[1].bin",
+        "H-index.json",
         "metadata",
     }
 
@@ -624,7 +673,7 @@ def test_bin_path_with_long_test_id(
         + "-88c716620b48351a"
     )
 
-    dumps = [i.name for i in dump.iterdir() if i.name != "metadata"]
+    dumps = [i.name for i in dump.iterdir() if i.suffix == ".bin"]
     assert len(dumps) == 1
     assert dumps[0] == f"{expected_stem}.bin"
     metadata = list((dump / "metadata").iterdir())
@@ -663,7 +712,7 @@ def test_bin_path_with_long_test_id_and_long_prefix(
         + "-3e4fe15eabd37073"
     )
 
-    dumps = [i.name for i in dump.iterdir() if i.name != "metadata"]
+    dumps = [i.name for i in dump.iterdir() if i.suffix == ".bin"]
     assert len(dumps) == 1
     assert dumps[0] == f"{expected_stem}.bin"
     metadata = list((dump / "metadata").iterdir())
@@ -707,7 +756,7 @@ def test_plugin_works_with_the_flaky_plugin(pytester: Pytester) -> None:
         """
     )
 
-    with patch("pytest_memray.plugin.Tracker") as mock:
+    with patch("memray.Tracker") as mock:
         result = pytester.runpytest("--memray")
 
     # Ensure that flaky has only called our Tracker once per retry (2 times)
@@ -923,6 +972,59 @@ def test_leak_marker_does_work_if_memray_not_passed(pytester: Pytester) -> None:
     assert result.ret == ExitCode.TESTS_FAILED
 
 
+def test_markers_added_during_collection_are_tracked(pytester: Pytester) -> None:
+    pytester.makeconftest(
+        """
+        import pytest
+
+        def pytest_collection_modifyitems(items):
+            for item in items:
+                item.add_marker(pytest.mark.limit_memory("1KB"))
+        """
+    )
+    pytester.makepyfile(
+        """
+        from memray._test import MemoryAllocator
+        allocator = MemoryAllocator()
+
+        def test_memory_alloc_fails():
+            allocator.valloc(4 * 1024)
+            allocator.free()
+
+        def test_no_allocations():
+            pass
+        """
+    )
+
+    result = pytester.runpytest()
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=1, failed=1)
+
+
+def test_markers_applied_at_setup_are_tracked(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        from memray._test import MemoryAllocator
+        allocator = MemoryAllocator()
+
+        @pytest.fixture
+        def limited(request):
+            request.applymarker(pytest.mark.limit_memory("1KB"))
+
+        def test_memory_alloc_fails(limited):
+            allocator.valloc(4 * 1024)
+            allocator.free()
+        """
+    )
+
+    result = pytester.runpytest()
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    assert "Test was limited to 1.0KiB but allocated 4.0KiB" in result.stdout.str()
+
+
 def test_multiple_markers_are_not_supported(pytester: Pytester) -> None:
     pytester.makepyfile(
         """
@@ -1108,3 +1210,1511 @@ def test_running_async_tests_with_anyio(pytester: Pytester) -> None:
             "Test was allowed to leak 5.0KiB per location"
             " but at least one location leaked more"
         )
+
+
+@pytest.mark.parametrize(
+    "thread_limit, outcome",
+    [
+        ("10KB", ExitCode.TESTS_FAILED),
+        ("100KB", ExitCode.OK),
+    ],
+)
+def test_limit_memory_per_thread(
+    pytester: Pytester, thread_limit: str, outcome: ExitCode
+) -> None:
+    pytester.makepyfile(
+        f"""
+        import pytest
+        import threading
+        from memray._test import MemoryAllocator
+
+        def allocating_func():
+            allocator = MemoryAllocator()
+            allocator.valloc(1024 * 20)
+            allocator.free()
+
+        @pytest.mark.limit_memory("1MB", thread_limit="{thread_limit}")
+        def test_memory_alloc_fails():
+            t = threading.Thread(target=allocating_func, name="worker-1")
+            t.start()
+            t.join()
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == outcome
+    if outcome == ExitCode.TESTS_FAILED:
+        output = result.stdout.str()
+        assert "Test was limited to 10.0KiB per thread" in output
+        assert "(worker-1) allocated" in output
+        assert "Per-thread breakdown:" in output
+
+
+@pytest.mark.parametrize(
+    "allocators, outcome",
+    [
+        (["malloc"], ExitCode.OK),
+        (["mmap"], ExitCode.TESTS_FAILED),
+        (["malloc", "mmap"], ExitCode.TESTS_FAILED),
+    ],
+)
+def test_limit_memory_by_allocator(
+    pytester: Pytester, allocators: list[str], outcome: ExitCode
+) -> None:
+    pytester.makepyfile(
+        f"""
+        import mmap
+        import pytest
+        from memray._test import MemoryAllocator
+
+        @pytest.mark.limit_memory("1MB", allocators={allocators!r})
+        def test_memory_alloc():
+            buffer = mmap.mmap(-1, 2 * 1024 * 1024)
+            buffer.close()
+            allocator = MemoryAllocator()
+            allocator.malloc(1024 * 20)
+            allocator.free()
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == outcome
+    if outcome == ExitCode.TESTS_FAILED:
+        output = result.stdout.str()
+        kinds = "/".join(sorted(allocators))
+        assert f"Test was limited to 1.0MiB of {kinds} memory" in output
+        assert "Per-allocator breakdown:" in output
+        assert "- mmap: 2.0MiB in 1 allocation(s)" in output
+
+
+def test_limit_memory_unknown_allocator(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.limit_memory("1MB", allocators=["jemalloc"])
+        def test_memory_alloc():
+            pass
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.INTERNAL_ERROR
+    assert "Unknown allocator kind(s) 'jemalloc'" in result.stdout.str()
+
+
+@pytest.mark.parametrize(
+    "limit, outcome",
+    [
+        ("3MB", ExitCode.OK),
+        ("1MB", ExitCode.TESTS_FAILED),
+    ],
+)
+def test_limit_memory_first_party_only(
+    pytester: Pytester, limit: str, outcome: ExitCode
+) -> None:
+    pytester.makepyfile(
+        **{
+            "vendor/thirdparty": """
+            def allocate(size):
+                return bytearray(size)
+            """,
+            "app/service": """
+            from thirdparty import allocate
+
+            def build():
+                return allocate(2 * 1024 * 1024)
+            """,
+            "test_app": f"""
+            import pytest
+            from service import build
+            from thirdparty import allocate
+
+            @pytest.mark.limit_memory("{limit}", first_party_only=True)
+            def test_build():
+                data = build()
+                other = allocate(4 * 1024 * 1024)
+            """,
+        }
+    )
+    pytester.syspathinsert(pytester.path / "vendor")
+    pytester.syspathinsert(pytester.path / "app")
+
+    result = pytester.runpytest("--memray", "--memray-project-root=app")
+
+    assert result.ret == outcome
+    if outcome == ExitCode.TESTS_FAILED:
+        output = result.stdout.str()
+        assert "Test was limited to 1.0MiB in first-party code" in output
+        assert "but allocated 2.0MiB" in output
+        assert "Per-function breakdown of first-party code:" in output
+        assert re.search(r"- build:.*service\.py:4: 2\.0MiB in 1 allocation", output)
+
+
+def test_memray_report_first_party_functions(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        **{
+            "app/.venv/lib/site-packages/thirdparty": """
+            def allocate(size):
+                return bytearray(size)
+            """,
+            "app/service": """
+            from thirdparty import allocate
+
+            def build():
+                return allocate(2 * 1024 * 1024)
+            """,
+            "test_app": """
+            from service import build
+
+            def test_build():
+                data = build()
+            """,
+        }
+    )
+    pytester.syspathinsert(pytester.path / "app/.venv/lib/site-packages")
+    pytester.syspathinsert(pytester.path / "app")
+    pytester.makeini(
+        """
+        [pytest]
+        memray_project_roots = app
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+    output = result.stdout.str()
+    assert "Biggest allocating first-party functions:" in output
+    assert re.search(r"- build:.*service\.py:4 -> 2\.0MiB", output)
+
+
+def test_limit_leaks_per_thread_breakdown(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        import threading
+        from memray._test import MemoryAllocator
+        allocator = MemoryAllocator()
+
+        def allocating_func():
+            allocator.valloc(1024 * 20)
+            # No free call here
+
+        @pytest.mark.limit_leaks("10KB")
+        def test_memory_alloc_fails():
+            t = threading.Thread(target=allocating_func, name="leaky-worker")
+            t.start()
+            t.join()
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    output = result.stdout.str()
+    assert "Per-thread breakdown:" in output
+    assert "(leaky-worker):" in output
+
+
+def test_memray_report_per_thread(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import threading
+        from memray._test import MemoryAllocator
+
+        def allocating_func():
+            allocator = MemoryAllocator()
+            allocator.valloc(1024 * 20)
+            allocator.free()
+
+        def test_foo():
+            t = threading.Thread(target=allocating_func, name="worker-1")
+            t.start()
+            t.join()
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+    output = result.stdout.str()
+    assert "Memory by thread:" in output
+    assert "(worker-1) ->" in output
+
+
+def test_memray_report_per_allocator(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import mmap
+        from memray._test import MemoryAllocator
+
+        def test_foo():
+            buffer = mmap.mmap(-1, 2 * 1024 * 1024)
+            allocator = MemoryAllocator()
+            allocator.malloc(1024 * 20)
+            allocator.free()
+            buffer.close()
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+    output = result.stdout.str()
+    assert "Memory by allocator:" in output
+    assert "- mmap -> 2.0MiB in 1 allocation(s)" in output
+    assert "- malloc -> 20.0KiB in 1 allocation(s)" in output
+
+
+def test_memray_report_per_async_task(pytester: Pytester) -> None:
+    pytester.makeconftest(
+        """
+        import asyncio
+        import inspect
+        import pytest
+
+        @pytest.hookimpl(tryfirst=True)
+        def pytest_pyfunc_call(pyfuncitem):
+            if inspect.iscoroutinefunction(pyfuncitem.obj):
+                asyncio.run(pyfuncitem.obj())
+                return True
+        """
+    )
+    pytester.makepyfile(
+        """
+        import asyncio
+        from memray._test import MemoryAllocator
+
+        async def small_handler():
+            await asyncio.sleep(0)
+            allocator = MemoryAllocator()
+            allocator.valloc(1024)
+            await asyncio.sleep(0)
+            allocator.free()
+
+        async def big_handler():
+            await asyncio.sleep(0)
+            allocator = MemoryAllocator()
+            allocator.valloc(1024 * 64)
+            await asyncio.sleep(0)
+            allocator.free()
+
+        async def test_foo():
+            await asyncio.gather(
+                asyncio.create_task(small_handler(), name="small"),
+                asyncio.create_task(big_handler(), name="big"),
+            )
+        """
+    )
+
+    result = pytester.runpytest("--memray", "--track-async-tasks")
+
+    assert result.ret == ExitCode.OK
+    output = result.stdout.str()
+    assert "Memory by asyncio task:" in output
+    big, small = (
+        line
+        for line in output.splitlines()
+        if "_handler:" in line and "task(s)" in line
+    )
+    assert "big_handler" in big and "1 task(s): big)" in big
+    assert "small_handler" in small and "1 task(s): small)" in small
+
+
+def test_memray_report_async_tasks_not_shown_by_default(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        from memray._test import MemoryAllocator
+
+        @pytest.fixture
+        def anyio_backend():
+            return 'asyncio'
+
+        @pytest.mark.anyio
+        async def test_foo():
+            allocator = MemoryAllocator()
+            allocator.valloc(1024)
+            allocator.free()
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+    assert "Memory by asyncio task:" not in result.stdout.str()
+
+
+@pytest.mark.parametrize(
+    "marker_args, outcome",
+    [
+        ("count=50", ExitCode.TESTS_FAILED),
+        ("count=100_000", ExitCode.OK),
+        ("churn=50", ExitCode.TESTS_FAILED),
+        ("churn=100_000", ExitCode.OK),
+        ("count=100_000, churn=50", ExitCode.TESTS_FAILED),
+    ],
+)
+def test_limit_allocations_marker(
+    pytester: Pytester, marker_args: str, outcome: ExitCode
+) -> None:
+    pytester.makepyfile(
+        f"""
+        import pytest
+        from memray._test import MemoryAllocator
+
+        def churn():
+            allocator = MemoryAllocator()
+            for _ in range(100):
+                allocator.valloc(64)
+                allocator.free()
+
+        @pytest.mark.limit_allocations({marker_args})
+        def test_churn():
+            churn()
+        """
+    )
+
+    result = pytester.runpytest()
+
+    assert result.ret == outcome
+    if outcome == ExitCode.TESTS_FAILED:
+        output = result.stdout.str()
+        assert "List of call sites by number of allocations:" in output
+        assert re.search(r"- 1\d\d allocations \(.*\) made here:", output)
+        assert "valloc:" in output
+
+
+def test_limit_allocations_report_messages(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        from memray._test import MemoryAllocator
+
+        def churn():
+            allocator = MemoryAllocator()
+            for _ in range(100):
+                allocator.valloc(64)
+                allocator.free()
+
+        @pytest.mark.limit_allocations(count=10)
+        def test_count():
+            churn()
+
+        @pytest.mark.limit_allocations(churn=10)
+        def test_churn():
+            churn()
+        """
+    )
+
+    result = pytester.runpytest()
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    output = result.stdout.str()
+    assert re.search(r"Test was limited to 10 allocations but made \d+", output)
+    assert re.search(
+        r"Test was limited to 10 allocations per call site "
+        r"but one call site made 1\d\d",
+        output,
+    )
+
+
+def test_limit_allocations_needs_a_limit(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.limit_allocations
+        def test_foo():
+            pass
+        """
+    )
+
+    result = pytester.runpytest()
+
+    assert result.ret != ExitCode.OK
+    output = "\n".join(result.outlines + result.errlines)
+    assert "limit_allocations needs a count or a churn limit" in output
+
+
+def test_memray_report_allocation_hotspots(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        from memray._test import MemoryAllocator
+
+        def many_small():
+            allocator = MemoryAllocator()
+            for _ in range(100):
+                allocator.malloc(16)
+                allocator.free()
+
+        def few_big():
+            allocator = MemoryAllocator()
+            for _ in range(2):
+                allocator.valloc(1024 * 1024)
+                allocator.free()
+
+        def test_foo():
+            many_small()
+            few_big()
+
+        def test_bar():
+            many_small()
+        """
+    )
+
+    result = pytester.runpytest("--memray", "--allocation-hotspots=1")
+
+    assert result.ret == ExitCode.OK
+    output = result.stdout.str()
+    assert "Allocation hot spots across 2 tests" in output
+    most_allocations = output.split("Most allocations:")[1].splitlines()[1]
+    most_bytes = output.split("Most bytes allocated:")[1].splitlines()[1]
+    assert "- malloc:" in most_allocations
+    assert re.search(r"-> 2\d\d allocations \(3\.\dKiB\)$", most_allocations)
+    assert "- valloc:" in most_bytes
+    assert re.search(r"-> 2\.0MiB \(2 allocations\)$", most_bytes)
+
+
+def test_memray_report_allocation_hotspots_not_shown_by_default(
+    pytester: Pytester,
+) -> None:
+    pytester.makepyfile(
+        """
+        def test_foo():
+            pass
+        """
+    )
+
+    with patch("memray.Tracker", wraps=Tracker) as mock:
+        result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+    assert "Allocation hot spots" not in result.stdout.str()
+    assert mock.call_args.kwargs["file_format"] == FileFormat.AGGREGATED_ALLOCATIONS
+
+
+@pytest.mark.parametrize("extra_args", [[], ["-n", "2"]])
+def test_suite_flamegraph_collapsed(pytester: Pytester, extra_args: list[str]) -> None:
+    pytester.makepyfile(
+        """
+        from memray._test import MemoryAllocator
+
+        def allocating_func1():
+            allocator = MemoryAllocator()
+            allocator.valloc(1024)
+            allocator.free()
+
+        def allocating_func2():
+            allocator = MemoryAllocator()
+            allocator.valloc(1024 * 2)
+            allocator.free()
+
+        def test_foo():
+            allocating_func1()
+
+        def test_bar():
+            allocating_func2()
+        """
+    )
+    output_file = pytester.path / "suite.folded"
+
+    result = pytester.runpytest(
+        "--memray", "--memray-suite-flamegraph", str(output_file), *extra_args
+    )
+
+    assert result.ret == ExitCode.OK
+    assert f"Wrote the suite flame graph to {output_file}" in result.stdout.str()
+    stacks = {}
+    for line in output_file.read_text().splitlines():
+        stack, _, size = line.rpartition(" ")
+        stacks[stack] = int(size)
+    (func1,) = (size for stack, size in stacks.items() if "allocating_func1" in stack)
+    (func2,) = (size for stack, size in stacks.items() if "allocating_func2" in stack)
+    assert func1 == 1024
+    assert func2 == 1024 * 2
+    assert all(
+        stack.split(";")[-1].startswith("valloc (")
+        for stack in stacks
+        if "allocating_func" in stack
+    )
+
+
+def test_suite_flamegraph_html(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        from memray._test import MemoryAllocator
+
+        def allocating_func():
+            allocator = MemoryAllocator()
+            allocator.valloc(1024 * 64)
+            allocator.free()
+
+        def test_foo():
+            allocating_func()
+        """
+    )
+    output_file = pytester.path / "suite.html"
+
+    result = pytester.runpytest(
+        "--memray", "--memray-suite-flamegraph", str(output_file)
+    )
+
+    assert result.ret == ExitCode.OK
+    page = output_file.read_text()
+    assert page.startswith("<!DOCTYPE html>")
+    assert "<svg" in page
+    assert "allocating_func (" in page
+
+
+@pytest.mark.parametrize("extra_args", [[], ["-n", "2"]])
+def test_html_reports_for_failing_tests(
+    pytester: Pytester, extra_args: list[str]
+) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        from memray._test import MemoryAllocator
+
+        allocator = MemoryAllocator()
+
+        @pytest.mark.limit_memory("1KB")
+        def test_too_much():
+            allocator.valloc(1024 * 64)
+            allocator.free()
+
+        @pytest.mark.limit_leaks("1KB")
+        def test_leaks():
+            allocator.valloc(1024 * 64)
+
+        @pytest.mark.limit_memory("1MB")
+        def test_fine():
+            allocator.valloc(1024 * 64)
+            allocator.free()
+        """
+    )
+    output_dir = pytester.path / "reports"
+
+    result = pytester.runpytest(
+        "--memray", "--memray-html-reports", str(output_dir), *extra_args
+    )
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    output = result.stdout.str()
+    assert f"HTML reports written to {output_dir}:" in output
+    pages = sorted(path.name for path in output_dir.iterdir())
+    assert len(pages) == 4
+    assert sum(name.endswith("-flamegraph.html") for name in pages) == 2
+    assert sum(name.endswith("-table.html") for name in pages) == 2
+    assert all("test_fine" not in name for name in pages)
+    for page in output_dir.iterdir():
+        assert str(page) in output
+        assert "<html" in page.read_text()
+
+
+def test_html_reports_for_summary_tests(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        from memray._test import MemoryAllocator
+
+        def test_big():
+            allocator = MemoryAllocator()
+            allocator.valloc(1024 * 64)
+            allocator.free()
+
+        def test_small():
+            allocator = MemoryAllocator()
+            allocator.valloc(1024)
+            allocator.free()
+        """
+    )
+    output_dir = pytester.path / "reports"
+
+    result = pytester.runpytest(
+        "--memray",
+        "--most-allocations=1",
+        "--memray-html-reports",
+        str(output_dir),
+        "--memray-html-reports-for-summary",
+    )
+
+    assert result.ret == ExitCode.OK
+    result.stdout.fnmatch_lines(
+        ["*- test_html_reports_for_summary_tests.py::test_big:"]
+    )
+    pages = sorted(path.name for path in output_dir.iterdir())
+    assert len(pages) == 2
+    assert all("test_big" in name for name in pages)
+
+
+@pytest.mark.parametrize("leaks", [True, False])
+def test_render_reports(tmp_path: Path, leaks: bool) -> None:
+    from memray._test import MemoryAllocator
+
+    result_file = tmp_path / "capture.bin"
+    allocator = MemoryAllocator()
+    with Tracker(result_file):
+        allocator.valloc(1024 * 64)
+
+    written = render_reports(ReportJob("test_id", result_file, tmp_path, "t", leaks))
+
+    assert written == [tmp_path / "t-flamegraph.html", tmp_path / "t-table.html"]
+    assert all("<html" in path.read_text() for path in written)
+
+
+@pytest.mark.parametrize("overwrite", [False, True])
+def test_compare_with_previous_run(pytester: Pytester, overwrite: bool) -> None:
+    test_file = """
+        from memray._test import MemoryAllocator
+
+        def allocating_func():
+            allocator = MemoryAllocator()
+            allocator.valloc({size})
+            allocator.free()
+
+        def test_foo():
+            allocating_func()
+
+        def test_bar():
+            pass
+    """
+    pytester.makepyfile(test_file.format(size=1024))
+    previous = pytester.path / "previous"
+    output_args = ["--memray-bin-path", str(previous), "--memray-bin-prefix", "run"]
+    result = pytester.runpytest("--memray", *output_args)
+    assert result.ret == ExitCode.OK
+
+    pytester.makepyfile(test_file.format(size=1024 * 10))
+    # The run can write its own index over the one it is compared with.
+    extra_args = output_args if overwrite else []
+    result = pytester.runpytest(
+        "--memray", "--memray-compare", str(previous), *extra_args
+    )
+
+    assert result.ret == ExitCode.OK
+    output = result.stdout.str()
+    assert f"Peak memory compared to the previous run at {previous}" in output
+    assert "1 of 2 tests in both runs changed their peak memory" in output
+    assert re.search(
+        r"- test_compare_with_previous_run.py::test_foo: "
+        r"1\.\dKiB -> 10\.\dKiB \(\+9\.\dKiB, \+\d+\.\d%\)",
+        output,
+    )
+    assert re.search(r"valloc:.*:\d+ grew by 9\.0KiB", output)
+
+
+def test_compare_with_ambiguous_previous_run(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        def test_foo():
+            pass
+        """
+    )
+    previous = pytester.path / "previous"
+    for prefix in ("a", "b"):
+        args = ["--memray-bin-path", str(previous), "--memray-bin-prefix", prefix]
+        assert pytester.runpytest("--memray", *args).ret == ExitCode.OK
+
+    result = pytester.runpytest("--memray", "--memray-compare", str(previous))
+
+    assert result.ret == ExitCode.OK
+    assert "expected exactly one memray index" in result.stdout.str()
+
+    index = previous / "a-index.json"
+    result = pytester.runpytest("--memray", "--memray-compare", str(index))
+    assert "0 of 1 tests in both runs changed their peak memory" in result.stdout.str()
+
+
+@pytest.mark.parametrize("extra_args", [[], ["-n", "2"]])
+def test_track_only_tests_affected_by_changed_files(
+    pytester: Pytester, extra_args: list[str]
+) -> None:
+    for name in ("small", "big"):
+        pytester.makepyfile(
+            **{
+                name: """
+                from memray._test import MemoryAllocator
+
+                def allocate():
+                    allocator = MemoryAllocator()
+                    allocator.valloc(1024 * 1024)
+                    allocator.free()
+                """
+            }
+        )
+    pytester.makepyfile(
+        test_foo="""
+        import big
+        import small
+
+        def test_small():
+            small.allocate()
+
+        def test_big():
+            big.allocate()
+        """
+    )
+    previous = pytester.path / "previous"
+    result = pytester.runpytest("--memray", "--memray-bin-path", str(previous))
+    assert result.ret == ExitCode.OK
+
+    changed_files = pytester.path / "changed.txt"
+    changed_files.write_text("big.py\n")
+    current = pytester.path / "current"
+    result = pytester.runpytest(
+        "--memray",
+        "--memray-bin-path",
+        str(current),
+        "--memray-compare",
+        str(previous),
+        "--memray-changed-files",
+        str(changed_files),
+        *extra_args,
+    )
+
+    assert result.ret == ExitCode.OK
+    assert "Skipped tracking 1 tests not affected by the files" in result.stdout.str()
+    dumps = [i.name for i in current.iterdir() if i.suffix == ".bin"]
+    assert len(dumps) == 1
+    assert "test_big" in dumps[0]
+    # The skipped test keeps its entry from the previous run in the new index.
+    assert read_index(current).keys() == read_index(previous).keys()
+
+
+def test_changed_files_requires_compare(pytester: Pytester) -> None:
+    pytester.makepyfile("def test_foo(): pass")
+    changed_files = pytester.path / "changed.txt"
+    changed_files.write_text("test_foo.py\n")
+
+    result = pytester.runpytest(
+        "--memray", "--memray-changed-files", str(changed_files)
+    )
+
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(["*--memray-changed-files requires --memray-compare*"])
+
+
+@pytest.mark.parametrize(
+    "size_expression, complexity, passes",
+    [
+        ("n * 1024 * 1024", "linear", True),
+        ("n * n * 256 * 1024", "quadratic", True),
+        ("n * n * 256 * 1024", "linear", False),
+        ("n * 1024 * 1024", "constant", False),
+    ],
+)
+@pytest.mark.parametrize("extra_args", [[], ["-n", "2"]], ids=["serial", "xdist"])
+def test_memory_scaling_marker(
+    pytester: Pytester,
+    size_expression: str,
+    complexity: str,
+    passes: bool,
+    extra_args: list[str],
+) -> None:
+    pytester.makepyfile(
+        f"""
+        import pytest
+        from memray._test import MemoryAllocator
+
+        @pytest.mark.memory_scaling("n", "{complexity}")
+        @pytest.mark.parametrize("n", [1, 2, 4, 8])
+        def test_memory_alloc_fails(n):
+            allocator = MemoryAllocator()
+            allocator.valloc({size_expression})
+            allocator.free()
+        """
+    )
+
+    result = pytester.runpytest("--memray", *extra_args)
+
+    if passes:
+        assert result.ret == ExitCode.OK
+        return
+    # The group is checked once the session is over, so the session fails
+    # while each of its tests passed.
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=4)
+    result.stdout.fnmatch_lines(
+        [
+            "*MEMRAY MEMORY SCALING FAILURES*",
+            "test_memory_scaling_marker.py::test_memory_alloc_fails: "
+            "Peak memory grows as O(n*) in n but was declared to grow as *",
+            "Peak memory by n:",
+            "*n=1: *",
+            "*n=8: *",
+        ]
+    )
+
+
+def test_memory_scaling_marker_skipped_parametrization(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        from memray._test import MemoryAllocator
+
+        @pytest.mark.memory_scaling("n", "constant")
+        @pytest.mark.parametrize(
+            "n", [1, pytest.param(2, marks=pytest.mark.skip), 4, 8]
+        )
+        def test_memory_alloc(n):
+            allocator = MemoryAllocator()
+            allocator.valloc(n * 1024 * 1024)
+            allocator.free()
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=3, skipped=1)
+    result.stdout.fnmatch_lines(["*declared to grow as O(1)*"])
+
+
+def test_memory_scaling_marker_too_few_values(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.memory_scaling("n")
+        @pytest.mark.parametrize("n", [1000, 2000, 4000])
+        def test_memory_alloc(n):
+            assert n != 2000
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=2, failed=1, warnings=1)
+    result.stdout.fnmatch_lines(
+        [
+            "*test_memory_alloc: memory_scaling needs at least 3 distinct values "
+            "of n to fit, but only 2 passed"
+        ]
+    )
+    assert "INTERNALERROR" not in result.stdout.str()
+
+
+def test_memory_scaling_marker_unknown_complexity(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.memory_scaling("n", "cubic")
+        @pytest.mark.parametrize("n", [1, 2, 3])
+        def test_foo(n):
+            pass
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(["*unknown memory_scaling complexity 'cubic'*"])
+
+
+def test_memory_scaling_marker_needs_parametrization(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.memory_scaling("n")
+        def test_foo():
+            pass
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(["*memory_scaling needs a test parametrized*"])
+
+
+@pytest.mark.parametrize("args", ["repeat=0", "warmup=-1"])
+def test_leak_marker_rejects_invalid_repeat(pytester: Pytester, args: str) -> None:
+    pytester.makepyfile(
+        f"""
+        import pytest
+
+        @pytest.mark.limit_leaks("1KB", {args})
+        def test_foo():
+            pass
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(
+        ["*test_foo: limit_leaks needs a warmup >= 0 and a repeat >= 1, got *"]
+    )
+
+
+def test_leak_marker_repeat_ignores_one_shot_caches(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        from memray._test import MemoryAllocator
+        allocator = MemoryAllocator()
+        cache = []
+
+        def fill_cache():
+            if not cache:
+                cache.append(allocator.valloc(1024 * 1024))
+
+        def leak():
+            allocator.valloc(64 * 1024)
+
+        @pytest.mark.limit_leaks("1MB", repeat=5)
+        def test_cache():
+            fill_cache()
+
+        @pytest.mark.limit_leaks("32KB", repeat=5)
+        def test_leak():
+            fill_cache()
+            leak()
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=1, failed=1)
+    output = result.stdout.str()
+    assert "per location per iteration but at least one location leaked" in output
+    assert "64.0KiB leaked here per iteration" in output
+    assert "fill_cache" not in output
+
+
+def test_leak_marker_warmup(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        from memray._test import MemoryAllocator
+        allocator = MemoryAllocator()
+        calls = []
+
+        @pytest.mark.limit_leaks("1KB", warmup=1)
+        def test_cache():
+            calls.append(1)
+            if len(calls) == 1:
+                allocator.valloc(1024 * 1024)
+
+        def test_warmup_ran():
+            assert len(calls) == 2
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+
+
+@pytest.mark.parametrize(
+    "leak_size, outcome",
+    [
+        (0, ExitCode.OK),
+        (1024 * 1024, ExitCode.TESTS_FAILED),
+    ],
+)
+def test_leak_rate_marker(
+    pytester: Pytester, leak_size: int, outcome: ExitCode
+) -> None:
+    pytester.makepyfile(
+        f"""
+        import time
+        import pytest
+        from memray._test import MemoryAllocator
+        allocator = MemoryAllocator()
+
+        @pytest.mark.limit_leak_rate("1MB/min", check_interval=3600)
+        def test_soak():
+            for _ in range(30):
+                if {leak_size}:
+                    allocator.valloc({leak_size})
+                time.sleep(0.02)
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == outcome
+    if outcome == ExitCode.TESTS_FAILED:
+        output = result.stdout.str()
+        assert "Test was allowed to leak 1.0MiB/min but leaked" in output
+        assert "stopped after" not in output
+        assert "Heap size over time:" in output
+
+
+def test_leak_rate_marker_rate_keyword(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.limit_leak_rate(rate="1MB/min", check_interval=3600)
+        def test_soak():
+            pass
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+
+
+def test_leak_rate_marker_does_not_stop_churn(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import time
+        import pytest
+
+        @pytest.mark.limit_leak_rate("200KB/min", check_interval=0.2)
+        def test_churn():
+            deadline = time.monotonic() + 2
+            while time.monotonic() < deadline:
+                data = [bytearray(1024) for _ in range(100)]
+                del data
+                time.sleep(0.001)
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert "stopped after" not in result.stdout.str()
+    assert result.ret == ExitCode.OK
+
+
+def test_leak_rate_marker_does_not_count_its_own_checks(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import time
+        import pytest
+
+        @pytest.mark.limit_leak_rate("1KB/min", check_interval=0.05)
+        def test_idle():
+            time.sleep(6)
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert "stopped after" not in result.stdout.str()
+    assert result.ret == ExitCode.OK
+
+
+def test_leak_rate_marker_stops_test_early(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import time
+        import pytest
+        from memray._test import MemoryAllocator
+        allocator = MemoryAllocator()
+
+        @pytest.mark.limit_leak_rate("1MB/min", check_interval=0.5)
+        def test_soak():
+            deadline = time.monotonic() + 60
+            while time.monotonic() < deadline:
+                allocator.valloc(1024 * 1024)
+                time.sleep(0.02)
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    assert result.duration < 30
+    assert re.search(r"leaked .*/min \(stopped after \d+\.\ds\)", result.stdout.str())
+
+
+@pytest.mark.parametrize(
+    "marker_args, extra_args",
+    [
+        ('"1MB", abort_at=8, check_interval=0.01', []),
+        ('"1MB", check_interval=0.01', ["--memray-abort-at", "8"]),
+        ('limit="1MB", abort_at=8, check_interval=0.01', []),
+    ],
+)
+def test_limit_memory_stops_test_early(
+    pytester: Pytester, marker_args: str, extra_args: list[str]
+) -> None:
+    pytester.makepyfile(
+        f"""
+        import time
+        import pytest
+
+        @pytest.mark.limit_memory({marker_args})
+        def test_runaway():
+            chunks = []
+            for _ in range(256):
+                chunks.append(b"x" * 1024 * 1024)
+                time.sleep(0.005)
+        """
+    )
+
+    result = pytester.runpytest("--memray", *extra_args)
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    match = re.search(
+        r"Test was limited to 1\.0MiB but allocated ([\d.]+)MiB before it was stopped",
+        result.stdout.str(),
+    )
+    assert match is not None
+    assert float(match[1]) < 128
+
+
+def test_limit_memory_stops_async_test_early(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import asyncio
+        import pytest
+
+        @pytest.fixture
+        def anyio_backend():
+            return 'asyncio'
+
+        @pytest.mark.anyio
+        @pytest.mark.limit_memory("1MB", abort_at=8, check_interval=0.01)
+        async def test_runaway():
+            chunks = []
+            for _ in range(256):
+                chunks.append(b"x" * 1024 * 1024)
+                await asyncio.sleep(0.005)
+
+        @pytest.mark.anyio
+        async def test_loop_still_works():
+            await asyncio.sleep(0)
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=1, failed=1)
+    match = re.search(
+        r"Test was limited to 1\.0MiB but allocated ([\d.]+)MiB before it was stopped",
+        result.stdout.str(),
+    )
+    assert match is not None
+    assert float(match[1]) < 128
+
+
+def test_limit_memory_is_not_stopped_under_the_abort_threshold(
+    pytester: Pytester,
+) -> None:
+    pytester.makepyfile(
+        """
+        import time
+        import pytest
+
+        @pytest.mark.limit_memory("1MB", abort_at=64, check_interval=0.01)
+        def test_small():
+            data = b"x" * (2 * 1024 * 1024)
+            time.sleep(0.05)
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    output = result.stdout.str()
+    assert "Test was limited to 1.0MiB but allocated 2.0MiB" in output
+    assert "before it was stopped" not in output
+
+
+@pytest.mark.parametrize("extra_args", [[], ["-n", "2"]])
+def test_live_display(pytester: Pytester, extra_args: list[str]) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+        from memray._test import MemoryAllocator
+
+        allocator = MemoryAllocator()
+
+        def test_small():
+            allocator.valloc(1024)
+            allocator.free()
+
+        def test_big():
+            allocator.valloc(1024 * 1024)
+            allocator.free()
+        """
+    )
+
+    result = pytester.runpytest(
+        "--memray", "--memray-live", "--memray-live-interval", "0", *extra_args
+    )
+
+    assert result.ret == ExitCode.OK
+    workers = r"gw\d: .*" if extra_args else r"main: \S+ over 2 tests"
+    result.stdout.re_match_lines(
+        [rf"memray: worst so far \S+::test_big \(1\.\dMiB\); {workers}"]
+    )
+
+
+def test_live_display_is_off_by_default(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        def test_nothing():
+            pass
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+    assert "worst so far" not in result.stdout.str()
+
+
+@pytest.mark.parametrize("extra_args", [[], ["-n", "2"]])
+def test_session_timeline(pytester: Pytester, extra_args: list[str]) -> None:
+    pytester.makepyfile(
+        """
+        import time
+
+        def test_small():
+            time.sleep(0.1)
+
+        def test_big():
+            data = b"x" * (64 * 1024 * 1024)
+            time.sleep(0.2)
+        """
+    )
+    output_dir = pytester.path / "out"
+
+    result = pytester.runpytest(
+        "--memray-timeline",
+        "--memray-timeline-interval",
+        "0.01",
+        "--memray-bin-path",
+        str(output_dir),
+        "--memray-bin-prefix",
+        "run",
+        *extra_args,
+    )
+
+    assert result.ret == ExitCode.OK
+    result.stdout.fnmatch_lines(
+        [
+            "*MEMRAY SESSION TIMELINE*",
+            "*: * -> * over *s, peak * at *s during *::test_big",
+        ]
+    )
+    assert "MEMRAY REPORT" not in result.stdout.str()
+    timelines = read_timelines(output_dir / "run-timeline.json")
+    assert set(timelines) == ({"gw0", "gw1"} if extra_args else {"main"})
+    tests = {test for timeline in timelines.values() for _, test in timeline.tests}
+    assert tests == {
+        "test_session_timeline.py::test_small",
+        "test_session_timeline.py::test_big",
+    }
+
+
+def test_session_timeline_is_not_charged_to_tests(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import time
+        import pytest
+
+        @pytest.mark.limit_allocations(count=20)
+        def test_idle():
+            time.sleep(1)
+
+        def test_big():
+            data = b"x" * (64 * 1024 * 1024)
+            del data
+        """
+    )
+
+    result = pytester.runpytest(
+        "--memray", "--memray-timeline", "--memray-timeline-interval", "0.01"
+    )
+
+    assert result.ret == ExitCode.OK
+    # The peak is recorded although no sample is taken while tests are tracked.
+    result.stdout.fnmatch_lines(["*: * -> * over *s, peak * at *s during *::test_big"])
+
+
+@pytest.mark.parametrize("from_file", [False, True])
+def test_budget_policy(pytester: Pytester, from_file: bool) -> None:
+    policy = """
+        test_budget_policy.py limit_memory("1 KB")
+        test_budget_policy.py::test_big_allowed limit_memory("1 MB")
+    """
+    args = ["--memray"]
+    if from_file:
+        budgets = pytester.makefile(".txt", budgets=policy)
+        args.extend(["--memray-budgets", str(budgets)])
+    else:
+        pytester.makeini(f"[pytest]\nmemray_budgets ={policy}")
+    pytester.makepyfile(
+        test_budget_policy="""
+        import pytest
+        from memray._test import MemoryAllocator
+        allocator = MemoryAllocator()
+
+        def test_small():
+            pass
+
+        def test_big():
+            allocator.valloc(64 * 1024)
+            allocator.free()
+
+        @pytest.mark.parametrize("size", [1, 2])
+        def test_big_allowed(size):
+            allocator.valloc(64 * 1024 * size)
+            allocator.free()
+
+        @pytest.mark.limit_memory("1 MB")
+        def test_big_with_marker():
+            allocator.valloc(64 * 1024)
+            allocator.free()
+        """
+    )
+
+    result = pytester.runpytest(*args)
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=4, failed=1)
+    result.stdout.fnmatch_lines(["MEMORY PROBLEMS test_budget_policy.py::test_big *"])
+    assert "Test was limited to 1.0KiB but allocated 64.0KiB" in result.stdout.str()
+
+
+@pytest.mark.parametrize(
+    "budget, message",
+    [
+        ("limit_memory(size)", "must be literals"),
+        ("limit_allocations(max_count=1000)", "unexpected keyword argument*"),
+    ],
+)
+def test_budget_policy_errors(pytester: Pytester, budget: str, message: str) -> None:
+    pytester.makeini(f"[pytest]\nmemray_budgets =\n    tests {budget}")
+    pytester.makepyfile("def test_nothing(): pass")
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.fnmatch_lines(
+        [f"*Invalid memray budget at memray_budgets:1: *{message}*"]
+    )
+
+
+@pytest.mark.parametrize("start", ["fork", "spawn", "subprocess"])
+@pytest.mark.parametrize("processes", ["sum", "max"])
+def test_follow_children(pytester: Pytester, start: str, processes: str) -> None:
+    pytester.makepyfile(
+        f"""
+        import multiprocessing
+        import subprocess
+        import sys
+        import pytest
+
+        def work():
+            data = b"x" * (24 * 1024 * 1024)
+
+        @pytest.mark.limit_memory("40MB", processes={processes!r})
+        def test_children():
+            for _ in range(2):
+                if {start!r} == "subprocess":
+                    subprocess.run(
+                        [sys.executable, "-c", "data = b'x' * (24 * 1024 * 1024)"],
+                        check=True,
+                    )
+                else:
+                    context = multiprocessing.get_context({start!r})
+                    process = context.Process(target=work)
+                    process.start()
+                    process.join()
+                    assert process.exitcode == 0
+        """
+    )
+
+    result = pytester.runpytest("--memray", "--memray-follow-children")
+
+    # Starting processes with spawn also starts multiprocessing's resource
+    # tracker, which is followed too.
+    if processes == "sum":
+        assert result.ret == ExitCode.TESTS_FAILED
+        result.stdout.fnmatch_lines(
+            [
+                "*Test was limited to 40.0MiB but allocated * across * processes",
+                "*Per-process breakdown:",
+                "*- test process: *",
+                "*- child process *: 2?.?MiB",
+                "*- child process *: 2?.?MiB",
+            ]
+        )
+    else:
+        assert result.ret == ExitCode.OK
+    result.stdout.fnmatch_lines(
+        ["*Peak memory of * child process(es): *", "*- pid * -> 2?.?MiB"]
+    )
+
+
+def test_follow_children_max_names_the_largest_process(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import subprocess
+        import sys
+        import pytest
+
+        @pytest.mark.limit_memory("16MB", processes="max")
+        def test_children():
+            subprocess.run(
+                [sys.executable, "-c", "data = b'x' * (24 * 1024 * 1024)"],
+                check=True,
+            )
+        """
+    )
+
+    result = pytester.runpytest("--memray", "--memray-follow-children")
+
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.stdout.fnmatch_lines(
+        [
+            "*Test was limited to 16.0MiB per process but child process * "
+            "allocated 2?.?MiB"
+        ]
+    )
+
+
+def test_children_are_not_followed_by_default(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import subprocess
+        import sys
+        import pytest
+
+        @pytest.mark.limit_memory("16MB")
+        def test_children():
+            subprocess.run(
+                [sys.executable, "-c", "data = b'x' * (24 * 1024 * 1024)"],
+                check=True,
+            )
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.OK
+    assert "child process" not in result.stdout.str()
+
+
+def test_limit_memory_rejects_unknown_processes(pytester: Pytester) -> None:
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.limit_memory("16MB", processes="mean")
+        def test_children():
+            pass
+        """
+    )
+
+    result = pytester.runpytest("--memray")
+
+    assert result.ret == ExitCode.INTERNAL_ERROR
+    assert "Unknown processes 'mean', expected one of" in result.stdout.str()
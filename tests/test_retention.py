@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import gc
+import sys
+from types import ModuleType
+from typing import Generator
+from typing import Iterator
+
+import pytest
+
+from pytest_memray.retention import find_retention_path
+from pytest_memray.retention import format_retention_path
+
+
+class Leaked:
+    pass
+
+
+@pytest.fixture
+def module() -> Iterator[ModuleType]:
+    module = ModuleType("leaky_module")
+    sys.modules[module.__name__] = module
+    yield module
+    del sys.modules[module.__name__]
+
+
+def _retention_path(targets: list[object]) -> str | None:
+    # The caller's reference is dropped, so that only the ones under test
+    # keep the object alive.
+    chain = find_retention_path(targets.pop(), ignored=[targets])
+    return format_retention_path(chain) if chain is not None else None
+
+
+def test_module_global(module: ModuleType) -> None:
+    module.registry = {"key": [Leaked()]}
+
+    path = _retention_path([module.registry["key"][0]])
+
+    assert path == "leaky_module.registry['key'][0]"
+
+
+def test_class_and_instance_attributes(module: ModuleType) -> None:
+    class Cache:
+        instances: list[object] = []
+
+        def __init__(self) -> None:
+            self.leaked = Leaked()
+
+    Cache.instances.append(Cache())
+    module.Cache = Cache
+
+    path = _retention_path([Cache.instances[0].leaked])
+
+    assert path is not None
+    assert path.endswith("Cache.instances[0].leaked")
+
+
+def test_suspended_generator(module: ModuleType) -> None:
+    def generator() -> Generator[None, None, None]:
+        leaked = Leaked()  # noqa: F841
+        yield
+
+    module.generator = generator()
+    next(module.generator)
+    frame = module.generator.gi_frame
+
+    path = _retention_path([frame.f_locals["leaked"]])
+    del frame
+
+    assert path == "leaky_module.generator.gi_frame.f_locals['leaked']"
+
+
+def test_frame_of_a_traceback(module: ModuleType) -> None:
+    def failing() -> None:
+        leaked = Leaked()  # noqa: F841
+        raise ValueError
+
+    try:
+        failing()
+    except ValueError as exc:
+        module.error = exc
+    frame = module.error.__traceback__.tb_next.tb_frame
+
+    path = _retention_path([frame.f_locals["leaked"]])
+    del frame
+
+    assert path is not None
+    assert path.startswith("<frame of failing at ")
+    assert path.endswith(".f_locals['leaked']")
+
+
+def test_unreachable_object() -> None:
+    assert _retention_path([Leaked()]) is None
+
+
+def test_caller_frames_are_ignored() -> None:
+    leaked = Leaked()
+
+    assert find_retention_path(leaked) is None
+
+
+def test_heap_is_scanned_once_per_level(
+    module: ModuleType, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    leaked = Leaked()
+    chain: object = leaked
+    for _ in range(5):
+        chain = [chain, [Leaked() for _ in range(20)]]
+    module.chain = chain
+    del chain
+    scans = []
+    get_referrers = gc.get_referrers
+
+    def counting_get_referrers(*objs: object) -> list[object]:
+        scans.append(len(objs))
+        return get_referrers(*objs)
+
+    monkeypatch.setattr(gc, "get_referrers", counting_get_referrers)
+
+    path = _retention_path([leaked])
+
+    assert path == "leaky_module.chain[0][0][0][0][0]"
+    assert len(scans) == 6
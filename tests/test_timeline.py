@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+import os
+import resource
+import time
+from pathlib import Path
+
+from pytest_memray.timeline import ResidentMemory
+from pytest_memray.timeline import Timeline
+from pytest_memray.timeline import TimelineRecorder
+from pytest_memray.timeline import read_timelines
+from pytest_memray.timeline import write_timelines
+
+
+def test_test_at() -> None:
+    timeline = Timeline(
+        1.0, [1, 2, 3], [0.0, 1.0, 2.0], [(0.5, "test_a"), (1.5, "test_b")]
+    )
+
+    assert timeline.test_at(0.1) is None
+    assert timeline.test_at(0.5) == "test_a"
+    assert timeline.test_at(1.0) == "test_a"
+    assert timeline.test_at(2.0) == "test_b"
+
+
+def test_peak() -> None:
+    timeline = Timeline(0.5, [10, 30, 20, 30], [0.0, 0.6, 1.0, 1.5], [])
+
+    assert timeline.peak() == (30, 0.6)
+
+
+def test_chart_keeps_the_peak_of_each_stretch() -> None:
+    samples = [0, 8, 0, 0, 4, 0, 7, 7]
+    timeline = Timeline(1.0, samples, [float(i) for i in range(8)], [])
+
+    assert timeline.chart(4) == "█▁▄▇"
+    assert timeline.chart(100) == "▁█▁▁▄▁▇▇"
+
+
+def test_recorder_halves_its_samples_when_full() -> None:
+    recorder = TimelineRecorder(0.001, capacity=8)
+    recorder.start()
+    recorder.mark_test("test_a")
+    time.sleep(0.1)
+
+    timeline = recorder.stop()
+
+    assert 4 <= len(timeline.samples) <= 8
+    assert timeline.interval > 0.001
+    assert all(sample > 0 for sample in timeline.samples)
+    assert timeline.times == sorted(timeline.times)
+    assert timeline.tests[0][1] == "test_a"
+
+
+def test_resident_memory() -> None:
+    resident_memory = ResidentMemory()
+    with open("/proc/self/statm", "rb") as statm:
+        expected = int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    assert abs(resident_memory() - expected) < 16 * 1024 * 1024
+    resident_memory.close()
+
+
+def test_recorder_records_the_peak_while_paused() -> None:
+    # Go above the peak of the process so far, or it wouldn't tell anything.
+    size = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    recorder = TimelineRecorder(0.001)
+    recorder.start()
+    with recorder.paused():
+        data = b"x" * size
+        del data
+    timeline = recorder.stop()
+
+    peak, _ = timeline.peak()
+    assert peak > size
+
+
+def test_recorder_leaves_the_peak_of_the_process_alone() -> None:
+    data = b"x" * (64 * 1024 * 1024)
+    del data
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    recorder = TimelineRecorder(0.001)
+    recorder.start()
+    with recorder.paused():
+        pass
+    recorder.stop()
+
+    assert resource.getrusage(resource.RUSAGE_SELF).ru_maxrss >= before
+
+
+def test_write_and_read_timelines(tmp_path: Path) -> None:
+    timelines = {
+        "gw0": Timeline(0.1, [1, 2], [0.0, 0.1], [(0.0, "test_a")]),
+        "gw1": Timeline(0.2, [3], [0.0], []),
+    }
+
+    write_timelines(timelines, tmp_path / "timeline.json")
+
+    assert read_timelines(tmp_path / "timeline.json") == timelines
@@ -15,6 +15,7 @@ import pytest
 
 from pytest_memray.utils import WriteEnabledDirectoryAction
 from pytest_memray.utils import parse_memory_string
+from pytest_memray.utils import parse_rate_string
 from pytest_memray.plugin import cli_hist
 
 
@@ -67,6 +68,26 @@ def test_parse_incorrect_memory_string(the_str: str) -> None:
         parse_memory_string(the_str)
 
 
+@pytest.mark.parametrize(
+    "the_str, expected",
+    [
+        ("60 B/min", 1),
+        ("1MB/s", 1024**2),
+        ("1 MB / sec", 1024**2),
+        ("3.6KB/hour", 3.6 * 1024 / 3600),
+        ("120b/M", 2),
+    ],
+)
+def test_parse_rate_string(the_str: str, expected: float) -> None:
+    assert parse_rate_string(the_str) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("the_str", ["1MB", "1MB/day", "1/min", "MB/min"])
+def test_parse_incorrect_rate_string(the_str: str) -> None:
+    with pytest.raises(ValueError):
+        parse_rate_string(the_str)
+
+
 WDirCheck = Callable[[Path], Namespace]
 
 